@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_gateway.settings')
+# Bajo ASGI las rutas proxy usan la vista asíncrona con respuestas en streaming
+os.environ.setdefault('GATEWAY_ASYNC_PROXY', '1')
 
 application = get_asgi_application()
@@ -14,6 +14,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,16 +49,25 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para medir también el tiempo del resto de middlewares
+    'gateway_app.middleware.MetricsMiddleware',
+    # Antes que el resto para comprimir la respuesta final (ver GATEWAY_COMPRESSION)
+    'gateway_app.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Versiones "lean": se omiten en las rutas proxy (ver GATEWAY_LEAN_PROXY)
+    'gateway_app.middleware.LeanSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'gateway_app.middleware.LeanCsrfViewMiddleware',
+    'gateway_app.middleware.LeanAuthenticationMiddleware',
+    'gateway_app.middleware.LeanMessageMiddleware',
+    'gateway_app.middleware.LeanXFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# Las rutas proxy (/api/<servicio>/...) omiten sesiones, CSRF, autenticación de Django, mensajes y
+# X-Frame-Options: la API es JSON sin estado con JWT. El admin y el resto de rutas usan la pila completa
+GATEWAY_LEAN_PROXY = True
+
 ROOT_URLCONF = 'api_gateway.urls'
 
 TEMPLATES = [
@@ -92,6 +103,15 @@ DATABASES = {
     }
 }
 
+# Autenticación sin estado: request.user se construye con los claims del JWT, sin consultar la base de datos
+GATEWAY_STATELESS_AUTH = os.environ.get('GATEWAY_STATELESS_AUTH', '1') == '1'
+
+# Con autenticación sin estado el gateway puede funcionar sin base de datos (el admin queda desactivado)
+GATEWAY_NO_DATABASE = GATEWAY_STATELESS_AUTH and os.environ.get('GATEWAY_NO_DATABASE', '0') == '1'
+if GATEWAY_NO_DATABASE:
+    DATABASES = {}
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -139,18 +159,239 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'gateway_app.authentication.StatelessJWTAuthentication'
+        if GATEWAY_STATELESS_AUTH else
+        'gateway_app.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Caché de tokens JWT ya verificados (evita repetir la firma y la consulta del usuario)
+GATEWAY_AUTH_CACHE = {
+    'ENABLED': True,
+    'TTL': 300,
+    'MAX_ENTRIES': 10000,
+}
+
+# El login se reenvía al servicio de usuarios por el cliente compartido. Con LOCAL_REFRESH el refresh se
+# resuelve en el gateway con la clave compartida y los refresh tokens rotados van a la denylist (caché
+# DENYLIST_CACHE). Los refresh del mismo token en curso se resuelven una sola vez y su respuesta se
+# reutiliza durante REFRESH_CACHE_TTL
+GATEWAY_TOKENS = {
+    'COALESCE_LOGIN': True,
+    'REFRESH_CACHE_TTL': 10,
+    'MAX_ENTRIES': 10000,
+    'LOCAL_REFRESH': True,
+    'DENYLIST': True,
+    'DENYLIST_CACHE': 'denylist',
+}
+if GATEWAY_NO_DATABASE:
+    # Sin base de datos no hay denylist compartida: el refresh vuelve a resolverlo el servicio de usuarios
+    GATEWAY_TOKENS['LOCAL_REFRESH'] = False
+
+# La denylist de refresh tokens tiene que ser común a todos los procesos y réplicas del gateway, así que
+# vive en la base de datos (tabla creada con manage.py createcachetable) y no en la memoria de cada proceso
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'denylist': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'gateway_jwt_denylist',
+    },
+}
+
+# Clave de firma de los JWT, compartida por el gateway y todos los servicios: así el gateway
+# puede verificar y refrescar localmente los tokens emitidos por el servicio de usuarios.
+# Se lee siempre de JWT_SIGNING_KEY; en DEBUG, si falta, todos los servicios usan la misma clave
+# de desarrollo para que un `docker compose up` sin variables funcione
+JWT_SIGNING_KEY = os.environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured('La variable de entorno JWT_SIGNING_KEY es obligatoria con DEBUG desactivado')
+    JWT_SIGNING_KEY = 'django-insecure-jwt-desarrollo-compartida-0b7f3c9e1d54a2f86c3e9b17d04a5f2e'
+
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
+    # Igual que el servicio de usuarios: los access tokens que el gateway emite al refrescar
+    # localmente no deben durar más que los que emite el propio servicio
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'ROTATE_REFRESH_TOKENS': True,
+    'SIGNING_KEY': JWT_SIGNING_KEY,
+}
+
+# /api/gateway/stats/ y /metrics solo responden a usuarios staff o a quien envíe la cabecera
+# X-Gateway-Token con este valor (p. ej. Prometheus). Sin valor, solo a usuarios staff
+GATEWAY_OPERATOR_TOKEN = os.environ.get('GATEWAY_OPERATOR_TOKEN')
+
+# Políticas de las rutas proxy. Cada servicio de SERVICES se publica en /api/<servicio>/ y requiere
+# autenticación salvo que una entrada lo cambie; gana la entrada con el prefijo más largo que admita el método.
+# CACHE (opcional) decide si los GET de la ruta pasan por GATEWAY_CACHE.
+GATEWAY_ROUTES = [
+    # Registro de usuarios
+    {'SERVICE': 'usuarios', 'METHODS': ['POST'], 'AUTH': 'public'},
+    # Catálogo de productos
+    {'SERVICE': 'productos', 'METHODS': ['GET'], 'AUTH': 'public', 'CACHE': True},
+    # Reserva y liberación de stock: solo las llama el servicio de órdenes, directamente
+    {'SERVICE': 'productos', 'PREFIX': 'productos/reservar', 'AUTH': 'internal'},
+    {'SERVICE': 'productos', 'PREFIX': 'productos/liberar', 'AUTH': 'internal'},
+]
+
+# Proxy asíncrono: se activa al servir el gateway con api_gateway.asgi (uvicorn, daphne...)
+GATEWAY_ASYNC_PROXY = os.environ.get('GATEWAY_ASYNC_PROXY', '0') == '1'
+
+# Reenviar las respuestas de los servicios sin parsearlas ni volver a serializarlas
+GATEWAY_PASSTHROUGH = True
+# Con passthrough activo, transmitir el cuerpo por bloques en lugar de cargarlo completo
+GATEWAY_STREAM_RESPONSES = False
+
+# Agrupar GET idénticos en curso (mismo método, URL y token) en una sola llamada al servicio
+GATEWAY_COALESCE_GETS = True
+
+# Caché de respuestas GET públicas (catálogo de productos)
+GATEWAY_CACHE = {
+    'ENABLED': True,
+    'SERVICES': ['productos'],
+    'TTL': 30,
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 50 * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 1024 * 1024,
+}
+
+# Vistas compuestas (/api/resumen/...): hilos compartidos para las llamadas en paralelo a los servicios
+GATEWAY_AGGREGATION = {
+    'MAX_WORKERS': 16,
+}
+
+# Lotes de subsolicitudes (/api/batch/); se ejecutan en los hilos de GATEWAY_AGGREGATION
+GATEWAY_BATCH = {
+    'MAX_REQUESTS': 20,
+    'MAX_PARALLEL': 8,
+}
+
+# Duplicar los GET lentos en otro backend y quedarse con la primera respuesta (solo con varias instancias)
+GATEWAY_HEDGING = {
+    'ENABLED': True,
+    'SERVICES': ['productos', 'usuarios'],
+    'PERCENTILE': 95,
+    'MIN_DELAY': 0.01,
+    'MAX_RATE': 0.1,
+}
+
+# Reintentos con espera exponencial y jitter para métodos idempotentes ante errores de conexión,
+# limitados por un presupuesto por servicio (proporción del tráfico) para no agravar una caída
+GATEWAY_RETRY = {
+    'ENABLED': True,
+    'METHODS': ['GET', 'PUT', 'DELETE'],
+    'MAX_ATTEMPTS': 3,
+    'BASE_DELAY': 0.05,
+    'MAX_DELAY': 1.0,
+    'BUDGET_RATIO': 0.2,
+    'BUDGET_RESERVE': 10,
+}
+
+# Compresión de respuestas con brotli (si está instalado) o gzip según el Accept-Encoding del cliente.
+# Con UPSTREAM se piden los cuerpos comprimidos a los servicios y se reenvían sin recomprimir
+GATEWAY_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'CONTENT_TYPES': ['application/json', 'text/'],
+    'UPSTREAM': True,
+}
+
+# Control de admisión: límite adaptativo (AIMD) de llamadas simultáneas a cada servicio con una cola
+# de espera acotada. Lo que no cabe recibe un 503 inmediato con Retry-After. Limitar ordenes acota
+# también las validaciones que ordenes hace contra usuarios y productos durante un pico de pedidos
+GATEWAY_ADMISSION = {
+    'ENABLED': True,
+    'INITIAL_LIMIT': 20,
+    'MIN_LIMIT': 2,
+    'MAX_LIMIT': 200,
+    'SLOW_CALL_DURATION': 1.0,
+    'BACKOFF_RATIO': 0.9,
+    'QUEUE_SIZE': 50,
+    'QUEUE_TIMEOUT': 0.5,
+    'RETRY_AFTER': 1,
+    'SERVICES': {
+        'ordenes': {'MAX_LIMIT': 50},
+    },
+}
+
+# Circuit breaker por servicio: corta las llamadas a un servicio caído o lento y responde 503
+GATEWAY_CIRCUIT_BREAKER = {
+    'ENABLED': True,
+    'WINDOW': 20,
+    'MIN_CALLS': 10,
+    'ERROR_RATE': 0.5,
+    'SLOW_CALL_DURATION': 3.0,
+    'SLOW_CALL_RATE': 0.8,
+    'OPEN_TIMEOUT': 30,
+    'HALF_OPEN_CALLS': 1,
+}
+
+# Registro de acceso del proxy: una línea JSON por solicitud, con muestreo
+GATEWAY_ACCESS_LOG = {
+    'SAMPLE_RATE': 0.1,
+    'ERROR_SAMPLE_RATE': 1.0,
+    'SLOW_THRESHOLD': 1.0,
+    'CAPTURE_BODY': False,
+    'BODY_MAX_CHARS': 500,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'gateway_app.access_log.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'access': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'gateway_app.access': {
+            'handlers': ['access'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 # Configuración de servicios
+# Cada servicio acepta una URL o un diccionario con la URL y la configuración de su pool de conexiones.
+# Para escalar un servicio horizontalmente se usa 'URLS' con todas sus instancias: el gateway
+# las balancea con 'BALANCER' (round_robin, least_outstanding o ewma) y saca de la rotación
+# las que fallan el health check (GET a 'HEALTH_CHECK_PATH' cada 'HEALTH_CHECK_INTERVAL' segundos)
 SERVICES = {
-    'USUARIOS': 'http://usuarios-service:8000/api/',  # Asegúrate que termine con /
-    'PRODUCTOS': 'http://productos-service:8000/api/',
-    'ORDENES': 'http://ordenes-service:8000/api/',
-}
\ No newline at end of file
+    'USUARIOS': {
+        'URL': 'http://usuarios-service:8000/api/',  # Asegúrate que termine con /
+        'POOL_SIZE': 10,
+        'KEEP_ALIVE': True,
+        'IDLE_TIMEOUT': 30,
+        'TIMEOUT': 10,
+    },
+    'PRODUCTOS': {
+        'URLS': [
+            'http://productos-service:8000/api/',
+        ],
+        'BALANCER': 'ewma',
+        'HEALTH_CHECK_PATH': '',
+        'HEALTH_CHECK_INTERVAL': 5,
+        'POOL_SIZE': 20,
+        'KEEP_ALIVE': True,
+        'IDLE_TIMEOUT': 30,
+        'TIMEOUT': 10,
+    },
+    'ORDENES': {
+        'URL': 'http://ordenes-service:8000/api/',
+        'POOL_SIZE': 10,
+        'KEEP_ALIVE': True,
+        'IDLE_TIMEOUT': 30,
+        'TIMEOUT': 10,
+    },
+}
@@ -14,21 +14,38 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, re_path
-from gateway_app.views import LoginView, RefreshTokenView, ProxyView
+from django.urls import path
+from gateway_app.routing import ServiceRoutePattern
+from gateway_app.views import (
+    LoginView, RefreshTokenView, ProxyView, GatewayStatsView, OrderSummaryView, BatchView, MetricsView,
+    async_proxy_view,
+)
+
+proxy_view = async_proxy_view if settings.GATEWAY_ASYNC_PROXY else ProxyView.as_view()
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    # Rutas proxy para microservicios: servicios y políticas salen de SERVICES y GATEWAY_ROUTES.
+    # Van primero porque son el grueso del tráfico y la tabla solo reconoce servicios configurados
+    path('api/', proxy_view, name='proxy', Pattern=ServiceRoutePattern),
 
     # Rutas de autenticación
     path('api/token/', LoginView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', RefreshTokenView.as_view(), name='token_refresh'),
 
+    # Estado interno del gateway
+    path('api/gateway/stats/', GatewayStatsView.as_view(), name='gateway_stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+
+    # Vistas compuestas: varias llamadas a los servicios en una sola solicitud
+    path('api/resumen/ordenes/<int:orden_id>/', OrderSummaryView.as_view(), name='order_summary'),
+    path('api/batch/', BatchView.as_view(), name='batch'),
+
     # URL para API root
     path('api/', ProxyView.as_view(), name='api-root'),
+]
 
-    # Rutas proxy para microservicios
-    re_path(r'^api/(?P<service>usuarios|productos|ordenes)/?(?P<path>.*)?$',
-            ProxyView.as_view(), name='proxy'),
-]
\ No newline at end of file
+# El admin necesita la base de datos del gateway
+if not settings.GATEWAY_NO_DATABASE:
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
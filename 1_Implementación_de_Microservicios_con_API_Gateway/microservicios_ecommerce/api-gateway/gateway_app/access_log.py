@@ -0,0 +1,89 @@
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger('gateway_app.access')
+
+DEFAULTS = {
+    'SAMPLE_RATE': 1.0,         # Proporción de solicitudes correctas que se registran
+    'ERROR_SAMPLE_RATE': 1.0,   # Proporción de respuestas 4xx/5xx que se registran
+    'SLOW_THRESHOLD': 1.0,      # Las solicitudes más lentas (segundos) se registran siempre
+    'CAPTURE_BODY': False,      # Incluir cuerpos de solicitud y respuesta (solo para depurar)
+    'BODY_MAX_CHARS': 500,
+}
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULTS, **getattr(settings, 'GATEWAY_ACCESS_LOG', {})}
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_config(setting, **kwargs):
+    global _config
+    if setting == 'GATEWAY_ACCESS_LOG':
+        _config = None
+
+
+def _sampled(status_code, duration, config):
+    if duration >= config['SLOW_THRESHOLD']:
+        return True
+    rate = config['ERROR_SAMPLE_RATE'] if status_code >= 400 else config['SAMPLE_RATE']
+    return rate >= 1 or random.random() < rate
+
+
+def log_access(service, method, path, status_code, duration, trace, request_body=None, response_body=None):
+    """
+    Registra una línea por solicitud proxy. Nada se formatea si el logger está desactivado
+    o si la solicitud queda fuera del muestreo; los cuerpos se pasan como funciones y
+    solo se evalúan con CAPTURE_BODY activo.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    config = get_config()
+    if not _sampled(status_code, duration, config):
+        return
+
+    fields = {
+        'service': service,
+        'method': method.upper(),
+        'path': path,
+        'status': status_code,
+        'duration_ms': round(duration * 1000, 3),
+        **trace,
+    }
+    if config['CAPTURE_BODY']:
+        limit = config['BODY_MAX_CHARS']
+        if request_body is not None:
+            fields['request_body'] = request_body()[:limit]
+        if response_body is not None:
+            fields['response_body'] = response_body()[:limit]
+
+    logger.info(
+        '%s %s/%s %s %.1fms', fields['method'], service, path, status_code, fields['duration_ms'],
+        extra={'access': fields}
+    )
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea los registros de acceso como una línea JSON"""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+        }
+        access = getattr(record, 'access', None)
+        if access is not None:
+            payload.update(access)
+        else:
+            payload['message'] = record.getMessage()
+        return json.dumps(payload, default=str)
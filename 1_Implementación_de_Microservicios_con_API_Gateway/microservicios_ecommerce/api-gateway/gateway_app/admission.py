@@ -0,0 +1,222 @@
+import asyncio
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import admission_limit, admission_queue_depth, admission_shed
+
+DEFAULTS = {
+    'ENABLED': True,
+    'INITIAL_LIMIT': 20,    # Llamadas simultáneas permitidas al arrancar
+    'MIN_LIMIT': 2,
+    'MAX_LIMIT': 200,
+    'SLOW_CALL_DURATION': 1.0,  # Una llamada más lenta cuenta como congestión, igual que un error
+    'BACKOFF_RATIO': 0.9,   # Ante congestión el límite se multiplica por este factor
+    'QUEUE_SIZE': 50,       # Solicitudes que pueden esperar un hueco; el resto se rechaza al momento
+    'QUEUE_TIMEOUT': 0.5,   # Segundos máximos de espera en la cola
+    'RETRY_AFTER': 1,       # Valor del header Retry-After de los 503 por sobrecarga
+    'SERVICES': {},         # Ajustes por servicio, p. ej. {'ordenes': {'MAX_LIMIT': 20}}
+}
+
+
+class ServiceOverloaded(Exception):
+    """El servicio está al límite de llamadas simultáneas y la cola de espera no admite más"""
+
+    def __init__(self, service, retry_after):
+        super().__init__(f"Servicio {service} saturado")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class _AsyncWaiter:
+    """Espera de una corrutina; release() la despierta desde cualquier hilo"""
+    __slots__ = ('loop', 'future', 'granted')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+    def set(self):
+        self.granted = True
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def is_set(self):
+        return self.granted
+
+
+class ConcurrencyLimiter:
+    """
+    Límite adaptativo (AIMD) de llamadas simultáneas a un servicio. Cada llamada rápida y sin
+    error sube el límite en 1/límite (≈ +1 por ronda); un error o una llamada lenta lo
+    multiplica por BACKOFF_RATIO. Lo que no cabe espera en una cola acotada, y lo que no
+    cabe en la cola se rechaza para que el cliente reciba un 503 inmediato
+    """
+
+    def __init__(self, name, initial_limit, min_limit, max_limit, slow_call_duration, backoff_ratio,
+                 queue_size, queue_timeout, retry_after):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.slow_call_duration = slow_call_duration
+        self.backoff_ratio = backoff_ratio
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        admission_limit.set(int(self.limit), service=name)
+
+    def acquire(self, timeout=None):
+        """Ocupa un hueco, esperando como mucho timeout segundos; False si la solicitud se descarta"""
+        with self._lock:
+            if self._try_acquire():
+                return True
+            if not self._can_queue():
+                return False
+            waiter = threading.Event()
+            self._enqueue(waiter)
+        waiter.wait(self.queue_timeout if timeout is None else timeout)
+        return self._dequeue(waiter)
+
+    async def acquire_async(self, timeout=None):
+        """Versión para el event loop: la espera no bloquea el hilo"""
+        with self._lock:
+            if self._try_acquire():
+                return True
+            if not self._can_queue():
+                return False
+            waiter = _AsyncWaiter(asyncio.get_running_loop())
+            self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # El hueco que se llegase a conceder vuelve al siguiente de la cola
+            if self._dequeue(waiter):
+                self.release(None)
+            raise
+        return self._dequeue(waiter)
+
+    def release(self, duration, error=False):
+        """
+        Libera el hueco de una llamada y ajusta el límite con su resultado.
+        duration None libera sin ajustar (la llamada no llegó a hacerse)
+        """
+        with self._lock:
+            in_use = self.in_flight
+            self.in_flight -= 1
+            if duration is not None:
+                if error or duration > self.slow_call_duration:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                elif in_use * 2 >= self.limit:
+                    # Solo crece si el límite se está usando; con poca carga no hay nada que medir
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            # El hueco pasa directamente a quien espera, sin competir con las solicitudes nuevas
+            while self._waiters and self.in_flight < int(self.limit):
+                self._waiters.popleft().set()
+                self.in_flight += 1
+                self.admitted += 1
+            admission_limit.set(int(self.limit), service=self.name)
+            admission_queue_depth.set(len(self._waiters), service=self.name)
+
+    def _try_acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def _can_queue(self):
+        if len(self._waiters) >= self.queue_size:
+            self.shed += 1
+            admission_shed.inc(service=self.name, reason='queue_full')
+            return False
+        return True
+
+    def _enqueue(self, waiter):
+        self._waiters.append(waiter)
+        admission_queue_depth.set(len(self._waiters), service=self.name)
+
+    def _dequeue(self, waiter):
+        """Tras la espera: True si release() le cedió un hueco, False si se agotó el tiempo"""
+        with self._lock:
+            if waiter.is_set():
+                return True
+            self._waiters.remove(waiter)
+            self.shed += 1
+            admission_shed.inc(service=self.name, reason='timeout')
+            admission_queue_depth.set(len(self._waiters), service=self.name)
+            return False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queued': len(self._waiters),
+                'admitted': self.admitted,
+                'shed': self.shed,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_config(service):
+    config = {**DEFAULTS, **getattr(settings, 'GATEWAY_ADMISSION', {})}
+    return {**config, **config['SERVICES'].get(service, {})}
+
+
+def get_limiter(service):
+    """Devuelve el limitador de un servicio, o None si el control de admisión está desactivado"""
+    name = service.lower()
+    limiter = _limiters.get(name)
+    if limiter is None:
+        config = get_config(name)
+        if not config['ENABLED']:
+            return None
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = _limiters[name] = ConcurrencyLimiter(
+                    name,
+                    initial_limit=config['INITIAL_LIMIT'],
+                    min_limit=config['MIN_LIMIT'],
+                    max_limit=config['MAX_LIMIT'],
+                    slow_call_duration=config['SLOW_CALL_DURATION'],
+                    backoff_ratio=config['BACKOFF_RATIO'],
+                    queue_size=config['QUEUE_SIZE'],
+                    queue_timeout=config['QUEUE_TIMEOUT'],
+                    retry_after=config['RETRY_AFTER'],
+                )
+    return limiter
+
+
+def admission_stats():
+    return {name: limiter.snapshot() for name, limiter in list(_limiters.items())}
+
+
+def reset_limiters():
+    with _limiters_lock:
+        _limiters.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_config_change(setting, **kwargs):
+    if setting == 'GATEWAY_ADMISSION':
+        reset_limiters()
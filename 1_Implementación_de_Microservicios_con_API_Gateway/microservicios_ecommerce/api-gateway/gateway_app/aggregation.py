@@ -0,0 +1,156 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import QueryDict
+
+from .admission import ServiceOverloaded
+from .breaker import get_breaker
+from .cache import get_response_cache
+from .hedging import get_hedger
+from .proxy import ServiceProxy
+from .upstream import get_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_WORKERS': 16,      # Llamadas simultáneas a los servicios entre todas las agregaciones
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = {**DEFAULTS, **getattr(settings, 'GATEWAY_AGGREGATION', {})}
+                _executor = ThreadPoolExecutor(
+                    max_workers=config['MAX_WORKERS'], thread_name_prefix='gateway-aggregation'
+                )
+    return _executor
+
+
+@receiver(setting_changed)
+def _reset_executor(setting, **kwargs):
+    global _executor
+    if setting == 'GATEWAY_AGGREGATION' and _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+class UpstreamError(Exception):
+    """Una llamada de la agregación no devolvió un documento utilizable"""
+
+    def __init__(self, service, status_code, detail):
+        super().__init__(detail)
+        self.service = service
+        self.status_code = status_code
+        self.detail = detail
+
+
+def fetch_json(service, path, authorization):
+    """
+    GET a un servicio a través del mismo cliente, balanceador y circuit breaker que el proxy.
+    Las respuestas públicas de la caché se usan sin consultar al servicio
+    """
+    cache = get_response_cache()
+    if cache is not None and cache.applies_to(service, 'get'):
+        entry, fresh = cache.get_fresh(cache.make_key(service, path, QueryDict()))
+        if fresh and entry.status == 200:
+            return json.loads(entry.body)
+
+    client = get_client(service)
+    if client is None:
+        raise UpstreamError(service, 502, f"Servicio '{service}' no configurado")
+
+    breaker = get_breaker(service)
+    if breaker is not None and not breaker.allow_request():
+        raise UpstreamError(service, 503, f"Servicio {service} no disponible temporalmente")
+
+    headers = {'Content-Type': 'application/json'}
+    if authorization:
+        headers['Authorization'] = authorization
+
+    try:
+        response = ServiceProxy.send(client, breaker, 'get', path, {}, hedger=get_hedger(service), headers=headers)
+    except ServiceOverloaded:
+        raise UpstreamError(service, 503, f"Servicio {service} saturado")
+    except requests.RequestException as e:
+        logger.error("Error al comunicarse con el servicio %s: %s", service, e)
+        raise UpstreamError(service, 502, f"Error al comunicarse con el servicio {service}")
+
+    if response.status_code != 200:
+        raise UpstreamError(service, response.status_code, response.text[:200])
+    try:
+        return response.json()
+    except ValueError:
+        raise UpstreamError(service, 502, "Respuesta no válida del servicio")
+
+
+def _result(future):
+    try:
+        return future.result(), None
+    except UpstreamError as e:
+        return None, {"status": e.status_code, "detail": e.detail}
+
+
+def order_summary(orden_id, authorization):
+    """
+    Compone una orden con sus productos y el usuario. La orden y el usuario se piden a la vez;
+    en cuanto llega la orden se piden todos sus productos en paralelo.
+    Devuelve (documento, status). Si falla la orden se propaga su error; si falla un producto,
+    el usuario o una línea no trae producto_id, el documento sale igualmente, con el detalle en 'errores'.
+    """
+    executor = get_executor()
+    usuario_future = executor.submit(fetch_json, 'usuarios', 'usuarios/me/', authorization)
+    orden_future = executor.submit(fetch_json, 'ordenes', f"ordenes/{orden_id}/", authorization)
+
+    orden, error = _result(orden_future)
+    if error is not None:
+        usuario_future.cancel()
+        return {"error": "No se pudo obtener la orden", "detail": error["detail"]}, error["status"]
+
+    errores = {}
+    lineas = []
+    for index, detalle in enumerate(orden.get('detalles') or []):
+        producto_id = detalle.get('producto_id') if isinstance(detalle, dict) else None
+        if not isinstance(producto_id, int) or isinstance(producto_id, bool):
+            # Línea mal formada: se informa en 'errores' sin romper el resto del resumen
+            errores[f"detalle:{index}"] = {"status": 502, "detail": "Línea de la orden sin producto_id válido"}
+            producto_id = None
+        lineas.append((detalle, producto_id))
+
+    producto_ids = dict.fromkeys(producto_id for _, producto_id in lineas if producto_id is not None)
+    producto_futures = {
+        producto_id: executor.submit(fetch_json, 'productos', f"productos/{producto_id}/", authorization)
+        for producto_id in producto_ids
+    }
+
+    productos = {}
+    for producto_id, future in producto_futures.items():
+        productos[producto_id], error = _result(future)
+        if error is not None:
+            errores[f"producto:{producto_id}"] = error
+
+    usuario, error = _result(usuario_future)
+    if error is not None:
+        errores["usuario"] = error
+
+    document = {
+        **orden,
+        "detalles": [
+            {**detalle, "producto": productos.get(producto_id)} if isinstance(detalle, dict) else detalle
+            for detalle, producto_id in lineas
+        ],
+        "usuario": usuario,
+        "errores": errores,
+    }
+    return document, 200
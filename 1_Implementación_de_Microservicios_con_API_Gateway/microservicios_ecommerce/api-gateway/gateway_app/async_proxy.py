@@ -0,0 +1,406 @@
+import asyncio
+import logging
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import status
+
+from .access_log import log_access
+from .admission import ServiceOverloaded, get_limiter
+from .breaker import get_breaker
+from .cache import get_response_cache
+from .coalescing import async_singleflight, make_key
+from .compression import mark_encoded, upstream_encodings
+from .hedging import get_hedger
+from .metrics import compressed_responses, hedge_wins, hedged_requests, proxy_phase_duration, upstream_duration, upstream_in_flight
+from .retry import get_retry_budget, should_retry
+from .routing import get_routing_table
+from .upstream import get_client, get_service_config
+
+logger = logging.getLogger(__name__)
+
+# Errores en los que la conexión se rechazó o se cortó: se pueden reintentar en métodos idempotentes
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+# Los clientes httpx están ligados al event loop que los creó
+_clients_by_loop = weakref.WeakKeyDictionary()
+
+
+def get_async_client(service):
+    """Devuelve el cliente asíncrono compartido de un servicio para el event loop actual"""
+    config = get_service_config(service)
+    if config is None:
+        return None
+
+    clients = _clients_by_loop.setdefault(asyncio.get_running_loop(), {})
+    name = service.upper()
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config['POOL_SIZE'],
+                max_keepalive_connections=config['POOL_SIZE'] if config['KEEP_ALIVE'] else 0,
+                keepalive_expiry=config['IDLE_TIMEOUT'],
+            ),
+            timeout=config['TIMEOUT'],
+        )
+    return client
+
+
+async def close_async_clients():
+    clients = _clients_by_loop.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+async def _relay(upstream, decode=True):
+    """Reenvía el cuerpo de la respuesta del servicio bloque a bloque (sin descomprimir con decode=False)"""
+    try:
+        chunks = upstream.aiter_bytes() if decode else upstream.aiter_raw()
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await upstream.aclose()
+
+
+class BufferedUpstream:
+    """Respuesta del servicio leída entera: se puede cachear y compartir entre solicitudes agrupadas"""
+    __slots__ = ('status_code', 'headers', 'content')
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+async def _read(upstream, keep_encoding=()):
+    """Lee el cuerpo completo; si viene en una codificación de keep_encoding no se descomprime"""
+    try:
+        if upstream.headers.get('content-encoding') in keep_encoding:
+            content = b''.join([chunk async for chunk in upstream.aiter_raw()])
+        else:
+            content = await upstream.aread()
+    finally:
+        await upstream.aclose()
+    return BufferedUpstream(upstream.status_code, upstream.headers, content)
+
+
+class AsyncServiceProxy:
+    @staticmethod
+    async def forward_request(service, path, request, route=None):
+        start = time.monotonic()
+        trace = {}
+        if route is None:
+            route = get_routing_table().match(service, path, request.method)
+        response = await AsyncServiceProxy._forward(service, path, request, trace, route)
+        duration = time.monotonic() - start
+        if not trace.get('coalesced'):
+            upstream = trace.get('upstream_ms', 0) / 1000
+            proxy_phase_duration.observe(max(0.0, duration - upstream), service=service, phase='gateway')
+        log_access(
+            service, request.method, path, response.status_code, duration, trace,
+            request_body=lambda: request.body.decode('utf-8', errors='replace'),
+            response_body=lambda: '<streaming>' if response.streaming else response.content.decode('utf-8', errors='replace'),
+        )
+        return response
+
+    @staticmethod
+    async def _forward(service, path, request, trace, route):
+        """
+        Mismo comportamiento que ServiceProxy._forward: caché de respuestas, GET agrupados,
+        llamadas duplicadas e invalidación de la caché en las escrituras. Lo que no se cachea
+        ni se comparte se transmite al cliente por bloques
+        """
+        client = get_async_client(service)
+        if client is None:
+            return JsonResponse(
+                {"error": f"Servicio '{service}' no configurado"},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+
+        # El balanceo (y el estado de salud de los backends) se comparte con el proxy síncrono
+        service_client = get_client(service)
+
+        method = request.method.lower()
+        if method not in ['get', 'post', 'put', 'patch', 'delete']:
+            return JsonResponse({"error": f"Método {method} no soportado"}, status=status.HTTP_400_BAD_REQUEST)
+
+        headers = {
+            'Content-Type': 'application/json',
+        }
+        if 'HTTP_AUTHORIZATION' in request.META:
+            headers['Authorization'] = request.META['HTTP_AUTHORIZATION']
+
+        params = None
+        content = None
+        if method == 'get':
+            params = [(key, value) for key, values in request.GET.lists() for value in values]
+        elif method in ['post', 'put', 'patch'] and request.body:
+            # El cuerpo se reenvía tal cual, sin parsearlo en el gateway
+            content = request.body
+            headers['Content-Type'] = request.META.get('CONTENT_TYPE') or 'application/json'
+
+        # La caché es la misma que usa el proxy síncrono
+        cache = get_response_cache()
+        cache_key = cache_entry = None
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if cache is not None and cache.applies_to(service, method, route.cache if route else None):
+            cache_key = cache.make_key(service, path, request.GET)
+            cache_entry, fresh = cache.get_fresh(cache_key)
+            if fresh:
+                trace['cache'] = 'HIT'
+                return cache.respond(cache_entry, 'HIT', request, if_none_match)
+            if cache_entry is not None and cache_entry.etag:
+                headers['If-None-Match'] = cache_entry.etag
+
+        breaker = get_breaker(service)
+        if breaker is not None and not breaker.allow_request():
+            trace['breaker'] = breaker.state
+            response = JsonResponse(
+                {"error": f"Servicio {service} no disponible temporalmente"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = str(breaker.retry_after())
+            return response
+
+        # Lo que se cachea o se comparte con otras solicitudes se lee entero; el resto se transmite
+        coalesce = (
+            method == 'get'
+            and getattr(settings, 'GATEWAY_COALESCE_GETS', True)
+            and not getattr(settings, 'GATEWAY_STREAM_RESPONSES', False)
+        )
+        buffered = cache_key is not None or coalesce
+        # Si el servicio comprime en una codificación que acepta el cliente, el cuerpo se reenvía tal cual;
+        # lo que se cachea se guarda sin comprimir
+        keep_encoding = upstream_encodings(request) if cache_key is None else ()
+        if keep_encoding:
+            headers['Accept-Encoding'] = ', '.join(keep_encoding)
+
+        async def fetch():
+            upstream = await AsyncServiceProxy.send(
+                client, service_client, breaker, method, path, trace,
+                hedger=get_hedger(service) if method == 'get' and buffered else None,
+                headers=headers, params=params, content=content
+            )
+            return await _read(upstream, keep_encoding) if buffered else upstream
+
+        try:
+            if coalesce:
+                key = make_key(
+                    method, f"{service_client.name}/{path}", request.GET,
+                    headers.get('Authorization'), headers.get('If-None-Match'), keep_encoding
+                )
+                upstream = await async_singleflight.do(key, fetch)
+                if 'backend' not in trace:
+                    # Otra solicitud idéntica hizo la llamada por esta
+                    trace['coalesced'] = True
+            else:
+                upstream = await fetch()
+        except ServiceOverloaded as e:
+            trace['shed'] = True
+            response = JsonResponse(
+                {"error": f"Servicio {service} saturado, inténtelo de nuevo más tarde"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = str(e.retry_after)
+            return response
+        except httpx.HTTPError as e:
+            trace['error'] = type(e).__name__
+            logger.error("Error al comunicarse con el servicio %s: %s", service, e)
+            return JsonResponse(
+                {"error": f"Error al comunicarse con el servicio {service}", "detail": str(e)},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+
+        if cache_key is not None:
+            if upstream.status_code == 304 and cache_entry is not None:
+                cache.revalidated(cache_entry)
+                trace['cache'] = 'REVALIDATED'
+                return cache.respond(cache_entry, 'REVALIDATED', request, if_none_match)
+            if upstream.status_code == 200:
+                entry = cache.store(
+                    cache_key,
+                    upstream.content,
+                    upstream.status_code,
+                    upstream.headers.get('content-type', 'application/json'),
+                    upstream.headers.get('etag')
+                )
+                if entry is not None:
+                    trace['cache'] = 'MISS'
+                    return cache.respond(entry, 'MISS', request, if_none_match)
+        elif method != 'get' and cache is not None and cache.applies_to(service, 'GET') and upstream.status_code < 400:
+            # Una escritura en el servicio invalida sus respuestas cacheadas
+            cache.invalidate(service)
+
+        encoding = upstream.headers.get('content-encoding')
+        encoded = encoding in keep_encoding
+        content_type = upstream.headers.get('content-type', 'application/json')
+        if buffered:
+            response = HttpResponse(upstream.content, status=upstream.status_code, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                _relay(upstream, decode=not encoded), status=upstream.status_code, content_type=content_type
+            )
+        if encoded:
+            compressed_responses.inc(encoding=encoding, source='upstream')
+            mark_encoded(response, encoding)
+        return response
+
+    @staticmethod
+    async def send(client, service_client, breaker, method, path, trace, hedger=None, **kwargs):
+        """
+        Llama a uno de los backends a través del límite de concurrencia del servicio.
+        Lanza ServiceOverloaded si el servicio está al límite de llamadas simultáneas
+        """
+        limiter = get_limiter(service_client.name)
+        if limiter is None:
+            return await AsyncServiceProxy._send(client, service_client, breaker, method, path, trace, hedger, **kwargs)
+
+        start = time.monotonic()
+        admitted = False
+        try:
+            admitted = await limiter.acquire_async()
+        finally:
+            # La llamada no sale: el turno de prueba del circuito semiabierto queda libre
+            if not admitted and breaker is not None:
+                breaker.release_probe()
+        if not admitted:
+            raise ServiceOverloaded(service_client.name.lower(), limiter.retry_after)
+        trace['queued_ms'] = round((time.monotonic() - start) * 1000, 3)
+
+        start = time.monotonic()
+        error = True
+        try:
+            upstream = await AsyncServiceProxy._send(
+                client, service_client, breaker, method, path, trace, hedger, **kwargs
+            )
+            error = upstream.status_code >= 500
+            return upstream
+        finally:
+            # El hueco se libera al recibir los headers; el cuerpo se lee o se transmite después
+            limiter.release(time.monotonic() - start, error)
+
+    @staticmethod
+    async def _send(client, service_client, breaker, method, path, trace, hedger=None, **kwargs):
+        """Los métodos idempotentes se reintentan mientras quede presupuesto; con hedger, una llamada lenta se duplica"""
+        if hedger is not None and len(service_client.balancer.backends) > 1:
+            delay = hedger.delay()
+            if delay is not None:
+                return await AsyncServiceProxy._send_hedged(
+                    client, service_client, breaker, method, path, trace, hedger, delay, **kwargs
+                )
+
+        service = service_client.name
+        budget = get_retry_budget(service)
+        if budget is not None:
+            budget.deposit()
+        tried = []
+        while True:
+            backend = service_client.balancer.choose(exclude=tried)
+            try:
+                return await AsyncServiceProxy._attempt(
+                    client, service_client, breaker, method, path, backend, trace, hedger, **kwargs
+                )
+            except RETRYABLE_ERRORS:
+                tried.append(backend)
+                if not should_retry(service, breaker, method, budget, len(tried)):
+                    raise
+                trace['retries'] = len(tried)
+                await asyncio.sleep(budget.backoff(len(tried)))
+
+    @staticmethod
+    async def _send_hedged(client, service_client, breaker, method, path, trace, hedger, delay, **kwargs):
+        """
+        Si el primer intento no ha respondido tras delay segundos se lanza otro en un backend
+        distinto. La solicitud se queda con la primera respuesta y el otro intento se cancela
+        """
+        service = service_client.name.lower()
+        first = service_client.balancer.choose()
+        traces = [{}, {}]
+        primary = asyncio.ensure_future(AsyncServiceProxy._attempt(
+            client, service_client, breaker, method, path, first, traces[0], hedger, **kwargs
+        ))
+        try:
+            done, _ = await asyncio.wait([primary], timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            trace.update(traces[0])
+            return primary.result()
+
+        hedger.record_hedge()
+        hedged_requests.inc(service=service)
+        second = service_client.balancer.choose(exclude=(first,))
+        secondary = asyncio.ensure_future(AsyncServiceProxy._attempt(
+            client, service_client, breaker, method, path, second, traces[1], hedger, **kwargs
+        ))
+        attempts = [primary, secondary]
+        pending = set(attempts)
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Si los dos terminan a la vez se prefiere el primero
+                winner = next((task for task in attempts if task in done and task.exception() is None), None)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in attempts:
+                if task is not winner and not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
+
+        if winner is secondary:
+            hedger.record_win()
+            hedge_wins.inc(service=service)
+            trace.update(traces[1])
+            trace['hedge'] = 'won'
+            return secondary.result()
+        trace.update(traces[0])
+        trace['hedge'] = 'lost'
+        return primary.result()
+
+    @staticmethod
+    async def _attempt(client, service_client, breaker, method, path, backend, trace, hedger=None, **kwargs):
+        """Una llamada a un backend; registra el resultado en el balanceador, el circuit breaker y las métricas"""
+        balancer = service_client.balancer
+        service = service_client.name.lower()
+        url = service_client.build_url(backend, path)
+        trace['backend'] = backend.url
+        upstream_in_flight.inc(service=service)
+        start = time.monotonic()
+        try:
+            upstream_request = client.build_request(method, url, **kwargs)
+            upstream = await client.send(upstream_request, stream=True)
+        except asyncio.CancelledError:
+            # Cancelado porque el otro intento respondió antes: no es un fallo del backend
+            duration = time.monotonic() - start
+            trace['upstream_ms'] = round(duration * 1000, 3)
+            balancer.release(backend, duration, error=False)
+            raise
+        except httpx.HTTPError:
+            duration = time.monotonic() - start
+            trace['upstream_ms'] = round(duration * 1000, 3)
+            balancer.release(backend, duration, error=True)
+            if breaker is not None:
+                breaker.record(True, duration)
+            upstream_duration.observe(duration, service=service, method=method.upper(), status='error')
+            raise
+        finally:
+            upstream_in_flight.dec(service=service)
+
+        duration = time.monotonic() - start
+        trace['upstream_ms'] = round(duration * 1000, 3)
+        balancer.release(backend, duration, error=upstream.status_code >= 500)
+        if breaker is not None:
+            breaker.record(upstream.status_code >= 500, duration)
+        if hedger is not None:
+            hedger.observe(duration)
+        # Con stream=True la llamada termina al recibir los headers; el cuerpo se transmite después
+        upstream_duration.observe(duration, service=service, method=method.upper(), status=upstream.status_code)
+        proxy_phase_duration.observe(duration, service=service, phase='headers')
+        return upstream
@@ -0,0 +1,133 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+
+DEFAULTS = {
+    'ENABLED': True,
+    'TTL': 300,             # Segundos máximos que se confía en un token ya verificado
+    'MAX_ENTRIES': 10000,
+}
+
+
+class TokenCache:
+    """Caché LRU de tokens ya verificados; cada entrada vence con el TTL o con el 'exp' del token"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(raw_token):
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+        return hashlib.sha256(raw_token).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, token_exp=None):
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Devuelve la caché configurada en settings.GATEWAY_AUTH_CACHE, o None si está desactivada"""
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                config = {**DEFAULTS, **getattr(settings, 'GATEWAY_AUTH_CACHE', {})}
+                if not config['ENABLED']:
+                    return None
+                _token_cache = TokenCache(ttl=config['TTL'], max_entries=config['MAX_ENTRIES'])
+    return _token_cache
+
+
+@receiver(setting_changed)
+def _reset_token_cache(setting, **kwargs):
+    global _token_cache
+    if setting == 'GATEWAY_AUTH_CACHE':
+        _token_cache = None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication que recuerda los tokens ya verificados: un acierto evita
+    comprobar la firma y consultar el usuario en la base de datos
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        cache = get_token_cache()
+        if cache is None:
+            validated_token = self.get_validated_token(raw_token)
+            return self.get_user(validated_token), validated_token
+
+        key = cache.make_key(raw_token)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        validated_token = self.get_validated_token(raw_token)
+        result = (self.get_user(validated_token), validated_token)
+        cache.set(key, result, validated_token.get('exp'))
+        return result
+
+
+class StatelessJWTAuthentication(CachedJWTAuthentication, JWTStatelessUserAuthentication):
+    """
+    Confía en los claims del token ya verificado y construye un TokenUser sin tocar la base
+    de datos: los usuarios viven en el servicio de usuarios, no en el gateway
+    """
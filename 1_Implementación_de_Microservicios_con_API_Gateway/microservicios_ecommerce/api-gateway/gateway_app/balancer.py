@@ -0,0 +1,167 @@
+import itertools
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+# Latencia que cuenta una solicitud fallida: un backend que falla rápido no debe parecer el más rápido
+EWMA_ERROR_PENALTY = 1.0
+
+
+class Backend:
+    """Una instancia de un servicio con su estado de salud y carga"""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+
+    def snapshot(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'ewma_ms': round(self.ewma * 1000, 3),
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+
+class LoadBalancer:
+    """
+    Reparte las solicitudes de un servicio entre sus backends sanos.
+    Estrategias: round_robin, least_outstanding y ewma (latencia media ponderada por carga)
+    """
+    STRATEGIES = ('round_robin', 'least_outstanding', 'ewma')
+
+    def __init__(self, name, config):
+        strategy = config['BALANCER']
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Estrategia de balanceo desconocida para {name}: {strategy}")
+
+        self.name = name
+        self.strategy = strategy
+        self.backends = [Backend(url) for url in config['URLS']]
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._checker = None
+
+        if len(self.backends) > 1 and config['HEALTH_CHECK_INTERVAL']:
+            self._checker = HealthChecker(self, config)
+            self._checker.start()
+
+    def choose(self, exclude=()):
+        """Elige un backend y lo marca como ocupado; hay que llamar a release() al terminar"""
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if not candidates:
+                # Sin backends sanos: mejor intentarlo que fallar sin preguntar
+                candidates = [b for b in self.backends if b not in exclude] or self.backends
+
+            if self.strategy == 'ewma':
+                # Los backends sin datos parten de la media del resto en lugar de 0
+                seed = self._mean_ewma()
+                for candidate in candidates:
+                    if not candidate.ewma:
+                        candidate.ewma = seed
+
+            if len(candidates) == 1 or self.strategy == 'round_robin':
+                backend = candidates[next(self._counter) % len(candidates)]
+            elif self.strategy == 'least_outstanding':
+                start = next(self._counter) % len(candidates)
+                rotated = candidates[start:] + candidates[:start]
+                backend = min(rotated, key=lambda b: b.outstanding)
+            else:
+                start = next(self._counter) % len(candidates)
+                rotated = candidates[start:] + candidates[:start]
+                backend = min(rotated, key=lambda b: (b.ewma * (b.outstanding + 1), b.outstanding))
+
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, duration, error=False):
+        with self._lock:
+            backend.outstanding -= 1
+            if error:
+                backend.failures += 1
+                duration = max(duration, EWMA_ERROR_PENALTY)
+            if backend.ewma:
+                backend.ewma = EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * backend.ewma
+            else:
+                backend.ewma = duration
+
+    def _mean_ewma(self, exclude=None):
+        """Latencia media de los backends sanos que ya tienen datos (0 si ninguno)"""
+        values = [b.ewma for b in self.backends if b.ewma and b.healthy and b is not exclude]
+        return sum(values) / len(values) if values else 0.0
+
+    def mark(self, backend, ok, healthy_threshold, unhealthy_threshold):
+        """Aplica el resultado de un health check"""
+        with self._lock:
+            if ok:
+                backend.consecutive_failures = 0
+                backend.consecutive_successes += 1
+                if not backend.healthy and backend.consecutive_successes >= healthy_threshold:
+                    backend.healthy = True
+                    # Su latencia es la de antes de caer: vuelve con la media actual del resto
+                    backend.ewma = self._mean_ewma(exclude=backend)
+                    logger.warning(f"Backend {backend.url} de {self.name} vuelve a estar sano")
+            else:
+                backend.consecutive_successes = 0
+                backend.consecutive_failures += 1
+                if backend.healthy and backend.consecutive_failures >= unhealthy_threshold:
+                    backend.healthy = False
+                    logger.warning(f"Backend {backend.url} de {self.name} fuera de rotación")
+
+    def close(self):
+        if self._checker is not None:
+            self._checker.stop()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'strategy': self.strategy,
+                'backends': [backend.snapshot() for backend in self.backends],
+            }
+
+
+class HealthChecker(threading.Thread):
+    """Comprueba periódicamente cada backend con un GET a HEALTH_CHECK_PATH"""
+
+    def __init__(self, balancer, config):
+        super().__init__(name=f"health-check-{balancer.name.lower()}", daemon=True)
+        self.balancer = balancer
+        self.path = config['HEALTH_CHECK_PATH']
+        self.interval = config['HEALTH_CHECK_INTERVAL']
+        self.timeout = config['HEALTH_CHECK_TIMEOUT']
+        self.healthy_threshold = config['HEALTHY_THRESHOLD']
+        self.unhealthy_threshold = config['UNHEALTHY_THRESHOLD']
+        self.session = requests.Session()
+        self._stop_event = threading.Event()
+
+    def check(self, backend):
+        try:
+            response = self.session.get(f"{backend.url}{self.path}", timeout=self.timeout)
+            return response.status_code < 500
+        except requests.RequestException:
+            return False
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for backend in self.balancer.backends:
+                ok = self.check(backend)
+                self.balancer.mark(backend, ok, self.healthy_threshold, self.unhealthy_threshold)
+            self._stop_event.wait(self.interval)
+        self.session.close()
+
+    def stop(self):
+        self._stop_event.set()
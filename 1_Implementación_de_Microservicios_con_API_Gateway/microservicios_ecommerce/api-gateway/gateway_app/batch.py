@@ -0,0 +1,112 @@
+import json
+import threading
+
+from django.conf import settings
+from django.http import QueryDict
+from rest_framework import status
+from rest_framework.response import Response
+
+from .aggregation import get_executor
+from .proxy import ServiceProxy, SUPPORTED_METHODS
+from .routing import get_routing_table, has_dot_segments
+
+DEFAULTS = {
+    'MAX_REQUESTS': 20,     # Subsolicitudes admitidas por lote
+    'MAX_PARALLEL': 8,      # Subsolicitudes de un mismo lote en curso a la vez
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GATEWAY_BATCH', {})}
+
+
+class SubRequest:
+    """Lo que ServiceProxy lee de una solicitud, construido a partir de una entrada del lote"""
+
+    def __init__(self, parent, method, path, body):
+        self.method = method
+        self.META = {}
+        if 'HTTP_AUTHORIZATION' in parent.META:
+            self.META['HTTP_AUTHORIZATION'] = parent.META['HTTP_AUTHORIZATION']
+        path, _, query = path.partition('?')
+        self.path = path
+        self.query_params = QueryDict(query)
+        self.data = body if body is not None else {}
+
+
+def parse_batch(data):
+    """Valida el lote; devuelve (entradas, None) o (None, mensaje de error)"""
+    if not isinstance(data, list):
+        data = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(data, list) or not data:
+        return None, "Se esperaba una lista de subsolicitudes en 'requests'"
+
+    max_requests = get_config()['MAX_REQUESTS']
+    if len(data) > max_requests:
+        return None, f"Un lote admite como máximo {max_requests} subsolicitudes"
+
+    entries = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            return None, f"Subsolicitud {index}: se esperaba un objeto"
+        method = str(item.get('method', 'GET')).upper()
+        service = item.get('service')
+        if method.lower() not in SUPPORTED_METHODS:
+            return None, f"Subsolicitud {index}: método {method} no soportado"
+        if not isinstance(service, str) or not get_routing_table().has_service(service.lower()):
+            return None, f"Subsolicitud {index}: servicio '{service}' desconocido"
+        path = str(item.get('path', '')).lstrip('/')
+        if has_dot_segments(path):
+            return None, f"Subsolicitud {index}: ruta no válida"
+        entries.append((method, service.lower(), path, item.get('body')))
+    return entries, None
+
+
+def _body(response):
+    if isinstance(response, Response):
+        return response.data
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode('utf-8', errors='replace')
+
+
+def dispatch(request, entries, check_permissions):
+    """
+    Envía las subsolicitudes a través de ServiceProxy en paralelo, con como mucho MAX_PARALLEL
+    en curso, y devuelve sus resultados en el mismo orden. check_permissions(service, method, path)
+    devuelve None o la respuesta de error para esa subsolicitud.
+    """
+    slots = threading.BoundedSemaphore(get_config()['MAX_PARALLEL'])
+    executor = get_executor()
+
+    def run(method, service, path, body):
+        try:
+            sub_request = SubRequest(request, method, path, body)
+            response = ServiceProxy.forward_request(service, sub_request.path, sub_request)
+            return {"status": response.status_code, "body": _body(response)}
+        finally:
+            slots.release()
+
+    results = [None] * len(entries)
+    futures = []
+    for index, (method, service, path, body) in enumerate(entries):
+        denied = check_permissions(service, method, path.partition('?')[0])
+        if denied is not None:
+            results[index] = denied
+            continue
+        slots.acquire()
+        futures.append((index, executor.submit(run, method, service, path, body)))
+
+    for index, future in futures:
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            results[index] = {
+                "status": status.HTTP_502_BAD_GATEWAY,
+                "body": {"error": "Error al procesar la subsolicitud", "detail": str(e)},
+            }
+    return results
@@ -0,0 +1,174 @@
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULTS = {
+    'ENABLED': True,
+    'WINDOW': 20,               # Últimas llamadas que se evalúan
+    'MIN_CALLS': 10,            # Llamadas mínimas en la ventana antes de poder abrir el circuito
+    'ERROR_RATE': 0.5,          # Proporción de errores (excepciones o 5xx) que abre el circuito
+    'SLOW_CALL_DURATION': 3.0,  # Segundos a partir de los cuales una llamada se considera lenta
+    'SLOW_CALL_RATE': 0.8,      # Proporción de llamadas lentas que abre el circuito
+    'OPEN_TIMEOUT': 30,         # Segundos en estado abierto antes de probar de nuevo
+    'HALF_OPEN_CALLS': 1,       # Llamadas de prueba simultáneas en estado semiabierto
+}
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, window, min_calls, error_rate, slow_call_duration, slow_call_rate,
+                 open_timeout, half_open_calls):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # (error, lenta)
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._probes = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow_request(self):
+        """Indica si la llamada puede salir hacia el servicio; reserva un turno de prueba si está semiabierto"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def release_probe(self):
+        """
+        Devuelve el turno de prueba que reservó allow_request() cuando la llamada no llega a
+        salir (p. ej. la descarta el control de admisión); sin esto el circuito semiabierto
+        se quedaría sin turnos y rechazaría el servicio para siempre
+        """
+        with self._lock:
+            if self._current_state() == self.HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def retry_after(self):
+        with self._lock:
+            if self._state != self.OPEN:
+                return 1
+            remaining = self.open_timeout - (time.monotonic() - self._opened_at)
+            return max(1, math.ceil(remaining))
+
+    def record(self, error, duration):
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            state = self._current_state()
+            if state == self.HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if error or slow:
+                    self._open()
+                else:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            if state == self.OPEN:
+                return
+
+            self._outcomes.append((error, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            errors = sum(1 for failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, was_slow in self._outcomes if was_slow)
+            if errors / calls >= self.error_rate or slow_calls / calls >= self.slow_call_rate:
+                self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._probes = 0
+        self.times_opened += 1
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            return {
+                'state': state,
+                'calls': calls,
+                'errors': sum(1 for failed, _ in self._outcomes if failed),
+                'slow_calls': sum(1 for _, slow in self._outcomes if slow),
+                'rejected': self.rejected,
+                'times_opened': self.times_opened,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GATEWAY_CIRCUIT_BREAKER', {})}
+
+
+def get_breaker(service):
+    """Devuelve el circuit breaker de un servicio, o None si están desactivados"""
+    name = service.upper()
+    breaker = _breakers.get(name)
+    if breaker is None:
+        config = get_config()
+        if not config['ENABLED']:
+            return None
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(
+                    name,
+                    window=config['WINDOW'],
+                    min_calls=config['MIN_CALLS'],
+                    error_rate=config['ERROR_RATE'],
+                    slow_call_duration=config['SLOW_CALL_DURATION'],
+                    slow_call_rate=config['SLOW_CALL_RATE'],
+                    open_timeout=config['OPEN_TIMEOUT'],
+                    half_open_calls=config['HALF_OPEN_CALLS'],
+                )
+    return breaker
+
+
+def breaker_states():
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
+
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_config_change(setting, **kwargs):
+    if setting == 'GATEWAY_CIRCUIT_BREAKER':
+        reset_breakers()
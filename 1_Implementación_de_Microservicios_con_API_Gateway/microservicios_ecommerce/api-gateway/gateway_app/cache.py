@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+
+from .compression import choose_encoding, compress, mark_encoded
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVICES': ['productos'],       # Solo servicios cuyos GET son públicos
+    'TTL': 30,                       # Segundos que una entrada se sirve sin consultar al servicio
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 50 * 1024 * 1024,   # Tamaño total de los cuerpos almacenados
+    'MAX_ENTRY_BYTES': 1024 * 1024,  # Respuestas más grandes no se cachean
+}
+
+
+class CacheEntry:
+    __slots__ = ('key', 'body', 'status', 'content_type', 'etag', 'stored_at', 'encoded')
+
+    def __init__(self, key, body, status, content_type, etag):
+        self.key = key
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.etag = etag
+        self.stored_at = time.monotonic()
+        # Cuerpo ya comprimido por codificación: se comprime una vez y se sirve en cada acierto
+        self.encoded = {}
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+    def is_fresh(self, ttl):
+        return time.monotonic() - self.stored_at < ttl
+
+    def to_response(self, cache_status, if_none_match=None, encoding=None):
+        """
+        Construye la respuesta para el cliente, o un 304 si ya tiene esta versión.
+        Con encoding se envía la variante comprimida (ver ResponseCache.encode)
+        """
+        body = self.encoded.get(encoding) if encoding else None
+        # If-None-Match usa comparación débil: W/"x" y "x" son la misma versión
+        if self.etag and if_none_match and if_none_match.removeprefix('W/') == self.etag.removeprefix('W/'):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body or self.body, status=self.status, content_type=self.content_type)
+        if self.etag:
+            response['ETag'] = self.etag
+        if body is not None and response.status_code != 304:
+            mark_encoded(response, encoding)
+        response['X-Gateway-Cache'] = cache_status
+        return response
+
+
+class ResponseCache:
+    """Caché LRU en memoria de respuestas GET públicas, acotada por número de entradas y bytes"""
+
+    def __init__(self, services, ttl, max_entries, max_bytes, max_entry_bytes):
+        self.services = {service.lower() for service in services}
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def applies_to(self, service, method, policy=None):
+        """policy es la política de caché de la ruta (GATEWAY_ROUTES); None usa la lista de servicios"""
+        if method.upper() != 'GET':
+            return False
+        return policy if policy is not None else service.lower() in self.services
+
+    @staticmethod
+    def make_key(service, path, params):
+        query = urlencode(sorted((key, value) for key, values in params.lists() for value in values))
+        return f"{service.lower()}:{path}?{query}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_fresh(self, key):
+        """Devuelve la entrada si todavía está vigente y contabiliza el acierto o fallo"""
+        entry = self.get(key)
+        with self._lock:
+            if entry is not None and entry.is_fresh(self.ttl):
+                self.hits += 1
+                return entry, True
+            self.misses += 1
+        return entry, False
+
+    def store(self, key, body, status, content_type, etag):
+        if len(body) > self.max_entry_bytes:
+            return None
+
+        entry = CacheEntry(key, body, status, content_type, etag)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += len(body)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def encode(self, entry, encoding):
+        """
+        Prepara la variante comprimida de una entrada y devuelve la codificación a usar,
+        o None si comprimida no ocupa menos. La variante cuenta para MAX_BYTES
+        """
+        if encoding in entry.encoded:
+            return encoding
+        body = compress(entry.body, encoding)
+        if len(body) >= len(entry.body):
+            return None
+        with self._lock:
+            if encoding not in entry.encoded:
+                entry.encoded[encoding] = body
+                if self._entries.get(entry.key) is entry:
+                    self._bytes += len(body)
+                    self._evict()
+        return encoding
+
+    def respond(self, entry, cache_status, request, if_none_match=None):
+        """Respuesta para el cliente a partir de una entrada, comprimida si lo acepta"""
+        encoding = choose_encoding(request, entry.content_type, len(entry.body))
+        if encoding is not None:
+            encoding = self.encode(entry, encoding)
+        return entry.to_response(cache_status, if_none_match, encoding)
+
+    def revalidated(self, entry):
+        """El servicio confirmó con un 304 que la entrada sigue siendo válida"""
+        with self._lock:
+            entry.stored_at = time.monotonic()
+            self.revalidations += 1
+
+    def invalidate(self, service):
+        prefix = f"{service.lower()}:"
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._bytes -= self._entries.pop(key).size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Devuelve la caché configurada en settings.GATEWAY_CACHE, o None si está desactivada"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = {**DEFAULTS, **getattr(settings, 'GATEWAY_CACHE', {})}
+                if not config['ENABLED']:
+                    return None
+                _cache = ResponseCache(
+                    services=config['SERVICES'],
+                    ttl=config['TTL'],
+                    max_entries=config['MAX_ENTRIES'],
+                    max_bytes=config['MAX_BYTES'],
+                    max_entry_bytes=config['MAX_ENTRY_BYTES'],
+                )
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_cache(setting, **kwargs):
+    global _cache
+    if setting == 'GATEWAY_CACHE':
+        _cache = None
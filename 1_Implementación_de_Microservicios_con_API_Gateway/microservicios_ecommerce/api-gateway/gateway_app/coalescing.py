@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Agrupa solicitudes idénticas en curso: la primera llega al servicio y
+    las demás esperan su resultado en lugar de repetir la llamada
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight para el proxy asíncrono: las solicitudes idénticas esperan el resultado de
+    la primera sin bloquear el event loop. Las llamadas en curso son de cada event loop
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Se canceló la solicitud que hacía la llamada (p. ej. el cliente se fue): se repite
+                return await fn()
+
+        future = calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Sin solicitudes esperando nadie la recoge: se marca como recuperada
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+    def snapshot(self):
+        return {
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'in_flight': sum(len(calls) for calls in list(self._calls.values())),
+        }
+
+
+def make_key(method, url, params, authorization, *extra):
+    """Método + URL + alcance de autenticación: solo se comparten respuestas del mismo token"""
+    query = sorted((key, value) for key, values in params.lists() for value in values) if params else []
+    scope = hashlib.sha256(authorization.encode()).hexdigest() if authorization else ''
+    return (method, url, tuple(query), scope) + extra
+
+
+singleflight = SingleFlight()
+async_singleflight = AsyncSingleFlight()
@@ -0,0 +1,193 @@
+import gzip
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .metrics import compressed_responses, compression_bytes
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional: sin él el gateway solo comprime con gzip
+    brotli = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,       # Cuerpos más pequeños se envían sin comprimir
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,    # 0-11; por encima de 6 el coste de CPU crece mucho más que el ahorro
+    'CONTENT_TYPES': ['application/json', 'text/'],
+    'UPSTREAM': True,       # Pedir cuerpos comprimidos a los servicios y reenviarlos tal cual
+}
+
+# Codificaciones que el gateway puede reenviar sin tocarlas, por orden de preferencia
+PASSTHROUGH_ENCODINGS = ('br', 'gzip')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GATEWAY_COMPRESSION', {})}
+
+
+def available_encodings():
+    """Codificaciones con las que el gateway sabe comprimir, por orden de preferencia"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def accepted_encodings(accept_encoding):
+    """Codificaciones de Accept-Encoding con q > 0, de mayor a menor preferencia"""
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    wildcard = weights.pop('*', None)
+    if wildcard:
+        for name in PASSTHROUGH_ENCODINGS:
+            weights.setdefault(name, wildcard)
+    # sorted es estable: a igual q se respeta el orden de PASSTHROUGH_ENCODINGS
+    candidates = [name for name in PASSTHROUGH_ENCODINGS if weights.get(name, 0) > 0]
+    return sorted(candidates, key=lambda name: -weights[name])
+
+
+def negotiate(accept_encoding, available=None):
+    """Codificación que se usará con el cliente, o None para enviar el cuerpo sin comprimir"""
+    available = available_encodings() if available is None else available
+    for name in accepted_encodings(accept_encoding):
+        if name in available:
+            return name
+    return None
+
+
+def is_compressible(content_type, config):
+    media_type = content_type.partition(';')[0].strip().lower()
+    return any(media_type.startswith(prefix) for prefix in config['CONTENT_TYPES'])
+
+
+def choose_encoding(request, content_type, size):
+    """Codificación para un cuerpo de size bytes, o None si no merece la pena comprimirlo"""
+    config = get_config()
+    if not config['ENABLED'] or size < config['MIN_SIZE'] or not is_compressible(content_type, config):
+        return None
+    return negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+
+def upstream_encodings(request):
+    """
+    Codificaciones que se piden al servicio: las que acepta el cliente, para poder
+    reenviar el cuerpo comprimido sin descomprimirlo ni volver a comprimirlo
+    """
+    config = get_config()
+    if not config['ENABLED'] or not config['UPSTREAM']:
+        return ()
+    return tuple(accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def compress(body, encoding, config=None):
+    config = config or get_config()
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=config['GZIP_LEVEL'], mtime=0)
+
+
+def _stream_compressor(encoding, config):
+    """(comprimir un bloque, cerrar el flujo) para cuerpos en streaming"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=config['BROTLI_QUALITY'])
+        return (lambda chunk: compressor.process(chunk) + compressor.flush()), compressor.finish
+    compressor = zlib.compressobj(config['GZIP_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    # Z_SYNC_FLUSH: cada bloque sale en cuanto llega, sin esperar al final del cuerpo
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+
+def _compress_stream(chunks, encoding, config):
+    process, finish = _stream_compressor(encoding, config)
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+async def _acompress_stream(chunks, encoding, config):
+    process, finish = _stream_compressor(encoding, config)
+    async for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def mark_encoded(response, encoding):
+    """Headers de un cuerpo comprimido; el ETag pasa a débil porque los bytes ya no son los originales"""
+    response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+class CompressionMiddleware:
+    """
+    Comprime con brotli o gzip las respuestas JSON y de texto según el Accept-Encoding del
+    cliente. Las que ya llegan comprimidas (del servicio o de la caché) se dejan tal cual.
+    Funciona tanto con WSGI como con ASGI sin cambiar de modo
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        config = get_config()
+        if not config['ENABLED'] or not is_compressible(response.get('Content-Type', ''), config):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+            return response
+
+        if response.streaming:
+            # El tamaño no se conoce de antemano: se comprime siempre
+            encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            if encoding is None:
+                return response
+            compressor = _acompress_stream if response.is_async else _compress_stream
+            response.streaming_content = compressor(response.streaming_content, encoding, config)
+            del response['Content-Length']
+        else:
+            encoding = choose_encoding(request, response.get('Content-Type', ''), len(response.content))
+            if encoding is None:
+                return response
+            body = compress(response.content, encoding, config)
+            if len(body) >= len(response.content):
+                return response
+            compression_bytes.inc(len(response.content), stage='original')
+            compression_bytes.inc(len(body), stage='compressed')
+            response.content = body
+            response['Content-Length'] = str(len(body))
+
+        compressed_responses.inc(encoding=encoding, source='gateway')
+        mark_encoded(response, encoding)
+        return response
@@ -0,0 +1,210 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVICES': ['productos', 'usuarios'],  # Solo GET idempotentes de estos servicios
+    'PERCENTILE': 95,       # Se lanza el segundo intento si el primero supera este percentil reciente
+    'MIN_DELAY': 0.01,      # Espera mínima (segundos) antes de duplicar una llamada
+    'WINDOW': 500,          # Duraciones recientes con las que se calcula el percentil
+    'MIN_SAMPLES': 50,      # Sin suficientes muestras no se duplica nada
+    'MAX_RATE': 0.1,        # Proporción máxima de llamadas duplicadas
+    'MAX_WORKERS': 32,      # Hilos para los segundos intentos (compartidos entre servicios)
+}
+
+
+class Hedger:
+    """Decide cuándo duplicar una llamada lenta y lleva la cuenta de duplicados y victorias"""
+
+    def __init__(self, name, percentile, min_delay, window, min_samples, max_rate):
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        # El percentil se recalcula cada cierto número de muestras, no en cada llamada
+        self.refresh_every = max(1, window // 20)
+
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self._pending = 0
+        self._threshold = None
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+
+    def observe(self, duration):
+        with self._lock:
+            self._samples.append(duration)
+            self._pending += 1
+            stale = self._threshold is None or self._pending >= self.refresh_every
+            if stale and len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                index = min(len(ordered) - 1, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+                self._threshold = ordered[index]
+                self._pending = 0
+
+    def delay(self):
+        """Segundos que se espera al primer intento antes de lanzar otro, o None si no se duplica"""
+        with self._lock:
+            self.requests += 1
+            if self._threshold is None or self.hedged >= self.max_rate * self.requests:
+                return None
+            return max(self.min_delay, self._threshold)
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedged += 1
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'wins': self.wins,
+                'hedge_rate': round(self.hedged / self.requests, 4) if self.requests else 0.0,
+                'delay_ms': round(self._threshold * 1000, 3) if self._threshold is not None else None,
+            }
+
+
+class _Timer:
+    __slots__ = ('fn', 'cancelled')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class HedgeScheduler:
+    """
+    Un único hilo que espera a que venza el retardo de cada llamada y solo entonces pasa su
+    segundo intento al executor. Así ninguna llamada ocupa un hilo del executor mientras espera
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._cond = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._closed = False
+        threading.Thread(target=self._run, name='gateway-hedge-timer', daemon=True).start()
+
+    def schedule(self, delay, fn):
+        """Ejecuta fn en el executor dentro de delay segundos salvo que se cancele antes"""
+        timer = _Timer(fn)
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), timer))
+            self._cond.notify()
+        return timer
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._heap and self._heap[0][0] <= time.monotonic():
+                        break
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._closed:
+                    return
+                _, _, timer = heapq.heappop(self._heap)
+            if not timer.cancelled:
+                try:
+                    self.executor.submit(timer.fn)
+                except RuntimeError:
+                    pass  # Executor cerrado por un cambio de configuración: la llamada sigue sin duplicar
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+
+_hedgers = {}
+_executor = None
+_scheduler = None
+_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GATEWAY_HEDGING', {})}
+
+
+def get_hedger(service):
+    """Devuelve el Hedger de un servicio, o None si sus llamadas no se duplican"""
+    name = service.lower()
+    hedger = _hedgers.get(name)
+    if hedger is None:
+        config = get_config()
+        if not config['ENABLED'] or name not in config['SERVICES']:
+            return None
+        with _lock:
+            hedger = _hedgers.get(name)
+            if hedger is None:
+                hedger = _hedgers[name] = Hedger(
+                    name,
+                    percentile=config['PERCENTILE'],
+                    min_delay=config['MIN_DELAY'],
+                    window=config['WINDOW'],
+                    min_samples=config['MIN_SAMPLES'],
+                    max_rate=config['MAX_RATE'],
+                )
+    return hedger
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_config()['MAX_WORKERS'], thread_name_prefix='gateway-hedge'
+                )
+    return _executor
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        executor = get_executor()
+        with _lock:
+            if _scheduler is None:
+                _scheduler = HedgeScheduler(executor)
+    return _scheduler
+
+
+def hedging_stats():
+    return {name: hedger.snapshot() for name, hedger in list(_hedgers.items())}
+
+
+def reset_hedgers():
+    with _lock:
+        _hedgers.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_config_change(setting, **kwargs):
+    global _executor, _scheduler
+    if setting == 'GATEWAY_HEDGING':
+        reset_hedgers()
+        if _scheduler is not None:
+            _scheduler.close()
+            _scheduler = None
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
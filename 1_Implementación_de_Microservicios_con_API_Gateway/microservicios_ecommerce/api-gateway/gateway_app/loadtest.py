@@ -0,0 +1,233 @@
+"""
+Herramientas de la prueba de carga (manage.py loadtest): servicios falsos con latencia y
+errores configurables que imitan a usuarios, productos y órdenes, y un cliente con varios
+hilos que mide throughput y percentiles de latencia por ruta
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+CATALOG_SIZE = 50
+ORDERS = 20
+
+
+class StubProfile:
+    """Comportamiento de un servicio falso: latencia base, cola de latencia y tasa de errores 500"""
+
+    def __init__(self, latency=0.005, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        # Cola exponencial: la mayoría cerca de la latencia base y unas pocas mucho más lentas
+        return self.latency + (random.expovariate(1 / self.jitter) if self.jitter else 0)
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+
+def _producto(producto_id):
+    return {"id": producto_id, "nombre": f"Producto {producto_id}", "precio": "19.99", "stock": 100}
+
+
+def _orden(orden_id):
+    detalles = [{"producto_id": (orden_id + i) % CATALOG_SIZE + 1, "cantidad": i + 1} for i in range(3)]
+    return {"id": orden_id, "usuario_id": 1, "estado": "pendiente", "detalles": detalles}
+
+
+# (método, ruta) -> (status, documento); los grupos de la expresión se pasan como enteros
+ROUTES = {
+    'usuarios': [
+        ('GET', r'usuarios/me/', lambda: (200, {"id": 1, "username": "carga"})),
+        ('GET', r'usuarios/(\d+)/', lambda user_id: (200, {"id": user_id, "username": f"usuario{user_id}"})),
+        ('POST', r'usuarios/', lambda: (201, {"id": 2, "username": "nuevo"})),
+        ('POST', r'token/', lambda: (200, {"access": "stub", "refresh": "stub"})),
+    ],
+    'productos': [
+        ('GET', r'productos/', lambda: (200, [_producto(i) for i in range(1, CATALOG_SIZE + 1)])),
+        ('GET', r'productos/(\d+)/', lambda producto_id: (200, _producto(producto_id))),
+        ('PATCH', r'productos/(\d+)/', lambda producto_id: (200, _producto(producto_id))),
+    ],
+    'ordenes': [
+        ('GET', r'ordenes/', lambda: (200, [_orden(i) for i in range(1, ORDERS + 1)])),
+        ('GET', r'ordenes/(\d+)/', lambda orden_id: (200, _orden(orden_id))),
+        ('POST', r'ordenes/', lambda: (201, _orden(ORDERS + 1))),
+    ],
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Responde las rutas de ROUTES del servicio del servidor, con keep-alive"""
+    protocol_version = 'HTTP/1.1'
+
+    def handle_method(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        profile = self.server.profile
+        time.sleep(profile.delay())
+        if profile.fails():
+            return self.send_json(500, {"detail": "Error simulado"})
+
+        path = self.path.partition('?')[0].removeprefix('/api/')
+        for method, pattern, document in self.server.routes:
+            match = re.fullmatch(pattern, path)
+            if method == self.command and match:
+                return self.send_json(*document(*map(int, match.groups())))
+        self.send_json(404, {"detail": "No encontrado."})
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_method
+
+    def send_json(self, status, document):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """Servicio falso en un hilo propio; port=0 elige un puerto libre"""
+
+    def __init__(self, service, profile=None, host='127.0.0.1', port=0):
+        self.service = service
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.profile = profile or StubProfile()
+        self.httpd.routes = ROUTES[service]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Scenario:
+    """Una ruta del gateway con su peso en la mezcla de tráfico; {id} se sustituye por un id al azar"""
+
+    def __init__(self, name, method, path, body=None, weight=1, max_id=ORDERS):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.weight = weight
+        self.max_id = max_id
+
+    def url(self, base_url):
+        return base_url.rstrip('/') + self.path.format(id=random.randint(1, self.max_id))
+
+
+SCENARIOS = [
+    Scenario('productos-lista', 'GET', '/api/productos/productos/', weight=4),
+    Scenario('productos-detalle', 'GET', '/api/productos/productos/{id}/', weight=4, max_id=CATALOG_SIZE),
+    Scenario('usuarios-me', 'GET', '/api/usuarios/usuarios/me/', weight=2),
+    Scenario('ordenes-lista', 'GET', '/api/ordenes/ordenes/', weight=2),
+    Scenario('ordenes-crear', 'POST', '/api/ordenes/ordenes/',
+             body={"usuario_id": 1, "direccion_envio": "Calle Falsa 123",
+                   "detalles_datos": [{"producto_id": 1, "cantidad": 2}]}, weight=1),
+    Scenario('resumen-orden', 'GET', '/api/resumen/ordenes/{id}/', weight=1),
+    Scenario('batch', 'POST', '/api/batch/', body={"requests": [
+        {"service": "productos", "path": "productos/1/"},
+        {"service": "usuarios", "path": "usuarios/me/"},
+        {"service": "ordenes", "path": "ordenes/1/"},
+    ]}, weight=1),
+]
+
+
+def run_load(base_url, scenarios, workers=8, duration=10.0, max_requests=None, headers=None, timeout=30):
+    """
+    Lanza workers hilos, cada uno con su propia sesión keep-alive, que eligen escenarios según
+    su peso hasta agotar duration segundos (o max_requests en total).
+    Devuelve (muestras, segundos) con una muestra (escenario, status, segundos) por solicitud
+    """
+    weights = [scenario.weight for scenario in scenarios]
+    deadline = time.monotonic() + duration
+    remaining = [max_requests]
+    lock = threading.Lock()
+    samples = []
+
+    def take():
+        if time.monotonic() >= deadline:
+            return False
+        if remaining[0] is None:
+            return True
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        session = requests.Session()
+        session.headers.update(headers or {})
+        local = []
+        while take():
+            scenario = random.choices(scenarios, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = session.request(
+                    scenario.method, scenario.url(base_url), json=scenario.body, timeout=timeout
+                )
+                status = response.status_code
+            except requests.RequestException:
+                status = 'error'
+            local.append((scenario.name, status, time.perf_counter() - start))
+        session.close()
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - start
+
+
+def percentile(ordered, value):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(value / 100 * len(ordered)) - 1))]
+
+
+def summarize(samples, elapsed):
+    """Por ruta (y en 'total'): solicitudes, errores (5xx o de conexión), rps y p50/p95/p99 en ms"""
+    by_route = {}
+    for name, status, seconds in samples:
+        by_route.setdefault(name, []).append((status, seconds))
+    by_route = dict(sorted(by_route.items()))
+    by_route['total'] = [(status, seconds) for _, status, seconds in samples]
+
+    report = {}
+    for name, results in by_route.items():
+        durations = sorted(seconds for _, seconds in results)
+        report[name] = {
+            'requests': len(results),
+            'errors': sum(1 for status, _ in results if status == 'error' or status >= 500),
+            'rps': round(len(results) / elapsed, 1) if elapsed else 0.0,
+            **{f'p{p}': round(percentile(durations, p) * 1000, 2) for p in (50, 95, 99)},
+        }
+    return report
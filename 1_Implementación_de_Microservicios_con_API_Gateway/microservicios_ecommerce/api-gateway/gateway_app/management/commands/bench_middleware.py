@@ -0,0 +1,76 @@
+import time
+
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+
+from gateway_app.routing import ServiceRoutePattern
+
+# Pila anterior a los middlewares "lean"
+FULL_MIDDLEWARE = [
+    'gateway_app.middleware.MetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+]
+
+
+@csrf_exempt
+def _view(request, *args, **kwargs):
+    return HttpResponse(b'{}', content_type='application/json')
+
+
+class BenchURLConf:
+    """Solo la ruta proxy, con una vista vacía: se mide el coste de la pila, no el del servicio"""
+    urlpatterns = [path('api/', _view, name='proxy', Pattern=ServiceRoutePattern)]
+
+
+class Command(BaseCommand):
+    help = "Mide el coste por solicitud de la pila de middlewares en una ruta proxy, completa frente a lean"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def measure(self, middleware, iterations, **extra_settings):
+        with override_settings(MIDDLEWARE=middleware, **extra_settings):
+            handler = BaseHandler()
+            handler.load_middleware()
+            factory = RequestFactory()
+
+            def call():
+                request = factory.get('/api/productos/productos/', HTTP_HOST='localhost', HTTP_AUTHORIZATION='Bearer x')
+                request.urlconf = BenchURLConf
+                return handler.get_response(request)
+
+            call()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                call()
+            return (time.perf_counter() - start) / iterations * 1e6
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+
+        iterations = options['iterations']
+        # Solicitud sin middlewares: coste de RequestFactory, resolución y vista
+        baseline = self.measure([], iterations)
+        results = {
+            'completa': self.measure(FULL_MIDDLEWARE, iterations),
+            'lean': self.measure(settings.MIDDLEWARE, iterations, GATEWAY_LEAN_PROXY=True),
+        }
+        self.stdout.write(f"sin middlewares: {baseline:.1f} µs por solicitud")
+        for name, per_request in results.items():
+            self.stdout.write(
+                f"{name:>15}: {per_request:.1f} µs por solicitud ({per_request - baseline:.1f} µs de middlewares)"
+            )
+        overhead_full = results['completa'] - baseline
+        overhead_lean = results['lean'] - baseline
+        self.stdout.write(f"coste de la pila: {overhead_lean / overhead_full:.0%} del original")
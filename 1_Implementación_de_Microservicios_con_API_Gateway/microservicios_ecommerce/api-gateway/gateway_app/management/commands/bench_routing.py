@@ -0,0 +1,95 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.urls import URLResolver, path, re_path
+from django.urls.resolvers import RegexPattern
+from rest_framework.permissions import AllowAny, IsAuthenticated
+
+from gateway_app.routing import ServiceRoutePattern, get_routing_table
+
+SAMPLE_PATHS = [
+    ('/api/productos/productos/', 'GET'),
+    ('/api/productos/productos/42/', 'GET'),
+    ('/api/ordenes/ordenes/7/', 'GET'),
+    ('/api/ordenes/ordenes/', 'POST'),
+    ('/api/usuarios/usuarios/me/', 'GET'),
+    ('/api/usuarios/usuarios/', 'POST'),
+]
+
+
+def _view(request, *args, **kwargs):
+    return None
+
+
+def _leading_patterns():
+    # Las rutas que preceden al proxy en api_gateway/urls.py
+    return [
+        path('api/token/', _view),
+        path('api/token/refresh/', _view),
+        path('api/gateway/stats/', _view),
+        path('metrics', _view),
+        path('api/resumen/ordenes/<int:orden_id>/', _view),
+        path('api/batch/', _view),
+        path('api/', _view),
+    ]
+
+
+def _legacy_permissions(service, method):
+    """Decisión de permisos anterior a la tabla de rutas"""
+    if not service:
+        return [AllowAny()]
+    if service == 'usuarios' and method == 'POST':
+        return [AllowAny()]
+    elif service == 'productos' and method == 'GET':
+        return [AllowAny()]
+    return [IsAuthenticated()]
+
+
+def _table_permissions(service, method, path):
+    route = get_routing_table().match(service, path, method)
+    if route is not None and route.public:
+        return [AllowAny()]
+    return [IsAuthenticated()]
+
+
+class Command(BaseCommand):
+    help = "Compara el despacho de rutas proxy con regex frente a la tabla de rutas precompilada"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        legacy = URLResolver(RegexPattern(r'^/'), _leading_patterns() + [
+            re_path(r'^api/(?P<service>usuarios|productos|ordenes)/?(?P<path>.*)?$', _view, name='proxy'),
+        ])
+        # La tabla no se solapa con las demás rutas, así que el proxy puede ir el primero
+        table = URLResolver(RegexPattern(r'^/'), [
+            path('api/', _view, name='proxy', Pattern=ServiceRoutePattern),
+        ] + _leading_patterns())
+        get_routing_table()
+
+        def legacy_dispatch(url, method):
+            match = legacy.resolve(url)
+            return _legacy_permissions(match.kwargs['service'], method)
+
+        def table_dispatch(url, method):
+            match = table.resolve(url)
+            return _table_permissions(match.kwargs['service'], method, match.kwargs['path'])
+
+        for url, method in SAMPLE_PATHS:
+            if legacy.resolve(url).kwargs != table.resolve(url).kwargs:
+                raise AssertionError(f"Las dos tablas resuelven {url} de forma distinta")
+
+        results = {}
+        for name, dispatch in (('regex', legacy_dispatch), ('tabla', table_dispatch)):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for url, method in SAMPLE_PATHS:
+                    dispatch(url, method)
+            elapsed = time.perf_counter() - start
+            results[name] = elapsed / (iterations * len(SAMPLE_PATHS)) * 1e6
+
+        for name, per_request in results.items():
+            self.stdout.write(f"{name:>6}: {per_request:.2f} µs por solicitud (resolve + permisos)")
+        self.stdout.write(f"mejora: {results['regex'] / results['tabla']:.2f}x")
@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from gateway_app.loadtest import ROUTES, SCENARIOS, StubProfile, StubServer, run_load, summarize
+
+STUB_PORTS = {'usuarios': 9001, 'productos': 9002, 'ordenes': 9003}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _per_service(values, cast, option):
+    """'productos=0.02,ordenes=0.1' -> {'productos': 0.02, 'ordenes': 0.1}"""
+    result = {}
+    for item in filter(None, (values or '').split(',')):
+        service, _, value = item.partition('=')
+        if service not in ROUTES:
+            raise CommandError(f"{option}: servicio desconocido '{service}'")
+        try:
+            result[service] = cast(value)
+        except ValueError:
+            raise CommandError(f"{option}: valor no válido para {service}: '{value}'")
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga del gateway contra servicios falsos con latencia y errores configurables. "
+        "Informa de throughput y latencia p50/p95/p99 por ruta"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Clientes concurrentes")
+        parser.add_argument('--duration', type=float, default=10.0, help="Segundos de carga")
+        parser.add_argument('--requests', type=int, help="Número total de solicitudes (en lugar de --duration)")
+        parser.add_argument('--scenarios', help="Rutas a probar, separadas por comas (por defecto, todas)")
+        parser.add_argument('--latency', default='', help="Latencia base por servicio en segundos: productos=0.02")
+        parser.add_argument('--jitter', default='', help="Media de la cola exponencial de latencia: ordenes=0.05")
+        parser.add_argument('--error-rate', default='', help="Proporción de 500 por servicio: usuarios=0.01")
+        parser.add_argument('--default-latency', type=float, default=0.005, help="Latencia base de los servicios sin --latency")
+        parser.add_argument('--gateway', help="URL de un gateway ya arrancado; sin ella se arranca uno en este proceso")
+        parser.add_argument('--token', help="JWT para --gateway; sin él se firma uno con la SECRET_KEY local")
+        parser.add_argument('--stubs-only', action='store_true',
+                            help=f"Solo arrancar los servicios falsos en los puertos {STUB_PORTS} hasta Ctrl+C")
+        parser.add_argument('--json', action='store_true', help="Imprimir el informe en JSON")
+
+    def handle(self, *args, **options):
+        latency = _per_service(options['latency'], float, '--latency')
+        jitter = _per_service(options['jitter'], float, '--jitter')
+        errors = _per_service(options['error_rate'], float, '--error-rate')
+        scenarios = self.select_scenarios(options['scenarios'])
+
+        if options['stubs_only']:
+            return self.serve_stubs(latency, jitter, errors, options['default_latency'])
+
+        token = options['token'] or self.sign_token()
+        headers = {'Authorization': f"Bearer {token}"}
+        if options['gateway']:
+            report = self.drive(options['gateway'], scenarios, headers, options)
+        else:
+            stubs = self.start_stubs(latency, jitter, errors, options['default_latency'], ports=None)
+            try:
+                report = self.in_process(stubs, scenarios, headers, options)
+            finally:
+                for stub in stubs.values():
+                    stub.stop()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    @staticmethod
+    def select_scenarios(names):
+        if not names:
+            return SCENARIOS
+        by_name = {scenario.name: scenario for scenario in SCENARIOS}
+        unknown = [name for name in names.split(',') if name not in by_name]
+        if unknown:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(by_name)}")
+        return [by_name[name] for name in names.split(',')]
+
+    @staticmethod
+    def sign_token():
+        # Con la autenticación sin estado basta un token firmado: el usuario no necesita existir
+        token = AccessToken()
+        token['user_id'] = 1
+        token['username'] = 'carga'
+        return str(token)
+
+    @staticmethod
+    def start_stubs(latency, jitter, errors, default_latency, ports):
+        stubs = {}
+        for service in ROUTES:
+            profile = StubProfile(
+                latency=latency.get(service, default_latency),
+                jitter=jitter.get(service, 0.0),
+                error_rate=errors.get(service, 0.0),
+            )
+            port = ports[service] if ports else 0
+            stubs[service] = StubServer(service, profile, port=port).start()
+        return stubs
+
+    def serve_stubs(self, latency, jitter, errors, default_latency):
+        stubs = self.start_stubs(latency, jitter, errors, default_latency, ports=STUB_PORTS)
+        for service, stub in stubs.items():
+            self.stdout.write(f"{service}: {stub.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for stub in stubs.values():
+                stub.stop()
+
+    def in_process(self, stubs, scenarios, headers, options):
+        """Arranca el gateway con su configuración actual, pero apuntando a los servicios falsos"""
+        services = {service.upper(): {'URL': stub.url} for service, stub in stubs.items()}
+        with override_settings(SERVICES=services):
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=True)
+            server.daemon_threads = True
+            server.set_app(get_internal_wsgi_application())
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                return self.drive(f"http://127.0.0.1:{server.server_port}", scenarios, headers, options)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def drive(self, base_url, scenarios, headers, options):
+        # Calentamiento: conexiones, pools y percentiles del hedging, fuera de la medición
+        run_load(base_url, scenarios, workers=options['workers'], duration=1.0, max_requests=options['workers'] * 5,
+                 headers=headers)
+        # Con --requests se corre hasta completarlas, sin límite de tiempo
+        duration = float('inf') if options['requests'] else options['duration']
+        samples, elapsed = run_load(
+            base_url, scenarios, workers=options['workers'], duration=duration,
+            max_requests=options['requests'], headers=headers,
+        )
+        return summarize(samples, elapsed)
+
+    def print_report(self, report):
+        self.stdout.write(f"{'ruta':<20}{'solicitudes':>12}{'errores':>9}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name, row in report.items():
+            self.stdout.write(
+                f"{name:<20}{row['requests']:>12}{row['errors']:>9}{row['rps']:>9}"
+                f"{row['p50']:>9}{row['p95']:>9}{row['p99']:>9}"
+            )
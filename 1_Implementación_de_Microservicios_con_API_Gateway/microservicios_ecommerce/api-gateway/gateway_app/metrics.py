@@ -0,0 +1,229 @@
+import bisect
+import threading
+
+# Límites superiores (segundos) de los buckets de latencia
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Histograma con buckets fijos; guarda conteos por bucket, suma y total por combinación de etiquetas"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Un contador por bucket más el de +Inf, la suma y el total
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_samples(self, items):
+        bounds = self.buckets + (float('inf'),)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        """Exposición en formato de texto de Prometheus (0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Solicitudes que recibe el gateway (MetricsMiddleware)
+http_request_duration = registry.register(Histogram(
+    'gateway_http_request_duration_seconds',
+    'Tiempo total de cada solicitud en el gateway',
+    ('route', 'method', 'status'),
+))
+http_requests_in_flight = registry.register(Gauge(
+    'gateway_http_requests_in_flight',
+    'Solicitudes en curso en el gateway',
+))
+
+# Llamadas a los servicios (ServiceProxy y AsyncServiceProxy)
+upstream_duration = registry.register(Histogram(
+    'gateway_upstream_duration_seconds',
+    'Duración de la llamada al servicio, desde la conexión hasta el último byte',
+    ('service', 'method', 'status'),
+))
+upstream_in_flight = registry.register(Gauge(
+    'gateway_upstream_requests_in_flight',
+    'Llamadas en curso hacia cada servicio',
+    ('service',),
+))
+proxy_phase_duration = registry.register(Histogram(
+    'gateway_proxy_phase_duration_seconds',
+    'Tiempo por fase del reenvío: headers (conexión y espera del servicio), body (descarga) '
+    'y gateway (caché, parseo y construcción de la respuesta)',
+    ('service', 'phase'),
+))
+
+hedged_requests = registry.register(Counter(
+    'gateway_hedged_requests_total',
+    'Llamadas GET duplicadas en otro backend por tardar más que el percentil configurado',
+    ('service',),
+))
+hedge_wins = registry.register(Counter(
+    'gateway_hedge_wins_total',
+    'Llamadas duplicadas en las que el segundo intento respondió primero',
+    ('service',),
+))
+
+retries = registry.register(Counter(
+    'gateway_retries_total',
+    'Reintentos de llamadas idempotentes tras un error de conexión',
+    ('service',),
+))
+retries_exhausted = registry.register(Counter(
+    'gateway_retries_exhausted_total',
+    'Reintentos descartados por haber agotado el presupuesto del servicio',
+    ('service',),
+))
+
+# Login y refresh reenviados al servicio de usuarios (LoginView y RefreshTokenView)
+auth_duration = registry.register(Histogram(
+    'gateway_auth_duration_seconds',
+    'Duración de las llamadas de login y refresh al servicio de usuarios',
+    ('operation', 'status'),
+))
+auth_deduplicated = registry.register(Counter(
+    'gateway_auth_deduplicated_total',
+    'Logins y refresh resueltos sin llamar al servicio: agrupados con uno en curso (coalesced) o desde la caché (cache)',
+    ('operation', 'source'),
+))
+
+# Control de admisión (límite adaptativo de llamadas simultáneas por servicio)
+admission_limit = registry.register(Gauge(
+    'gateway_admission_limit',
+    'Límite actual de llamadas simultáneas a cada servicio',
+    ('service',),
+))
+admission_queue_depth = registry.register(Gauge(
+    'gateway_admission_queue_depth',
+    'Solicitudes esperando un hueco para llamar a cada servicio',
+    ('service',),
+))
+admission_shed = registry.register(Counter(
+    'gateway_admission_shed_total',
+    'Solicitudes rechazadas con 503 por cola llena (queue_full) o por esperar demasiado (timeout)',
+    ('service', 'reason'),
+))
+
+# Compresión de respuestas (CompressionMiddleware y cuerpos comprimidos que envían los servicios)
+compressed_responses = registry.register(Counter(
+    'gateway_compressed_responses_total',
+    'Respuestas enviadas comprimidas, por codificación y por quién comprimió (gateway o upstream)',
+    ('encoding', 'source'),
+))
+compression_bytes = registry.register(Counter(
+    'gateway_compression_bytes_total',
+    'Bytes de los cuerpos que comprime el gateway, antes (original) y después (compressed)',
+    ('stage',),
+))
+
+
+def render_metrics():
+    return registry.render()
@@ -0,0 +1,107 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+from .metrics import http_request_duration, http_requests_in_flight
+from .routing import is_proxy_path
+
+
+def _route_label(request):
+    """Nombre de la ruta resuelta (con el servicio en las rutas proxy), nunca la URL completa"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    route = match.url_name or match.view_name or 'unnamed'
+    service = match.kwargs.get('service')
+    return f"{route}:{service}" if service else route
+
+
+class MetricsMiddleware:
+    """
+    Mide la duración de cada solicitud por ruta, método y status, y cuántas hay en curso.
+    Funciona tanto con WSGI como con ASGI sin cambiar de modo
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.monotonic()
+        http_requests_in_flight.inc()
+        try:
+            response = self.get_response(request)
+        finally:
+            http_requests_in_flight.dec()
+        self._observe(request, response, time.monotonic() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.monotonic()
+        http_requests_in_flight.inc()
+        try:
+            response = await self.get_response(request)
+        finally:
+            http_requests_in_flight.dec()
+        self._observe(request, response, time.monotonic() - start)
+        return response
+
+    @staticmethod
+    def _observe(request, response, duration):
+        http_request_duration.observe(
+            duration, route=_route_label(request), method=request.method, status=response.status_code
+        )
+
+
+def _is_lean(request):
+    """Las rutas proxy son JSON con JWT: no necesitan sesión, mensajes, CSRF ni X-Frame-Options"""
+    lean = getattr(request, '_gateway_lean', None)
+    if lean is None:
+        lean = request._gateway_lean = (
+            getattr(settings, 'GATEWAY_LEAN_PROXY', True) and is_proxy_path(request.path_info)
+        )
+    return lean
+
+
+class LeanProxyMixin:
+    """Omite el middleware en las rutas proxy; el resto (admin, login...) lo sigue ejecutando completo"""
+
+    def __call__(self, request):
+        if _is_lean(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class LeanSessionMiddleware(LeanProxyMixin, SessionMiddleware):
+    pass
+
+
+class LeanCsrfViewMiddleware(LeanProxyMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if _is_lean(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class LeanAuthenticationMiddleware(LeanProxyMixin, AuthenticationMiddleware):
+    pass
+
+
+class LeanMessageMiddleware(LeanProxyMixin, MessageMiddleware):
+    pass
+
+
+class LeanXFrameOptionsMiddleware(LeanProxyMixin, XFrameOptionsMiddleware):
+    pass
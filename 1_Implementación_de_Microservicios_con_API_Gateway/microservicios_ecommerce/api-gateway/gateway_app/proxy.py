@@ -1,38 +1,133 @@
 import requests
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework import status
 import logging
 import json
+import threading
+import time
+from functools import partial
+from .access_log import log_access
+from .admission import ServiceOverloaded, get_limiter
+from .breaker import get_breaker
+from .cache import get_response_cache
+from .coalescing import make_key, singleflight
+from .compression import mark_encoded, upstream_encodings
+from .hedging import get_hedger, get_scheduler as get_hedge_scheduler
+from .metrics import compressed_responses, hedge_wins, hedged_requests, proxy_phase_duration, upstream_duration, upstream_in_flight
+from .retry import get_retry_budget, should_retry
+from .routing import get_routing_table
+from .upstream import ConnectionHandle, get_client, track_connection
 
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_SIZE = 64 * 1024
+SUPPORTED_METHODS = ['get', 'post', 'put', 'patch', 'delete']
+
+
+def _iter_and_close(response, chunk_size, decode=True):
+    """Itera el cuerpo del servicio y devuelve la conexión al pool al terminar"""
+    try:
+        if decode:
+            yield from response.iter_content(chunk_size=chunk_size)
+        else:
+            yield from response.raw.stream(chunk_size, decode_content=False)
+    finally:
+        response.close()
+
+
+def _read_encoded(response):
+    """
+    Lee el cuerpo tal como lo envió el servicio, sin descomprimirlo. Los errores de
+    urllib3 se traducen a las excepciones de requests, como hace iter_content
+    """
+    try:
+        response._content = response.raw.read(decode_content=False)
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e)
+    response._content_consumed = True
+
+
+class _HedgeRace:
+    """Estado compartido entre el primer intento (hilo de la solicitud) y el segundo (executor)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.finished = threading.Event()
+        self.closed = False     # El primero ya terminó: no se lanza el segundo
+        self.primary_ok = False
+        self.hedging = False
+        self.response = None
+
+    def start_hedge(self):
+        with self._lock:
+            if self.closed:
+                return False
+            self.hedging = True
+            return True
+
+    def finish_hedge(self, response=None):
+        """Resultado del segundo intento; True si gana porque el primero no ha respondido bien"""
+        with self._lock:
+            won = response is not None and not self.primary_ok
+            if won:
+                self.response = response
+        self.finished.set()
+        return won
+
+    def finish_primary(self, ok):
+        """Indica si hay un segundo intento en juego"""
+        with self._lock:
+            self.closed = True
+            self.primary_ok = ok and self.response is None
+            return self.hedging
+
+
+def _response_text(response):
+    if response.streaming:
+        return '<streaming>'
+    if response.has_header('Content-Encoding'):
+        return f"<{response['Content-Encoding']}>"
+    return response.content.decode('utf-8', errors='replace')
+
 
 class ServiceProxy:
     @staticmethod
-    def forward_request(service, path, request, **kwargs):
-        service_url = settings.SERVICES.get(service.upper())
-        if not service_url:
+    def forward_request(service, path, request, route=None):
+        # Un único registro de acceso por solicitud, con los tiempos del servicio en trace
+        start = time.monotonic()
+        trace = {}
+        if route is None:
+            route = get_routing_table().match(service, path, request.method)
+        response = ServiceProxy._forward(service, path, request, trace, route)
+        duration = time.monotonic() - start
+        if not trace.get('coalesced'):
+            # Lo que no se fue en la llamada al servicio: caché, parseo y construcción de la respuesta
+            upstream = trace.get('upstream_ms', 0) / 1000
+            proxy_phase_duration.observe(max(0.0, duration - upstream), service=service, phase='gateway')
+        log_access(
+            service, request.method, path, response.status_code, duration, trace,
+            request_body=lambda: json.dumps(request.data, default=str),
+            response_body=lambda: _response_text(response),
+        )
+        return response
+
+    @staticmethod
+    def _forward(service, path, request, trace, route):
+        client = get_client(service)
+        if client is None:
             return Response(
                 {"error": f"Servicio '{service}' no configurado"},
                 status=status.HTTP_502_BAD_GATEWAY
             )
 
-        # Importante: si path está vacío, aseguramos que se use la barra al final del servicio_url
-        # Si service_url termina con / y path está vacío, no agregamos otra /
-        if not path and not service_url.endswith('/'):
-            url = f"{service_url}/"
-        else:
-            url = f"{service_url}{path}"
-
         method = request.method.lower()
-
-        # Log detallado para depurar
-        logger.info(f"Forward Request:")
-        logger.info(f"Service: {service}")
-        logger.info(f"Path: '{path}'")
-        logger.info(f"URL Completa: {url}")
-        logger.info(f"Método: {method}")
+        if method not in SUPPORTED_METHODS:
+            return Response({"error": f"Método {method} no soportado"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Preparar headers
         headers = {
@@ -42,48 +137,308 @@ class ServiceProxy:
         if 'HTTP_AUTHORIZATION' in request.META:
             headers['Authorization'] = request.META['HTTP_AUTHORIZATION']
 
-        logger.info(f"Headers: {headers}")
 
         # Preparar datos
         data = None
         if method in ['post', 'put', 'patch'] and request.data:
             data = request.data
-            logger.info(f"Datos: {json.dumps(data)}")
+
+        # Caché de respuestas públicas: vigente -> se responde sin consultar al servicio,
+        # vencida -> se revalida con If-None-Match
+        cache = get_response_cache()
+        cache_key = cache_entry = None
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if cache is not None and cache.applies_to(service, method, route.cache if route else None):
+            cache_key = cache.make_key(service, path, request.query_params)
+            cache_entry, fresh = cache.get_fresh(cache_key)
+            if fresh:
+                trace['cache'] = 'HIT'
+                return cache.respond(cache_entry, 'HIT', request, if_none_match)
+            if cache_entry is not None and cache_entry.etag:
+                headers['If-None-Match'] = cache_entry.etag
+
+        # Circuito abierto: responder de inmediato en lugar de esperar el timeout del servicio
+        breaker = get_breaker(service)
+        if breaker is not None and not breaker.allow_request():
+            trace['breaker'] = breaker.state
+            return Response(
+                {"error": f"Servicio {service} no disponible temporalmente"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(breaker.retry_after())}
+            )
+
+        passthrough = getattr(settings, 'GATEWAY_PASSTHROUGH', True)
+        stream = passthrough and cache_key is None and getattr(settings, 'GATEWAY_STREAM_RESPONSES', False)
+        # Un cuerpo en streaming no se puede compartir entre varias solicitudes
+        coalesce = method == 'get' and not stream and getattr(settings, 'GATEWAY_COALESCE_GETS', True)
+        # Lo que se reenvía sin parsear puede llegar comprimido del servicio y salir tal cual;
+        # lo que se cachea se guarda sin comprimir
+        keep_encoding = upstream_encodings(request) if passthrough and cache_key is None else ()
+        if keep_encoding:
+            headers['Accept-Encoding'] = ', '.join(keep_encoding)
 
         # Realizar la solicitud al servicio
         try:
             if method == 'get':
-                response = requests.get(url, headers=headers, params=request.query_params, timeout=10)
-            elif method == 'post':
-                response = requests.post(url, headers=headers, json=data, timeout=10)
-            elif method == 'put':
-                response = requests.put(url, headers=headers, json=data, timeout=10)
-            elif method == 'patch':
-                response = requests.patch(url, headers=headers, json=data, timeout=10)
-            elif method == 'delete':
-                response = requests.delete(url, headers=headers, timeout=10)
+                send = partial(
+                    ServiceProxy.send, client, breaker, 'get', path, trace, hedger=get_hedger(service),
+                    headers=headers, params=request.query_params, stream=stream, keep_encoding=keep_encoding
+                )
+                if coalesce:
+                    key = make_key(
+                        method, f"{client.name}/{path}", request.query_params,
+                        headers.get('Authorization'), headers.get('If-None-Match'), keep_encoding
+                    )
+                    response = singleflight.do(key, send)
+                    if 'backend' not in trace:
+                        # Otra solicitud idéntica hizo la llamada por esta
+                        trace['coalesced'] = True
+                else:
+                    response = send()
+            elif method in ['post', 'put', 'patch']:
+                response = ServiceProxy.send(
+                    client, breaker, method, path, trace, headers=headers, json=data, stream=stream,
+                    keep_encoding=keep_encoding
+                )
             else:
-                return Response({"error": f"Método {method} no soportado"}, status=status.HTTP_400_BAD_REQUEST)
+                response = ServiceProxy.send(
+                    client, breaker, 'delete', path, trace, headers=headers, stream=stream,
+                    keep_encoding=keep_encoding
+                )
 
-            # Log de la respuesta
-            logger.info(f"Respuesta del servicio {service}:")
-            logger.info(f"Status: {response.status_code}")
-            logger.info(f"Contenido: {response.text[:500]}")
+            if cache_key is not None:
+                if response.status_code == 304 and cache_entry is not None:
+                    cache.revalidated(cache_entry)
+                    trace['cache'] = 'REVALIDATED'
+                    return cache.respond(cache_entry, 'REVALIDATED', request, if_none_match)
+                if response.status_code == 200:
+                    entry = cache.store(
+                        cache_key,
+                        response.content,
+                        response.status_code,
+                        response.headers.get('Content-Type', 'application/json'),
+                        response.headers.get('ETag')
+                    )
+                    if entry is not None:
+                        trace['cache'] = 'MISS'
+                        return cache.respond(entry, 'MISS', request, if_none_match)
+            elif method != 'get' and cache is not None and cache.applies_to(service, 'GET') and response.status_code < 400:
+                # Una escritura en el servicio invalida sus respuestas cacheadas
+                cache.invalidate(service)
+
+            if passthrough:
+                return ServiceProxy.relay_response(response, stream, keep_encoding)
 
             try:
                 data = response.json() if response.content else None
                 return Response(data=data, status=response.status_code)
             except ValueError:
                 # Si no es JSON válido, devolver el texto
-                logger.error(f"Respuesta no es JSON válido: {response.text}")
+                logger.error("Respuesta no es JSON válido del servicio %s", service)
                 return Response(
                     {"error": "Respuesta no válida del servicio", "detail": response.text[:500]},
                     status=status.HTTP_502_BAD_GATEWAY
                 )
 
+        except ServiceOverloaded as e:
+            # Mejor un 503 inmediato que hacer esperar al cliente y saturar más el servicio
+            return Response(
+                {"error": f"Servicio {service} saturado, inténtelo de nuevo más tarde"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(e.retry_after)}
+            )
         except requests.RequestException as e:
-            logger.error(f"Error al comunicarse con el servicio {service}: {str(e)}")
+            logger.error("Error al comunicarse con el servicio %s: %s", service, e)
+            trace['error'] = type(e).__name__
             return Response(
                 {"error": f"Error al comunicarse con el servicio {service}", "detail": str(e)},
                 status=status.HTTP_502_BAD_GATEWAY
-            )
\ No newline at end of file
+            )
+
+    @staticmethod
+    def send(client, breaker, method, path, trace, hedger=None, **kwargs):
+        """
+        Realiza la llamada a uno de los backends del servicio y registra el resultado
+        en el balanceador, en el circuit breaker y en la traza de la solicitud.
+        Con hedger, una llamada que tarda más de lo habitual se duplica en otro backend.
+        Los métodos idempotentes se reintentan ante errores de conexión mientras quede presupuesto.
+        Si el servicio responde con una codificación de keep_encoding, el cuerpo se conserva comprimido.
+        Lanza ServiceOverloaded si el servicio está al límite de llamadas simultáneas
+        """
+        limiter = get_limiter(client.name)
+        if limiter is None:
+            return ServiceProxy._send(client, breaker, method, path, trace, hedger, **kwargs)
+
+        start = time.monotonic()
+        if not limiter.acquire():
+            trace['shed'] = True
+            if breaker is not None:
+                breaker.release_probe()
+            raise ServiceOverloaded(client.name.lower(), limiter.retry_after)
+        trace['queued_ms'] = round((time.monotonic() - start) * 1000, 3)
+        start = time.monotonic()
+        error = True
+        try:
+            response = ServiceProxy._send(client, breaker, method, path, trace, hedger, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            limiter.release(time.monotonic() - start, error)
+
+    @staticmethod
+    def _send(client, breaker, method, path, trace, hedger=None, **kwargs):
+        if hedger is not None and not kwargs.get('stream') and len(client.balancer.backends) > 1:
+            delay = hedger.delay()
+            if delay is not None:
+                return ServiceProxy._send_hedged(client, breaker, method, path, trace, hedger, delay, **kwargs)
+
+        budget = get_retry_budget(client.name)
+        if budget is not None:
+            budget.deposit()
+        tried = []
+        while True:
+            backend = client.balancer.choose(exclude=tried)
+            try:
+                return ServiceProxy._attempt(client, breaker, method, path, backend, trace, hedger, **kwargs)
+            except requests.ConnectionError:
+                # Conexión rechazada o cortada, típico mientras un servicio se reinicia
+                tried.append(backend)
+                if not should_retry(client.name, breaker, method, budget, len(tried)):
+                    raise
+                trace['retries'] = len(tried)
+                time.sleep(budget.backoff(len(tried)))
+
+    @staticmethod
+    def _send_hedged(client, breaker, method, path, trace, hedger, delay, **kwargs):
+        """
+        El primer intento corre en el hilo de la solicitud. Si tras delay segundos no ha
+        terminado, se lanza otro en un backend distinto desde el executor; si ese responde
+        antes, corta la conexión del primero y la solicitud se queda con su respuesta
+        """
+        service = client.name.lower()
+        first = client.balancer.choose()
+        traces = [{}, {}]
+        race = _HedgeRace()
+        handle = ConnectionHandle()
+
+        def hedge():
+            if not race.start_hedge():
+                return
+            hedger.record_hedge()
+            hedged_requests.inc(service=service)
+            second = client.balancer.choose(exclude=(first,))
+            try:
+                response = ServiceProxy._attempt(client, breaker, method, path, second, traces[1], hedger, **kwargs)
+            except requests.RequestException:
+                race.finish_hedge()
+                return
+            if race.finish_hedge(response):
+                traces[0]['aborted'] = True
+                handle.abort()
+            else:
+                response.close()
+
+        timer = get_hedge_scheduler().schedule(delay, hedge)
+        response = error = None
+        try:
+            with track_connection(handle):
+                response = ServiceProxy._attempt(client, breaker, method, path, first, traces[0], hedger, **kwargs)
+        except requests.RequestException as e:
+            error = e
+        timer.cancel()
+
+        if not race.finish_primary(error is None):
+            trace.update(traces[0])
+            if error is not None:
+                raise error
+            return response
+
+        if error is not None:
+            # El primero falló (o lo cortó el segundo): la respuesta depende del segundo
+            race.finished.wait()
+        if race.response is None:
+            trace.update(traces[0])
+            trace['hedge'] = 'lost'
+            if error is not None:
+                raise error
+            return response
+
+        if response is not None:
+            response.close()
+        hedger.record_win()
+        hedge_wins.inc(service=service)
+        trace.update(traces[1])
+        trace['hedge'] = 'won'
+        return race.response
+
+    @staticmethod
+    def _attempt(client, breaker, method, path, backend, trace, hedger=None, **kwargs):
+        url = client.build_url(backend, path)
+        trace['backend'] = backend.url
+
+        service = client.name.lower()
+        keep_encoding = kwargs.pop('keep_encoding', ())
+        stream = kwargs.pop('stream', False)
+        upstream_in_flight.inc(service=service)
+        start = time.monotonic()
+        try:
+            # Para conservar el cuerpo comprimido hay que leerlo de la conexión, sin que requests lo decodifique
+            response = client.request(method, url, stream=stream or bool(keep_encoding), **kwargs)
+            if keep_encoding and not stream:
+                if response.headers.get('Content-Encoding') in keep_encoding:
+                    _read_encoded(response)
+                else:
+                    response.content
+        except requests.RequestException:
+            duration = time.monotonic() - start
+            trace['upstream_ms'] = round(duration * 1000, 3)
+            if trace.get('aborted'):
+                # Cortado porque el segundo intento respondió antes: no es un fallo del backend
+                client.balancer.release(backend, duration, error=False)
+                raise
+            client.balancer.release(backend, duration, error=True)
+            if breaker is not None:
+                breaker.record(True, duration)
+            upstream_duration.observe(duration, service=service, method=method.upper(), status='error')
+            raise
+        finally:
+            upstream_in_flight.dec(service=service)
+
+        duration = time.monotonic() - start
+        trace['upstream_ms'] = round(duration * 1000, 3)
+        error = response.status_code >= 500
+        client.balancer.release(backend, duration, error=error)
+        if breaker is not None:
+            breaker.record(error, duration)
+        if hedger is not None:
+            hedger.observe(duration)
+
+        upstream_duration.observe(duration, service=service, method=method.upper(), status=response.status_code)
+        # elapsed llega hasta los headers; sin streaming el resto es la descarga del cuerpo
+        headers_time = response.elapsed.total_seconds()
+        proxy_phase_duration.observe(headers_time, service=service, phase='headers')
+        if not stream:
+            proxy_phase_duration.observe(max(0.0, duration - headers_time), service=service, phase='body')
+        return response
+
+    @staticmethod
+    def relay_response(response, stream=False, keep_encoding=()):
+        """
+        Devuelve la respuesta del servicio sin parsearla: mismos bytes, status y content-type.
+        Un cuerpo comprimido en una codificación de keep_encoding se reenvía sin descomprimir
+        """
+        content_type = response.headers.get('Content-Type', 'application/json')
+        encoding = response.headers.get('Content-Encoding')
+        encoded = encoding in keep_encoding
+        if stream:
+            relayed = StreamingHttpResponse(
+                _iter_and_close(response, STREAM_CHUNK_SIZE, decode=not encoded),
+                status=response.status_code,
+                content_type=content_type
+            )
+        else:
+            relayed = HttpResponse(response.content, status=response.status_code, content_type=content_type)
+        if encoded:
+            compressed_responses.inc(encoding=encoding, source='upstream')
+            mark_encoded(relayed, encoding)
+        return relayed
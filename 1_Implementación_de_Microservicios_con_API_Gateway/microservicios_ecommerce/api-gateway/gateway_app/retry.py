@@ -0,0 +1,133 @@
+import random
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import retries, retries_exhausted
+
+DEFAULTS = {
+    'ENABLED': True,
+    'METHODS': ['GET', 'PUT', 'DELETE'],    # Solo métodos idempotentes
+    'MAX_ATTEMPTS': 3,      # Intentos totales por llamada, incluido el primero
+    'BASE_DELAY': 0.05,     # Segundos de espera base; se duplica en cada reintento
+    'MAX_DELAY': 1.0,
+    'BUDGET_RATIO': 0.2,    # Cada llamada aporta esta fracción de reintento al presupuesto
+    'BUDGET_RESERVE': 10,   # Máximo de reintentos acumulados (y saldo inicial)
+}
+
+
+class RetryBudget:
+    """
+    Presupuesto de reintentos de un servicio: cada llamada deposita BUDGET_RATIO y cada
+    reintento gasta uno, así que los reintentos nunca superan esa proporción del tráfico
+    (más la reserva) aunque el servicio esté caído
+    """
+
+    def __init__(self, name, methods, max_attempts, base_delay, max_delay, ratio, reserve):
+        self.name = name
+        self.methods = frozenset(method.upper() for method in methods)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.ratio = ratio
+        self.reserve = reserve
+
+        self._lock = threading.Lock()
+        self._balance = float(reserve)
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def allows(self, method):
+        return method.upper() in self.methods
+
+    def deposit(self):
+        with self._lock:
+            self.requests += 1
+            self._balance = min(self.reserve, self._balance + self.ratio)
+
+    def withdraw(self):
+        """Reserva un reintento; False si el presupuesto está agotado"""
+        with self._lock:
+            if self._balance < 1:
+                self.exhausted += 1
+                return False
+            self._balance -= 1
+            self.retries += 1
+            return True
+
+    def backoff(self, attempt):
+        """Espera exponencial con jitter completo antes del reintento número attempt (desde 1)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'exhausted': self.exhausted,
+                'balance': round(self._balance, 2),
+            }
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GATEWAY_RETRY', {})}
+
+
+def get_retry_budget(service):
+    """Devuelve el presupuesto de reintentos de un servicio, o None si los reintentos están desactivados"""
+    name = service.lower()
+    budget = _budgets.get(name)
+    if budget is None:
+        config = get_config()
+        if not config['ENABLED']:
+            return None
+        with _budgets_lock:
+            budget = _budgets.get(name)
+            if budget is None:
+                budget = _budgets[name] = RetryBudget(
+                    name,
+                    methods=config['METHODS'],
+                    max_attempts=config['MAX_ATTEMPTS'],
+                    base_delay=config['BASE_DELAY'],
+                    max_delay=config['MAX_DELAY'],
+                    ratio=config['BUDGET_RATIO'],
+                    reserve=config['BUDGET_RESERVE'],
+                )
+    return budget
+
+
+def should_retry(service, breaker, method, budget, attempts):
+    """Decide si una llamada que falló attempts veces se reintenta, gastando presupuesto si es así"""
+    if budget is None or not budget.allows(method) or attempts >= budget.max_attempts:
+        return False
+    service = service.lower()
+    if not budget.withdraw():
+        retries_exhausted.inc(service=service)
+        return False
+    # Si el circuito se abrió entre medias no tiene sentido insistir
+    if breaker is not None and not breaker.allow_request():
+        return False
+    retries.inc(service=service)
+    return True
+
+
+def retry_stats():
+    return {name: budget.snapshot() for name, budget in list(_budgets.items())}
+
+
+def reset_retry_budgets():
+    with _budgets_lock:
+        _budgets.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_config_change(setting, **kwargs):
+    if setting == 'GATEWAY_RETRY':
+        reset_retry_budgets()
@@ -0,0 +1,184 @@
+import re
+import threading
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+AUTH_POLICIES = ('public', 'authenticated', 'internal')
+
+# Rutas propias del gateway bajo /api/; el proxy se resuelve antes y no debe taparlas
+RESERVED_NAMES = frozenset({'token', 'gateway', 'resumen', 'batch'})
+
+
+def has_dot_segments(path):
+    """
+    Indica si la ruta tiene segmentos '.' o '..', también codificados (%2e%2e, %252e...).
+    El cliente HTTP los resuelve antes de enviar la solicitud, así que una ruta pública
+    seguida de '..' llegaría al servicio como otra ruta sin haber pasado por su política
+    """
+    for segment in path.split('/'):
+        previous = None
+        while segment != previous:
+            previous, segment = segment, unquote(segment)
+        if any(part in ('.', '..') for part in re.split(r'[/\\]', segment)):
+            return True
+    return False
+
+
+class Route:
+    """Política de una ruta proxy: métodos a los que aplica, autenticación y caché"""
+    __slots__ = ('service', 'prefix', 'methods', 'auth', 'cache')
+
+    def __init__(self, service, prefix='', methods=None, auth='authenticated', cache=None):
+        if auth not in AUTH_POLICIES:
+            raise ImproperlyConfigured(f"Política de autenticación desconocida para {service}: {auth}")
+        self.service = service
+        self.prefix = prefix
+        self.methods = frozenset(method.upper() for method in methods) if methods else None
+        self.auth = auth
+        # None: se decide con GATEWAY_CACHE['SERVICES']
+        self.cache = cache
+
+    @property
+    def public(self):
+        return self.auth == 'public'
+
+    @property
+    def internal(self):
+        """Ruta solo para llamadas entre servicios: el gateway no la reenvía nunca"""
+        return self.auth == 'internal'
+
+    def allows(self, method):
+        return self.methods is None or method in self.methods
+
+    def __repr__(self):
+        methods = ','.join(sorted(self.methods)) if self.methods else '*'
+        return f"<Route {self.service}/{self.prefix} {methods} {self.auth}>"
+
+
+class _Node:
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children = {}
+        self.routes = []
+
+
+class RoutingTable:
+    """
+    Trie de segmentos de ruta: servicio -> segmentos del prefijo. Cada servicio de
+    settings.SERVICES tiene una ruta por defecto (autenticada) y las de GATEWAY_ROUTES
+    la refinan por prefijo y método; gana la más específica que admita el método
+    """
+
+    def __init__(self, services, routes):
+        self._root = _Node()
+        for entry in routes:
+            service = entry['SERVICE'].lower()
+            if service not in services:
+                # Política de un servicio que no está desplegado: no hay nada que enrutar
+                continue
+            self.add(Route(
+                service,
+                prefix=entry.get('PREFIX', '').strip('/'),
+                methods=entry.get('METHODS'),
+                auth=entry.get('AUTH', 'authenticated'),
+                cache=entry.get('CACHE'),
+            ))
+        for service in services:
+            if service in RESERVED_NAMES:
+                raise ImproperlyConfigured(f"El nombre de servicio '{service}' está reservado por el gateway")
+            self.add(Route(service))
+
+    def add(self, route):
+        node = self._root.children.setdefault(route.service, _Node())
+        for segment in filter(None, route.prefix.split('/')):
+            node = node.children.setdefault(segment, _Node())
+        node.routes.append(route)
+
+    def has_service(self, service):
+        return service in self._root.children
+
+    def match(self, service, path, method):
+        """Devuelve la ruta que se aplica a la solicitud, o None si el servicio no existe o la ruta no es válida"""
+        node = self._root.children.get(service)
+        if node is None or has_dot_segments(path):
+            return None
+        best = self._pick(node, method)
+        # Los segmentos vacíos se ignoran igual que al registrar las rutas: 'productos//reservar/'
+        # llega al servicio como 'productos/reservar/' y debe tener la misma política
+        for segment in filter(None, path.split('/')):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            best = self._pick(node, method) or best
+        return best
+
+    @staticmethod
+    def _pick(node, method):
+        for route in node.routes:
+            if route.allows(method):
+                return route
+        return None
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_routing_table():
+    """Tabla compilada a partir de settings.SERVICES y settings.GATEWAY_ROUTES"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                services = [name.lower() for name in settings.SERVICES]
+                _table = RoutingTable(services, getattr(settings, 'GATEWAY_ROUTES', []))
+    return _table
+
+
+@receiver(setting_changed)
+def _reset_table(setting, **kwargs):
+    global _table
+    if setting in ('SERVICES', 'GATEWAY_ROUTES'):
+        _table = None
+
+
+def is_proxy_path(path, prefix='/api/'):
+    """Indica si la ruta (path_info) corresponde a un servicio del proxy"""
+    if not path.startswith(prefix):
+        return False
+    return get_routing_table().has_service(path[len(prefix):].partition('/')[0])
+
+
+class ServiceRoutePattern:
+    """
+    Patrón de URL para path(): resuelve '<prefijo><servicio>/<ruta>' consultando la tabla
+    de rutas en lugar de una expresión regular. La regex solo se usa para reverse()
+    """
+    converters = {}
+
+    def __init__(self, route, name=None, is_endpoint=True):
+        self._route = route
+        self.name = name
+        self.regex = re.compile(rf'^{re.escape(route)}(?P<service>[^/]+)/(?P<path>.*)$')
+
+    def match(self, path):
+        if not path.startswith(self._route):
+            return None
+        service, _, rest = path[len(self._route):].partition('/')
+        if not get_routing_table().has_service(service) or has_dot_segments(rest):
+            return None
+        return '', (), {'service': service, 'path': rest}
+
+    def check(self):
+        return []
+
+    def describe(self):
+        return f"'{self}'" + (f" [name='{self.name}']" if self.name else '')
+
+    def __str__(self):
+        return f"{self._route}<service>/<path>"
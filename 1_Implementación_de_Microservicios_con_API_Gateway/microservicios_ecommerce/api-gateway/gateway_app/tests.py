@@ -1,3 +1,1334 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework.test import APIClient
+
+from .access_log import log_access
+from .admission import ConcurrencyLimiter, get_limiter, reset_limiters
+from .async_proxy import close_async_clients
+from .authentication import CachedJWTAuthentication, StatelessJWTAuthentication, get_token_cache
+from .balancer import HealthChecker, LoadBalancer
+from .breaker import CircuitBreaker, get_breaker, reset_breakers
+from .cache import get_response_cache
+from .coalescing import SingleFlight, async_singleflight, make_key
+from .compression import accepted_encodings, negotiate
+from .hedging import Hedger, get_hedger, reset_hedgers
+from .loadtest import Scenario, StubProfile, StubServer, percentile, run_load, summarize
+from .metrics import Histogram, registry, render_metrics
+from .proxy import ServiceProxy
+from .retry import RetryBudget, reset_retry_budgets
+from .routing import RoutingTable
+from .tokens import refresh_locally
+from .upstream import DEFAULTS, ConnectionHandle, get_client, get_service_config, reset_clients, track_connection
+from .views import async_proxy_view
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Servicio falso que responde JSON con keep-alive"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests_seen += 1
+        body = json.dumps({"path": self.path}).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_json(200, body, ETag=etag)
+
+    def do_POST(self):
+        self.server.requests_seen += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        self.send_json(201, self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, body, **headers):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def gateway_stats():
+    """/api/gateway/stats/ consultado por un usuario staff"""
+    client = APIClient()
+    client.force_authenticate(user=User(username='admin', is_staff=True))
+    return client.get('/api/gateway/stats/').json()
+
+
+class StubServiceMixin:
+    handler_class = StubHandler
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), cls.handler_class)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/api/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests_seen = 0
+        reset_clients()
+        reset_breakers()
+        self.addCleanup(reset_clients)
+        cache = get_response_cache()
+        if cache is not None:
+            cache.clear()
+
+
+class ServiceConfigTestCase(SimpleTestCase):
+    @override_settings(SERVICES={'PRODUCTOS': 'http://productos-service:8000/api/'})
+    def test_url_simple(self):
+        """Una entrada con solo la URL recibe los valores por defecto del pool"""
+        config = get_service_config('productos')
+        self.assertEqual(config['URL'], 'http://productos-service:8000/api/')
+        self.assertEqual(config['POOL_SIZE'], 10)
+        self.assertTrue(config['KEEP_ALIVE'])
+
+    @override_settings(SERVICES={})
+    def test_servicio_no_configurado(self):
+        self.assertIsNone(get_service_config('ordenes'))
+        self.assertIsNone(get_client('ordenes'))
+
+
+class RoutingTableTestCase(StubServiceMixin, SimpleTestCase):
+    def test_gana_la_ruta_mas_especifica(self):
+        table = RoutingTable(['productos', 'usuarios'], [
+            {'SERVICE': 'productos', 'METHODS': ['GET'], 'AUTH': 'public'},
+            {'SERVICE': 'productos', 'PREFIX': 'productos/admin', 'AUTH': 'authenticated'},
+            {'SERVICE': 'usuarios', 'METHODS': ['POST'], 'AUTH': 'public'},
+        ])
+        self.assertTrue(table.match('productos', 'productos/1/', 'GET').public)
+        self.assertFalse(table.match('productos', 'productos/admin/stock/', 'GET').public)
+        self.assertFalse(table.match('productos', 'productos/1/', 'DELETE').public)
+        self.assertTrue(table.match('usuarios', 'usuarios/', 'POST').public)
+        self.assertFalse(table.match('usuarios', 'usuarios/me/', 'GET').public)
+        self.assertIsNone(table.match('pagos', '', 'GET'))
+        self.assertFalse(table.match('productos', 'productos//admin/stock/', 'GET').public)
+
+    def test_segmentos_punto_no_salen_de_la_ruta_publica(self):
+        """'public/../ordenes/1/' no debe heredar la política pública: requests resuelve el '..' antes de enviar"""
+        table = RoutingTable(['ordenes'], [{'SERVICE': 'ordenes', 'PREFIX': 'public/', 'AUTH': 'public'}])
+        self.assertTrue(table.match('ordenes', 'public/1/', 'GET').public)
+        for path in ('public/../ordenes/1/', 'public/%2e%2e/ordenes/1/', 'public/%252E%252e/ordenes/1/',
+                     'public/./x/', 'public/..%2fordenes/1/'):
+            self.assertIsNone(table.match('ordenes', path, 'GET'), path)
+
+        routes = [{'SERVICE': 'ordenes', 'PREFIX': 'public/', 'AUTH': 'public'}]
+        with self.settings(SERVICES={'ORDENES': {'URL': self.base_url}}, GATEWAY_ROUTES=routes):
+            self.assertEqual(APIClient().get('/api/ordenes/public/1/').status_code, 200)
+            seen = self.server.requests_seen
+            self.assertEqual(APIClient().get('/api/ordenes/public/../ordenes/1/').status_code, 404)
+            self.assertEqual(APIClient().get('/api/ordenes/public/%2e%2e/ordenes/1/').status_code, 404)
+            self.assertEqual(self.server.requests_seen, seen)
+
+    def test_rutas_internas_no_se_reenvian(self):
+        routes = [
+            {'SERVICE': 'productos', 'METHODS': ['GET'], 'AUTH': 'public'},
+            {'SERVICE': 'productos', 'PREFIX': 'productos/reservar', 'AUTH': 'internal'},
+        ]
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_ROUTES=routes):
+            client = APIClient()
+            client.force_authenticate(user=User(username='cliente'))
+            for url in ('/api/productos/productos/reservar/', '/api/productos/productos//reservar/',
+                        '/api/productos//productos/reservar'):
+                response = client.post(url, {'items': []}, format='json')
+                self.assertEqual(response.status_code, 403, url)
+            batch = client.post('/api/batch/', {'requests': [
+                {'method': 'POST', 'service': 'productos', 'path': 'productos/reservar/', 'body': {'items': []}},
+            ]}, format='json')
+            self.assertEqual(batch.json()['results'][0]['status'], 403)
+            self.assertEqual(self.server.requests_seen, 0)
+
+    def test_nombre_reservado(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RoutingTable(['batch'], [])
+
+    def test_nuevo_servicio_solo_con_configuracion(self):
+        """Un cuarto servicio se publica en /api/<servicio>/ sin tocar el URLconf"""
+        routes = [{'SERVICE': 'pagos', 'PREFIX': 'tarifas', 'METHODS': ['GET'], 'AUTH': 'public'}]
+        with self.settings(SERVICES={'PAGOS': {'URL': self.base_url}}, GATEWAY_ROUTES=routes):
+            self.assertEqual(reverse('proxy', kwargs={'service': 'pagos', 'path': 'tarifas/'}), '/api/pagos/tarifas/')
+            self.assertEqual(APIClient().get('/api/pagos/tarifas/').status_code, 200)
+            self.assertEqual(APIClient().get('/api/pagos/cobros/').status_code, 401)
+            self.assertEqual(APIClient().get('/api/productos/productos/').status_code, 404)
+
+
+class LeanProxyMiddlewareTestCase(StubServiceMixin, SimpleTestCase):
+    def get(self, url):
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_CACHE={'ENABLED': False}):
+            return APIClient().get(url)
+
+    def test_rutas_proxy_sin_sesion_ni_clickjacking(self):
+        response = self.get('/api/productos/productos/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertNotIn('session', response.wsgi_request.__dict__)
+
+    def test_resto_de_rutas_con_pila_completa(self):
+        response = self.get('/api/gateway/stats/')
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+
+    @override_settings(GATEWAY_LEAN_PROXY=False)
+    def test_desactivado(self):
+        self.assertEqual(self.get('/api/productos/productos/')['X-Frame-Options'], 'DENY')
+
+
+class UpstreamPoolTestCase(StubServiceMixin, SimpleTestCase):
+    def test_reutiliza_conexiones(self):
+        """Las solicitudes consecutivas reutilizan la misma conexión keep-alive"""
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}):
+            client = get_client('productos')
+            for _ in range(3):
+                response = client.request('get', f"{self.base_url}productos/")
+                self.assertEqual(response.status_code, 200)
+
+        stats = client.stats.snapshot()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_descarta_conexiones_ociosas(self):
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url, 'IDLE_TIMEOUT': 0}}):
+            client = get_client('productos')
+            client.request('get', f"{self.base_url}productos/")
+            client.request('get', f"{self.base_url}productos/")
+
+        stats = client.stats.snapshot()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+
+    def test_no_corta_conexiones_devueltas_al_pool(self):
+        """Tras devolver la conexión al pool, abortar la llamada no afecta a la siguiente que la reutiliza"""
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}):
+            client = get_client('productos')
+            handle = ConnectionHandle()
+            with track_connection(handle):
+                self.assertEqual(client.request('get', f"{self.base_url}productos/").status_code, 200)
+            self.assertIsNone(handle.conn)
+
+            handle.abort()
+            self.assertEqual(client.request('get', f"{self.base_url}productos/").status_code, 200)
+
+        stats = client.stats.snapshot()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+
+class PassthroughTestCase(StubServiceMixin, SimpleTestCase):
+    def get_productos(self, **extra_settings):
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_CACHE={'ENABLED': False},
+                           **extra_settings):
+            return APIClient().get('/api/productos/productos/')
+
+    def test_reenvia_bytes_sin_modificar(self):
+        """El cuerpo llega al cliente exactamente como lo generó el servicio"""
+        response = self.get_productos()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, json.dumps({"path": "/api/productos/"}).encode())
+
+    def test_reenvio_en_streaming(self):
+        response = self.get_productos(GATEWAY_STREAM_RESPONSES=True)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), json.dumps({"path": "/api/productos/"}).encode())
+
+    def test_modo_clasico(self):
+        """Sin passthrough la respuesta se vuelve a renderizar con DRF"""
+        response = self.get_productos(GATEWAY_PASSTHROUGH=False)
+        self.assertEqual(response.json(), {"path": "/api/productos/"})
+
+
+@override_settings(GATEWAY_CACHE={'TTL': 60})
+class ResponseCacheTestCase(StubServiceMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        settings_override = self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_segunda_lectura_desde_cache(self):
+        """Solo la primera lectura del catálogo llega al servicio de productos"""
+        first = self.client.get('/api/productos/productos/', {'categoria': '1'})
+        second = self.client.get('/api/productos/productos/', {'categoria': '1'})
+
+        self.assertEqual(first['X-Gateway-Cache'], 'MISS')
+        self.assertEqual(second['X-Gateway-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.server.requests_seen, 1)
+
+    def test_parametros_distintos_no_comparten_entrada(self):
+        self.client.get('/api/productos/productos/', {'categoria': '1'})
+        self.client.get('/api/productos/productos/', {'categoria': '2'})
+        self.assertEqual(self.server.requests_seen, 2)
+
+    def test_if_none_match_del_cliente(self):
+        first = self.client.get('/api/productos/productos/')
+        response = self.client.get('/api/productos/productos/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_revalida_entrada_vencida(self):
+        with self.settings(GATEWAY_CACHE={'TTL': 0}):
+            self.client.get('/api/productos/productos/')
+            response = self.client.get('/api/productos/productos/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Gateway-Cache'], 'REVALIDATED')
+        self.assertEqual(response.json(), {"path": "/api/productos/"})
+
+    def test_lru_acotada(self):
+        with self.settings(GATEWAY_CACHE={'MAX_ENTRIES': 2}):
+            for categoria in ['1', '2', '3']:
+                self.client.get('/api/productos/productos/', {'categoria': categoria})
+            self.assertEqual(get_response_cache().snapshot()['evictions'], 1)
+
+    def test_escritura_invalida_cache(self):
+        self.client.get('/api/productos/productos/')
+        self.client.force_authenticate(user=User(username='admin'))
+        self.client.post('/api/productos/productos/', {"nombre": "Nuevo"}, format='json')
+        response = self.client.get('/api/productos/productos/')
+
+        self.assertEqual(response['X-Gateway-Cache'], 'MISS')
+        self.assertEqual(self.server.requests_seen, 3)
+
+    def test_lectura_sin_cache_no_invalida(self):
+        """Un GET de una ruta con CACHE False no es una escritura: la caché del servicio sigue intacta"""
+        routes = [
+            {'SERVICE': 'productos', 'METHODS': ['GET'], 'AUTH': 'public', 'CACHE': True},
+            {'SERVICE': 'productos', 'PREFIX': 'productos/stock', 'METHODS': ['GET'], 'AUTH': 'public', 'CACHE': False},
+        ]
+        with self.settings(GATEWAY_ROUTES=routes):
+            self.client.get('/api/productos/productos/')
+            self.client.get('/api/productos/productos/stock/')
+            response = self.client.get('/api/productos/productos/')
+
+        self.assertEqual(response['X-Gateway-Cache'], 'HIT')
+        self.assertEqual(self.server.requests_seen, 2)
+
+    async def test_proxy_asincrono_comparte_la_cache(self):
+        """La vista ASGI usa la misma caché que el proxy síncrono y sus escrituras la invalidan"""
+        factory = AsyncRequestFactory()
+        token = AccessToken()
+        token['user_id'] = 7
+
+        async def get():
+            return await async_proxy_view(factory.get('/api/productos/productos/'), service='productos', path='productos/')
+
+        self.assertEqual((await get())['X-Gateway-Cache'], 'MISS')
+        self.assertEqual((await get())['X-Gateway-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/productos/productos/')['X-Gateway-Cache'], 'HIT')
+        self.assertEqual(self.server.requests_seen, 1)
+
+        request = factory.post('/api/productos/productos/', {'nombre': 'Libro'}, content_type='application/json',
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual((await async_proxy_view(request, service='productos', path='productos/')).status_code, 201)
+        self.assertEqual((await get())['X-Gateway-Cache'], 'MISS')
+        self.assertEqual(self.server.requests_seen, 3)
+        await close_async_clients()
+
+
+class CompressionHandler(StubHandler):
+    """Catálogo grande; en /api/gzip/ lo envía comprimido si el cliente acepta gzip"""
+
+    def do_GET(self):
+        self.server.requests_seen += 1
+        self.server.accept_encoding = self.headers.get('Accept-Encoding')
+        body = json.dumps([{"id": i, "nombre": f"Producto {i}"} for i in range(200)]).encode()
+        if self.path.startswith('/api/gzip/') and 'gzip' in (self.server.accept_encoding or ''):
+            self.server.sent = gzip.compress(body)
+            self.send_json(200, self.server.sent, **{'Content-Encoding': 'gzip'})
+        else:
+            self.send_json(200, body)
+
+
+class CompressionTestCase(StubServiceMixin, SimpleTestCase):
+    handler_class = CompressionHandler
+
+    def get(self, url, **extra):
+        services = {'PRODUCTOS': {'URL': self.base_url}, 'ORDENES': {'URL': self.base_url}}
+        with self.settings(SERVICES=services):
+            client = APIClient()
+            client.force_authenticate(user=User(username='cliente'))
+            return client.get(url, **extra)
+
+    def test_negociacion(self):
+        self.assertEqual(accepted_encodings('gzip;q=0.5, br'), ['br', 'gzip'])
+        self.assertEqual(accepted_encodings('br;q=0, gzip'), ['gzip'])
+        self.assertEqual(accepted_encodings('*'), ['br', 'gzip'])
+        self.assertEqual(accepted_encodings('identity'), [])
+        self.assertEqual(negotiate('br, gzip', available=('gzip',)), 'gzip')
+        self.assertIsNone(negotiate('deflate'))
+
+    def test_comprime_respuesta_grande(self):
+        response = self.get('/api/ordenes/ordenes/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 200)
+
+    def test_sin_accept_encoding_no_comprime(self):
+        response = self.get('/api/ordenes/gzip/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(response.json()), 200)
+
+    def test_respuesta_pequena_sin_comprimir(self):
+        with self.settings(GATEWAY_COMPRESSION={'MIN_SIZE': 1024 * 1024}):
+            response = self.get('/api/ordenes/ordenes/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_reenvia_cuerpo_comprimido_del_servicio(self):
+        """El cuerpo gzip del servicio llega al cliente byte a byte, sin recomprimir"""
+        response = self.get('/api/ordenes/gzip/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(self.server.accept_encoding, 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response.content, self.server.sent)
+
+    def test_reenvio_comprimido_en_streaming(self):
+        with self.settings(GATEWAY_STREAM_RESPONSES=True):
+            response = self.get('/api/ordenes/gzip/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(b''.join(response.streaming_content), self.server.sent)
+
+    def test_cache_guarda_variante_comprimida(self):
+        cache = get_response_cache()
+        first = self.get('/api/productos/productos/', HTTP_ACCEPT_ENCODING='gzip')
+        stored = cache.snapshot()['bytes']
+        second = self.get('/api/productos/productos/', HTTP_ACCEPT_ENCODING='gzip')
+        plain = self.get('/api/productos/productos/')
+
+        self.assertEqual(second['X-Gateway-Cache'], 'HIT')
+        self.assertEqual(second['Content-Encoding'], 'gzip')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(cache.snapshot()['bytes'], stored)
+        self.assertEqual(len(plain.json()), 200)
+        self.assertEqual(self.server.requests_seen, 1)
+
+    async def test_proxy_asincrono_reenvia_cuerpo_comprimido(self):
+        factory = AsyncRequestFactory()
+        for stream in (False, True):
+            with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_CACHE={'ENABLED': False},
+                               GATEWAY_STREAM_RESPONSES=stream):
+                request = factory.get('/api/productos/gzip/', headers={'Accept-Encoding': 'gzip'})
+                response = await async_proxy_view(request, service='productos', path='gzip/')
+                if stream:
+                    body = b''.join([chunk async for chunk in response.streaming_content])
+                else:
+                    body = response.content
+                await close_async_clients()
+
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(body, self.server.sent)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def test_agrupa_solicitudes_identicas(self):
+        """Mientras una llamada está en curso, las idénticas esperan su resultado"""
+        group = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return 'respuesta'
+
+        threads = [
+            threading.Thread(target=lambda: results.append(group.do('clave', upstream)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        while group.snapshot()['coalesced'] < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['respuesta'] * 5)
+        self.assertEqual(group.snapshot(), {'leaders': 1, 'coalesced': 4, 'in_flight': 0})
+
+    def test_error_compartido(self):
+        group = SingleFlight()
+
+        def upstream():
+            raise ValueError('caído')
+
+        with self.assertRaises(ValueError):
+            group.do('clave', upstream)
+        self.assertEqual(group.snapshot()['in_flight'], 0)
+
+    def test_alcance_por_token(self):
+        self.assertNotEqual(
+            make_key('get', '/api/productos/', None, 'Bearer a'),
+            make_key('get', '/api/productos/', None, 'Bearer b'),
+        )
+
+
+class LoadBalancerTestCase(StubServiceMixin, SimpleTestCase):
+    def make_balancer(self, urls, strategy='round_robin'):
+        config = {**DEFAULTS, 'URLS': urls, 'BALANCER': strategy, 'HEALTH_CHECK_INTERVAL': 0}
+        return LoadBalancer('PRODUCTOS', config)
+
+    def test_round_robin(self):
+        balancer = self.make_balancer(['http://a/api/', 'http://b/api/'])
+        urls = []
+        for _ in range(4):
+            backend = balancer.choose()
+            balancer.release(backend, 0.01)
+            urls.append(backend.url)
+        self.assertEqual(urls, ['http://a/api/', 'http://b/api/'] * 2)
+
+    def test_menos_solicitudes_pendientes(self):
+        balancer = self.make_balancer(['http://a/api/', 'http://b/api/'], 'least_outstanding')
+        busy = balancer.choose()
+        self.assertNotEqual(balancer.choose(), busy)
+
+    def test_ewma_prefiere_backend_rapido(self):
+        balancer = self.make_balancer(['http://a/api/', 'http://b/api/'], 'ewma')
+        slow, fast = balancer.backends
+        balancer.release(balancer.choose(exclude=[fast]), 0.5)
+        balancer.release(balancer.choose(exclude=[slow]), 0.01)
+        self.assertEqual(balancer.choose(), fast)
+
+    def test_ewma_penaliza_errores_rapidos(self):
+        """Un backend que falla al instante no debe parecer el más rápido"""
+        balancer = self.make_balancer(['http://a/api/', 'http://b/api/'], 'ewma')
+        failing, ok = balancer.backends
+        balancer.release(balancer.choose(exclude=[ok]), 0.001, error=True)
+        balancer.release(balancer.choose(exclude=[failing]), 0.05)
+        for _ in range(3):
+            backend = balancer.choose()
+            self.assertEqual(backend, ok)
+            balancer.release(backend, 0.05)
+
+    def test_ewma_backend_nuevo_o_recuperado_parte_de_la_media(self):
+        balancer = self.make_balancer(['http://a/api/', 'http://b/api/', 'http://c/api/'], 'ewma')
+        a, b, c = balancer.backends
+        balancer.release(balancer.choose(exclude=[b, c]), 0.1)
+        balancer.release(balancer.choose(exclude=[a, c]), 0.3)
+        self.assertAlmostEqual(b.ewma, 0.3 * 0.3 + 0.7 * 0.1)  # b partió de la latencia de a, no de 0
+        balancer.choose(exclude=[a, b])
+        self.assertAlmostEqual(c.ewma, (a.ewma + b.ewma) / 2)
+
+        balancer.mark(b, False, 1, 1)
+        balancer.release(b, 0.01, error=True)
+        self.assertGreater(b.ewma, 0.3)
+        balancer.mark(b, True, 1, 1)
+        self.assertAlmostEqual(b.ewma, (a.ewma + c.ewma) / 2)
+
+    def test_health_check_saca_backend_caido(self):
+        """Un backend que no responde sale de la rotación y el tráfico va al sano"""
+        balancer = self.make_balancer([self.base_url, 'http://127.0.0.1:9/api/'])
+        checker = HealthChecker(balancer, {**DEFAULTS, 'HEALTH_CHECK_TIMEOUT': 1})
+        for _ in range(2):
+            for backend in balancer.backends:
+                balancer.mark(backend, checker.check(backend), 1, 2)
+
+        self.assertEqual([b.healthy for b in balancer.backends], [True, False])
+        self.assertEqual({balancer.choose().url for _ in range(3)}, {self.base_url})
+
+    def test_proxy_reparte_entre_backends(self):
+        client = APIClient()
+        services = {'PRODUCTOS': {'URLS': [self.base_url, self.base_url.replace('127.0.0.1', 'localhost')],
+                                  'HEALTH_CHECK_INTERVAL': 0}}
+        with self.settings(SERVICES=services, GATEWAY_CACHE={'ENABLED': False}):
+            for _ in range(4):
+                self.assertEqual(client.get('/api/productos/productos/').status_code, 200)
+            stats = gateway_stats()
+
+        self.assertEqual([b['requests'] for b in stats['backends']['PRODUCTOS']['backends']], [2, 2])
+
+
+class SlowStubHandler(StubHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        super().do_GET()
+
+
+class HedgingTestCase(StubServiceMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.slow_server = ThreadingHTTPServer(('127.0.0.1', 0), SlowStubHandler)
+        cls.slow_server.daemon_threads = True
+        threading.Thread(target=cls.slow_server.serve_forever, daemon=True).start()
+        cls.slow_url = f"http://127.0.0.1:{cls.slow_server.server_port}/api/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.slow_server.shutdown()
+        cls.slow_server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.slow_server.requests_seen = 0
+        reset_hedgers()
+        self.addCleanup(reset_hedgers)
+
+    def get_productos(self, **hedging):
+        services = {'PRODUCTOS': {'URLS': [self.slow_url, self.base_url], 'HEALTH_CHECK_INTERVAL': 0}}
+        hedging = {'SERVICES': ['productos'], 'MIN_SAMPLES': 1, 'MIN_DELAY': 0.05, 'MAX_RATE': 1, **hedging}
+        with self.settings(SERVICES=services, GATEWAY_CACHE={'ENABLED': False}, GATEWAY_COALESCE_GETS=False,
+                           GATEWAY_HEDGING=hedging):
+            get_hedger('productos').observe(0.01)
+            start = time.monotonic()
+            response = APIClient().get('/api/productos/productos/')
+            return response, time.monotonic() - start, get_hedger('productos').snapshot()
+
+    def test_percentil(self):
+        hedger = Hedger('productos', percentile=90, min_delay=0, window=100, min_samples=10, max_rate=1)
+        for duration in range(1, 11):
+            self.assertIsNone(hedger.delay())
+            hedger.observe(duration / 100)
+        self.assertEqual(hedger.delay(), 0.09)
+
+    def test_segundo_intento_gana(self):
+        """El primer backend tarda 0.5 s: el duplicado en el otro backend responde antes"""
+        response, elapsed, stats = self.get_productos()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(stats['hedged'], 1)
+        self.assertEqual(stats['wins'], 1)
+        self.assertEqual(self.server.requests_seen, 1)
+
+    def test_primer_intento_en_el_hilo_de_la_solicitud(self):
+        """Solo el duplicado usa el executor: el primer intento no espera a un hilo libre"""
+        attempt = ServiceProxy._attempt
+        threads = []
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return attempt(*args, **kwargs)
+
+        with mock.patch.object(ServiceProxy, '_attempt', side_effect=record_thread):
+            response, _, stats = self.get_productos()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats['hedged'], 1)
+        self.assertIs(threads[0], threading.current_thread())
+        self.assertTrue(threads[1].name.startswith('gateway-hedge'))
+
+    async def test_proxy_asincrono(self):
+        """La vista ASGI también duplica las llamadas lentas y cancela el intento que pierde"""
+        services = {'PRODUCTOS': {'URLS': [self.slow_url, self.base_url], 'HEALTH_CHECK_INTERVAL': 0}}
+        hedging = {'SERVICES': ['productos'], 'MIN_SAMPLES': 1, 'MIN_DELAY': 0.05, 'MAX_RATE': 1}
+        with self.settings(SERVICES=services, GATEWAY_CACHE={'ENABLED': False}, GATEWAY_HEDGING=hedging):
+            get_hedger('productos').observe(0.01)
+            start = time.monotonic()
+            request = AsyncRequestFactory().get('/api/productos/productos/')
+            response = await async_proxy_view(request, service='productos', path='productos/')
+            elapsed = time.monotonic() - start
+            stats = get_hedger('productos').snapshot()
+            backends = get_client('productos').balancer.snapshot()
+            await close_async_clients()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual((stats['hedged'], stats['wins']), (1, 1))
+        self.assertEqual(self.server.requests_seen, 1)
+        self.assertEqual([backend['outstanding'] for backend in backends['backends']], [0, 0])
+
+    def test_presupuesto_agotado(self):
+        response, elapsed, stats = self.get_productos(MAX_RATE=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(elapsed, 0.5)
+        self.assertEqual(stats['hedged'], 0)
+
+
+class RetryTestCase(StubServiceMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_retry_budgets()
+        self.addCleanup(reset_retry_budgets)
+
+    def request(self, method, **retry):
+        # Round robin empieza por el backend caído
+        services = {'PRODUCTOS': {'URLS': ['http://127.0.0.1:9/api/', self.base_url], 'HEALTH_CHECK_INTERVAL': 0}}
+        retry = {'BASE_DELAY': 0.001, **retry}
+        with self.settings(SERVICES=services, GATEWAY_CACHE={'ENABLED': False}, GATEWAY_RETRY=retry,
+                           GATEWAY_HEDGING={'ENABLED': False}):
+            client = APIClient()
+            client.force_authenticate(user=User(username='cliente'))
+            response = getattr(client, method)('/api/productos/productos/', {}, format='json')
+            return response, gateway_stats()['retries']['productos']
+
+    def test_presupuesto(self):
+        budget = RetryBudget('productos', ['GET'], max_attempts=3, base_delay=0.1, max_delay=1, ratio=0.5, reserve=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertEqual(budget.snapshot()['exhausted'], 1)
+        self.assertLessEqual(budget.backoff(5), 1)
+
+    def test_reintenta_get_en_otro_backend(self):
+        response, stats = self.request('get')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats['retries'], 1)
+
+    def test_no_reintenta_post(self):
+        response, stats = self.request('post')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(stats['retries'], 0)
+
+    def test_presupuesto_agotado(self):
+        response, stats = self.request('get', BUDGET_RESERVE=0)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(stats['exhausted'], 1)
+
+
+class AdmissionTestCase(StubServiceMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_limiters()
+        self.addCleanup(reset_limiters)
+
+    def limiter(self, **overrides):
+        config = dict(initial_limit=1, min_limit=1, max_limit=10, slow_call_duration=1.0, backoff_ratio=0.5,
+                      queue_size=1, queue_timeout=1.0, retry_after=1)
+        return ConcurrencyLimiter('ordenes', **{**config, **overrides})
+
+    def test_cola_acotada(self):
+        limiter = self.limiter()
+        self.assertTrue(limiter.acquire())
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+        waiter.start()
+        while not limiter.snapshot()['queued']:
+            time.sleep(0.001)
+
+        # La cola está llena: se descarta sin esperar
+        self.assertFalse(limiter.acquire())
+        limiter.release(0.01)
+        waiter.join()
+
+        self.assertEqual(results, [True])
+        self.assertEqual(limiter.snapshot()['shed'], 1)
+        self.assertEqual(limiter.snapshot()['in_flight'], 1)
+
+    def test_espera_maxima(self):
+        limiter = self.limiter()
+        limiter.acquire()
+        self.assertFalse(limiter.acquire(timeout=0.01))
+        self.assertEqual(limiter.snapshot()['queued'], 0)
+
+    def test_aimd(self):
+        limiter = self.limiter(initial_limit=4)
+        for _ in range(4):
+            limiter.acquire()
+        limiter.release(0.01)
+        self.assertGreater(limiter.limit, 4)
+        limiter.release(0.01, error=True)
+        self.assertLess(limiter.limit, 3)
+        limiter.release(5.0)
+        self.assertEqual(limiter.snapshot()['limit'], 1)
+
+    async def test_espera_asincrona(self):
+        limiter = self.limiter()
+        limiter.acquire()
+        threading.Timer(0.01, limiter.release, args=(0.01,)).start()
+        self.assertTrue(await limiter.acquire_async())
+
+    def test_proxy_responde_503_al_saturarse(self):
+        services = {'ORDENES': {'URL': self.base_url}}
+        admission = {'INITIAL_LIMIT': 1, 'MIN_LIMIT': 1, 'QUEUE_SIZE': 0, 'RETRY_AFTER': 2}
+        with self.settings(SERVICES=services, GATEWAY_ADMISSION=admission):
+            client = APIClient()
+            client.force_authenticate(user=User(username='cliente'))
+            get_limiter('ordenes').acquire()
+            response = client.get('/api/ordenes/ordenes/')
+            stats = gateway_stats()['admission']['ordenes']
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(stats['shed'], 1)
+        self.assertEqual(self.server.requests_seen, 0)
+        self.assertIn('gateway_admission_shed_total{service="ordenes",reason="queue_full"}', render_metrics())
+
+    def half_open_and_full(self, service):
+        """Circuito semiabierto con un único turno de prueba y limitador sin huecos ni cola"""
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        breaker = get_breaker(service)
+        breaker._open()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        limiter = get_limiter(service)
+        limiter.acquire()
+        return breaker, limiter
+
+    def shed_settings(self, service):
+        return self.settings(
+            SERVICES={service.upper(): {'URL': self.base_url}},
+            GATEWAY_ADMISSION={'INITIAL_LIMIT': 1, 'MIN_LIMIT': 1, 'QUEUE_SIZE': 0},
+            GATEWAY_CIRCUIT_BREAKER={'OPEN_TIMEOUT': 0, 'HALF_OPEN_CALLS': 1},
+            GATEWAY_CACHE={'ENABLED': False},
+        )
+
+    def test_descarte_libera_el_turno_de_prueba(self):
+        """Si la llamada de prueba del circuito semiabierto se descarta, la siguiente puede probar"""
+        with self.shed_settings('ordenes'):
+            client = APIClient()
+            client.force_authenticate(user=User(username='cliente'))
+            breaker, limiter = self.half_open_and_full('ordenes')
+            self.assertEqual(client.get('/api/ordenes/ordenes/').status_code, 503)
+            limiter.release(None)
+
+            self.assertEqual(client.get('/api/ordenes/ordenes/').status_code, 200)
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_descarte_asincrono_libera_el_turno_de_prueba(self):
+        factory = AsyncRequestFactory()
+        with self.shed_settings('productos'):
+            breaker, limiter = self.half_open_and_full('productos')
+            response = await async_proxy_view(factory.get('/api/productos/productos/'), service='productos', path='productos/')
+            self.assertEqual(response.status_code, 503)
+            limiter.release(None)
+
+            response = await async_proxy_view(factory.get('/api/productos/productos/'), service='productos', path='productos/')
+            await close_async_clients()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def make_breaker(self, **kwargs):
+        config = dict(window=4, min_calls=4, error_rate=0.5, slow_call_duration=1.0,
+                      slow_call_rate=1.0, open_timeout=60, half_open_calls=1)
+        config.update(kwargs)
+        return CircuitBreaker('ORDENES', **config)
+
+    def test_abre_por_tasa_de_errores(self):
+        breaker = self.make_breaker()
+        for error in [False, True, False, True]:
+            breaker.record(error, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_abre_por_latencia(self):
+        breaker = self.make_breaker()
+        for _ in range(4):
+            breaker.record(False, 2.0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_semiabierto_cierra_tras_prueba_exitosa(self):
+        breaker = self.make_breaker(open_timeout=0)
+        for _ in range(4):
+            breaker.record(True, 0.01)
+
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record(False, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_proxy_responde_503_con_circuito_abierto(self):
+        """Con el servicio caído, tras abrir el circuito el gateway responde 503 sin esperar"""
+        client = APIClient()
+        client.force_authenticate(user=User(username='cliente'))
+        with self.settings(SERVICES={'ORDENES': {'URL': 'http://127.0.0.1:9/api/', 'TIMEOUT': 1}},
+                           GATEWAY_CIRCUIT_BREAKER={'MIN_CALLS': 2, 'WINDOW': 2}, GATEWAY_RETRY={'ENABLED': False}):
+            statuses = [client.get('/api/ordenes/ordenes/').status_code for _ in range(3)]
+            stats = gateway_stats()
+
+        self.assertEqual(statuses, [502, 502, 503])
+        self.assertEqual(stats['breakers']['ORDENES']['state'], 'open')
+
+
+class CachedJWTAuthenticationTestCase(SimpleTestCase):
+    def setUp(self):
+        get_token_cache().clear()
+        token = AccessToken()
+        token['user_id'] = 1
+        self.request = RequestFactory().get('/api/ordenes/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.user = User(id=1, username='cliente')
+
+    def test_acierto_evita_firma_y_consulta(self):
+        """El segundo uso del token no vuelve a verificar la firma ni a consultar el usuario"""
+        auth = CachedJWTAuthentication()
+        with mock.patch.object(auth, 'get_user', return_value=self.user) as get_user, \
+                mock.patch.object(auth, 'get_validated_token', wraps=auth.get_validated_token) as validate:
+            first = auth.authenticate(self.request)
+            second = auth.authenticate(self.request)
+
+        self.assertEqual(first, second)
+        self.assertEqual(get_user.call_count, 1)
+        self.assertEqual(validate.call_count, 1)
+        self.assertEqual(get_token_cache().snapshot()['hits'], 1)
+
+    def test_entrada_vence_con_exp_del_token(self):
+        cache = get_token_cache()
+        cache.set('clave', 'valor', token_exp=time.time() - 1)
+        self.assertIsNone(cache.get('clave'))
+
+    def test_lru_acotada(self):
+        with self.settings(GATEWAY_AUTH_CACHE={'MAX_ENTRIES': 1}):
+            cache = get_token_cache()
+            cache.set('a', 1)
+            cache.set('b', 2)
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+
+
+class TokenHandler(StubHandler):
+    """Servicio de usuarios falso: login (401 con password 'mala') y refresh, cada uno tarda 0.2 s"""
+
+    def do_POST(self):
+        self.server.requests_seen += 1
+        data = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        time.sleep(0.2)
+        if self.path == '/api/token/' and data.get('password') == 'mala':
+            self.send_json(401, b'{"detail": "Credenciales incorrectas"}')
+        else:
+            self.send_json(200, json.dumps({"access": f"access-{self.server.requests_seen}"}).encode())
+
+
+class TokenForwardTestCase(StubServiceMixin, SimpleTestCase):
+    handler_class = TokenHandler
+
+    def setUp(self):
+        super().setUp()
+        settings_override = self.settings(
+            SERVICES={'USUARIOS': {'URL': self.base_url}}, GATEWAY_TOKENS={'LOCAL_REFRESH': False}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post(self, url, data):
+        return APIClient().post(url, data, format='json')
+
+    def test_login_por_el_cliente_compartido(self):
+        response = self.post('/api/token/', {'username': 'ana', 'password': 'buena'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"access": "access-1"})
+        self.assertEqual(self.post('/api/token/', {'username': 'ana', 'password': 'mala'}).status_code, 401)
+        self.assertEqual(gateway_stats()['pools']['USUARIOS']['hits'], 1)
+        self.assertIn('gateway_auth_duration_seconds_count{operation="login",status="401"} 1', render_metrics())
+
+    def test_refresh_concurrentes_se_agrupan(self):
+        """Cinco refresh del mismo token en curso llegan al servicio como uno solo"""
+        responses = []
+        threads = [
+            threading.Thread(target=lambda: responses.append(self.post('/api/token/refresh/', {'refresh': 'r1'})))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.requests_seen, 1)
+        self.assertEqual({response.json()['access'] for response in responses}, {'access-1'})
+
+    def test_refresh_reutiliza_respuesta_reciente(self):
+        first = self.post('/api/token/refresh/', {'refresh': 'r1'})
+        second = self.post('/api/token/refresh/', {'refresh': 'r1'})
+        other = self.post('/api/token/refresh/', {'refresh': 'r2'})
+
+        self.assertEqual(first.content, second.content)
+        self.assertNotEqual(first.content, other.content)
+        self.assertEqual(self.server.requests_seen, 2)
+
+    def test_sin_cache_de_refresh(self):
+        with self.settings(GATEWAY_TOKENS={'LOCAL_REFRESH': False, 'REFRESH_CACHE_TTL': 0}):
+            self.post('/api/token/refresh/', {'refresh': 'r1'})
+            self.post('/api/token/refresh/', {'refresh': 'r1'})
+        self.assertEqual(self.server.requests_seen, 2)
+
+
+class LocalRefreshTestCase(StubServiceMixin, SimpleTestCase):
+    handler_class = TokenHandler
+
+    def setUp(self):
+        super().setUp()
+        # La denylist real vive en la base de datos; aquí basta con una caché en memoria
+        settings_override = self.settings(
+            SERVICES={'USUARIOS': {'URL': self.base_url}},
+            GATEWAY_TOKENS={},
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'denylist': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'denylist'},
+            },
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        refresh = RefreshToken()
+        refresh['user_id'] = 7
+        self.refresh = str(refresh)
+
+    def post(self, data):
+        return APIClient().post('/api/token/refresh/', data, format='json')
+
+    def test_refresh_sin_llamar_al_servicio(self):
+        response = self.post({'refresh': self.refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests_seen, 0)
+        self.assertEqual(AccessToken(response.json()['access'])['user_id'], 7)
+        self.assertIn('gateway_auth_duration_seconds_count{operation="refresh_local",status="200"}', render_metrics())
+
+    def test_rotacion_invalida_el_token_anterior(self):
+        with self.settings(GATEWAY_TOKENS={'REFRESH_CACHE_TTL': 0}):
+            rotated = self.post({'refresh': self.refresh}).json()['refresh']
+            self.assertNotEqual(rotated, self.refresh)
+            reused = self.post({'refresh': self.refresh})
+            self.assertEqual(reused.status_code, 401)
+            self.assertEqual(reused.json()['code'], 'token_not_valid')
+            self.assertEqual(self.post({'refresh': rotated}).status_code, 200)
+
+    def test_rotacion_atomica_entre_procesos(self):
+        """Sin caché de respuestas ni agrupación comunes, solo uno de dos refresh simultáneos se acepta"""
+        results = []
+        barrier = threading.Barrier(2, timeout=5)
+
+        def refresh():
+            barrier.wait()
+            results.append(refresh_locally({'refresh': self.refresh})[0])
+
+        threads = [threading.Thread(target=refresh) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [200, 401])
+
+    def test_reintento_inmediato_recibe_el_mismo_par(self):
+        """Dentro de REFRESH_CACHE_TTL el mismo token devuelve el par ya emitido en lugar de un 401"""
+        first = self.post({'refresh': self.refresh})
+        second = self.post({'refresh': self.refresh})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.content, second.content)
+
+    def test_token_no_valido(self):
+        self.assertEqual(self.post({'refresh': 'basura'}).status_code, 401)
+        self.assertEqual(self.post({'refresh': str(AccessToken())}).status_code, 401)
+        self.assertEqual(self.post({}).status_code, 401)
+        self.assertEqual(self.server.requests_seen, 0)
+
+
+class StatelessAuthenticationTestCase(StubServiceMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        get_token_cache().clear()
+        token = AccessToken()
+        token['user_id'] = 7
+        self.authorization = f'Bearer {token}'
+
+    def test_usuario_desde_claims(self):
+        request = RequestFactory().get('/api/ordenes/', HTTP_AUTHORIZATION=self.authorization)
+        user, _ = StatelessJWTAuthentication().authenticate(request)
+        self.assertEqual(user.id, 7)
+        self.assertTrue(user.is_authenticated)
+
+    @override_settings(REST_FRAMEWORK={
+        'DEFAULT_AUTHENTICATION_CLASSES': ('gateway_app.authentication.StatelessJWTAuthentication',),
+    })
+    def test_proxy_autenticado_sin_base_de_datos(self):
+        """SimpleTestCase prohíbe las consultas: la ruta autenticada no debe tocar la base de datos"""
+        with self.settings(SERVICES={'ORDENES': {'URL': self.base_url}}):
+            response = APIClient().get('/api/ordenes/ordenes/', HTTP_AUTHORIZATION=self.authorization)
+        self.assertEqual(response.status_code, 200)
+
+
+class AggregationHandler(StubHandler):
+    """Servicio falso con una orden de tres líneas, sus productos y el usuario; cada respuesta tarda 0.3 s"""
+    DOCUMENTS = {
+        '/api/ordenes/1/': {"id": 1, "usuario_id": 7, "detalles": [
+            {"producto_id": 1, "cantidad": 1}, {"producto_id": 2, "cantidad": 2}, {"producto_id": 2, "cantidad": 1},
+        ]},
+        '/api/ordenes/2/': {"id": 2, "usuario_id": 7, "detalles": [{"producto_id": 404, "cantidad": 1}]},
+        '/api/ordenes/3/': {"id": 3, "usuario_id": 7, "detalles": [
+            {"cantidad": 1}, {"producto_id": 1, "cantidad": 1}, {"producto_id": "../usuarios/me", "cantidad": 1},
+        ]},
+        '/api/productos/1/': {"id": 1, "nombre": "Teclado"},
+        '/api/productos/2/': {"id": 2, "nombre": "Ratón"},
+        '/api/usuarios/me/': {"id": 7, "username": "ana"},
+    }
+
+    def do_GET(self):
+        self.server.requests_seen += 1
+        time.sleep(0.3)
+        document = self.DOCUMENTS.get(self.path)
+        if document is None:
+            self.send_json(404, b'{"detail": "No encontrado."}')
+        else:
+            self.send_json(200, json.dumps(document).encode())
+
+
+class AggregationTestCase(StubServiceMixin, SimpleTestCase):
+    handler_class = AggregationHandler
+
+    def get_summary(self, orden_id):
+        token = AccessToken()
+        token['user_id'] = 7
+        services = {name: {'URL': self.base_url} for name in ('USUARIOS', 'PRODUCTOS', 'ORDENES')}
+        with self.settings(SERVICES=services, GATEWAY_CACHE={'ENABLED': False}):
+            return APIClient().get(f'/api/resumen/ordenes/{orden_id}/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_documento_compuesto_en_paralelo(self):
+        start = time.monotonic()
+        response = self.get_summary(1)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['usuario']['username'], 'ana')
+        self.assertEqual([d['producto']['nombre'] for d in data['detalles']], ['Teclado', 'Ratón', 'Ratón'])
+        self.assertEqual(data['errores'], {})
+        # Orden, usuario y dos productos distintos; en serie serían 1.2 s
+        self.assertEqual(self.server.requests_seen, 4)
+        self.assertLess(elapsed, 0.9)
+
+    def test_producto_fallido_no_rompe_el_documento(self):
+        data = self.get_summary(2).json()
+        self.assertIsNone(data['detalles'][0]['producto'])
+        self.assertEqual(data['errores']['producto:404']['status'], 404)
+
+    def test_lineas_sin_producto_se_informan(self):
+        response = self.get_summary(3)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([d['producto'] for d in data['detalles']], [None, {"id": 1, "nombre": "Teclado"}, None])
+        self.assertEqual(sorted(data['errores']), ['detalle:0', 'detalle:2'])
+        # Orden, usuario y solo el producto válido
+        self.assertEqual(self.server.requests_seen, 3)
+
+    def test_orden_inexistente(self):
+        self.assertEqual(self.get_summary(99).status_code, 404)
+
+    def test_requiere_autenticacion(self):
+        self.assertEqual(APIClient().get('/api/resumen/ordenes/1/').status_code, 401)
+
+
+class BatchTestCase(StubServiceMixin, SimpleTestCase):
+    handler_class = AggregationHandler
+
+    def post_batch(self, payload, authorization=None, **extra_settings):
+        services = {name: {'URL': self.base_url} for name in ('USUARIOS', 'PRODUCTOS', 'ORDENES')}
+        headers = {'HTTP_AUTHORIZATION': authorization} if authorization else {}
+        with self.settings(SERVICES=services, GATEWAY_CACHE={'ENABLED': False}, **extra_settings):
+            return APIClient().post('/api/batch/', payload, format='json', **headers)
+
+    def test_subsolicitudes_en_paralelo_y_en_orden(self):
+        payload = {'requests': [
+            {'service': 'productos', 'path': 'productos/2/'},
+            {'service': 'productos', 'path': 'productos/1/'},
+            {'service': 'productos', 'path': 'productos/3/'},
+        ]}
+        start = time.monotonic()
+        response = self.post_batch(payload)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], [200, 200, 404])
+        self.assertEqual(results[0]['body']['nombre'], 'Ratón')
+        self.assertLess(elapsed, 0.8)
+
+    def test_paralelismo_acotado(self):
+        payload = [{'service': 'productos', 'path': f'productos/{i}/'} for i in (1, 2, 1, 2)]
+        start = time.monotonic()
+        self.post_batch(payload, GATEWAY_BATCH={'MAX_PARALLEL': 1})
+        self.assertGreaterEqual(time.monotonic() - start, 1.2)
+
+    def test_permisos_por_subsolicitud(self):
+        """Sin token, las subsolicitudes protegidas fallan con 401 sin llegar al servicio"""
+        response = self.post_batch([
+            {'service': 'productos', 'path': 'productos/1/'},
+            {'service': 'usuarios', 'path': 'usuarios/me/'},
+        ])
+        self.assertEqual([r['status'] for r in response.json()['results']], [200, 401])
+        self.assertEqual(self.server.requests_seen, 1)
+
+        token = AccessToken()
+        token['user_id'] = 7
+        response = self.post_batch([{'service': 'usuarios', 'path': 'usuarios/me/'}], f'Bearer {token}')
+        self.assertEqual(response.json()['results'][0]['body']['username'], 'ana')
+
+    def test_lote_invalido(self):
+        self.assertEqual(self.post_batch({'requests': []}).status_code, 400)
+        self.assertEqual(self.post_batch([{'service': 'pagos', 'path': ''}]).status_code, 400)
+        self.assertEqual(self.post_batch([{'service': 'productos', 'method': 'TRACE'}]).status_code, 400)
+        self.assertEqual(self.post_batch([{'service': 'productos', 'path': 'productos/../admin/'}]).status_code, 400)
+        too_many = [{'service': 'productos', 'path': 'productos/1/'}] * 3
+        self.assertEqual(self.post_batch(too_many, GATEWAY_BATCH={'MAX_REQUESTS': 2}).status_code, 400)
+
+
+class LoadTestHarnessTestCase(SimpleTestCase):
+    def test_percentiles(self):
+        ordered = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(ordered, 50), 0.05)
+        self.assertEqual(percentile(ordered, 99), 0.099)
+        self.assertIsNone(percentile([], 50))
+
+    def test_resumen_por_ruta(self):
+        samples = [('a', 200, 0.01), ('a', 500, 0.03), ('b', 'error', 0.02)]
+        report = summarize(samples, elapsed=2.0)
+        self.assertEqual(list(report), ['a', 'b', 'total'])
+        self.assertEqual(report['a']['errors'], 1)
+        self.assertEqual(report['total']['requests'], 3)
+        self.assertEqual(report['total']['rps'], 1.5)
+        self.assertEqual(report['total']['p99'], 30.0)
+
+    def test_servicio_falso_con_perfil(self):
+        stub = StubServer('productos', StubProfile(latency=0)).start()
+        failing = StubServer('productos', StubProfile(latency=0, error_rate=1.0)).start()
+        self.addCleanup(stub.stop)
+        self.addCleanup(failing.stop)
+
+        scenario = Scenario('detalle', 'GET', '/productos/{id}/', max_id=5)
+        samples, _ = run_load(stub.url, [scenario], workers=2, max_requests=10)
+        self.assertEqual([status for _, status, _ in samples], [200] * 10)
+        samples, _ = run_load(failing.url, [scenario], workers=2, max_requests=4)
+        self.assertEqual({status for _, status, _ in samples}, {500})
+
+
+class AccessLogTestCase(SimpleTestCase):
+    @override_settings(GATEWAY_ACCESS_LOG={'SAMPLE_RATE': 1})
+    def test_un_registro_estructurado(self):
+        with self.assertLogs('gateway_app.access', 'INFO') as logs:
+            log_access('productos', 'get', 'productos/', 200, 0.012, {'backend': 'http://a/api/'})
+
+        self.assertEqual(len(logs.records), 1)
+        access = logs.records[0].access
+        self.assertEqual(access['status'], 200)
+        self.assertEqual(access['duration_ms'], 12.0)
+        self.assertEqual(access['backend'], 'http://a/api/')
+
+    @override_settings(GATEWAY_ACCESS_LOG={'SAMPLE_RATE': 0})
+    def test_muestreo_y_cuerpos_perezosos(self):
+        """Fuera del muestreo no se registra nada ni se evalúan los cuerpos"""
+        body = mock.Mock(return_value='{}')
+        with self.assertNoLogs('gateway_app.access', 'INFO'):
+            log_access('productos', 'get', 'productos/', 200, 0.01, {}, request_body=body)
+        body.assert_not_called()
+
+        with self.assertLogs('gateway_app.access', 'INFO'):
+            log_access('productos', 'get', 'productos/', 500, 0.01, {})
+
+    @override_settings(GATEWAY_ACCESS_LOG={'CAPTURE_BODY': True, 'BODY_MAX_CHARS': 4})
+    def test_captura_de_cuerpo_bajo_demanda(self):
+        with self.assertLogs('gateway_app.access', 'INFO') as logs:
+            log_access('ordenes', 'post', 'ordenes/', 201, 0.01, {}, request_body=lambda: '{"total": 10}')
+        self.assertEqual(logs.records[0].access['request_body'], '{"to')
+
+
+class MetricsTestCase(StubServiceMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_histograma_acumulado(self):
+        histogram = Histogram('latencia_seconds', 'Prueba', ('service',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, service='productos')
+        histogram.observe(0.1, service='productos')
+        histogram.observe(3, service='productos')
+
+        lines = histogram.render()
+        self.assertIn('latencia_seconds_bucket{service="productos",le="0.1"} 2', lines)
+        self.assertIn('latencia_seconds_bucket{service="productos",le="1.0"} 2', lines)
+        self.assertIn('latencia_seconds_bucket{service="productos",le="+Inf"} 3', lines)
+        self.assertIn('latencia_seconds_count{service="productos"} 3', lines)
+
+    def test_estado_interno_solo_para_operadores(self):
+        cliente = APIClient()
+        cliente.force_authenticate(user=User(username='cliente'))
+        with self.settings(GATEWAY_OPERATOR_TOKEN='operador'):
+            for url in ('/api/gateway/stats/', '/metrics'):
+                self.assertEqual(APIClient().get(url).status_code, 401)
+                self.assertEqual(cliente.get(url).status_code, 403)
+                self.assertEqual(APIClient().get(url, headers={'X-Gateway-Token': 'otro'}).status_code, 401)
+                self.assertEqual(APIClient().get(url, headers={'X-Gateway-Token': 'operador'}).status_code, 200)
+        with self.settings(GATEWAY_OPERATOR_TOKEN=None):
+            self.assertEqual(APIClient().get('/metrics', headers={'X-Gateway-Token': ''}).status_code, 401)
+
+    def test_endpoint_metrics(self):
+        """Una solicitud proxy deja su latencia por ruta, por servicio y por fase"""
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_CACHE={'ENABLED': False},
+                           GATEWAY_OPERATOR_TOKEN='operador'):
+            client = APIClient()
+            self.assertEqual(client.get('/api/productos/productos/').status_code, 200)
+            response = client.get('/metrics', headers={'X-Gateway-Token': 'operador'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn(
+            'gateway_http_request_duration_seconds_count{route="proxy:productos",method="GET",status="200"} 1', body
+        )
+        self.assertIn(
+            'gateway_upstream_duration_seconds_count{service="productos",method="GET",status="200"} 1', body
+        )
+        self.assertIn('gateway_upstream_requests_in_flight{service="productos"} 0', body)
+        for phase in ('headers', 'body', 'gateway'):
+            self.assertIn(f'gateway_proxy_phase_duration_seconds_count{{service="productos",phase="{phase}"}} 1', body)
+
+
+class AsyncProxyTestCase(StubServiceMixin, SimpleTestCase):
+    # Cada llamada tarda 0.5 s: las solicitudes simultáneas coinciden en curso
+    handler_class = SlowStubHandler
+
+    async def test_reenvia_respuesta_en_streaming(self):
+        """La vista ASGI transmite el cuerpo del servicio sin bloquear"""
+        factory = AsyncRequestFactory()
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_CACHE={'ENABLED': False},
+                           GATEWAY_STREAM_RESPONSES=True):
+            request = factory.get('/api/productos/productos/', {'categoria': '2'})
+            response = await async_proxy_view(request, service='productos', path='productos/')
+            body = b''.join([chunk async for chunk in response.streaming_content])
+            await close_async_clients()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(body), {"path": "/api/productos/?categoria=2"})
+
+    async def test_agrupa_get_identicos(self):
+        factory = AsyncRequestFactory()
+        before = async_singleflight.snapshot()['coalesced']
+        with self.settings(SERVICES={'PRODUCTOS': {'URL': self.base_url}}, GATEWAY_CACHE={'ENABLED': False}):
+            responses = await asyncio.gather(*[
+                async_proxy_view(factory.get('/api/productos/productos/'), service='productos', path='productos/')
+                for _ in range(3)
+            ])
+            await close_async_clients()
+
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(self.server.requests_seen, 1)
+        self.assertEqual(async_singleflight.snapshot()['coalesced'] - before, 2)
+
+    async def test_requiere_autenticacion(self):
+        factory = AsyncRequestFactory()
+        with self.settings(SERVICES={'ORDENES': {'URL': self.base_url}}):
+            response = await async_proxy_view(factory.get('/api/ordenes/'), service='ordenes', path='')
+
+        self.assertEqual(response.status_code, 401)
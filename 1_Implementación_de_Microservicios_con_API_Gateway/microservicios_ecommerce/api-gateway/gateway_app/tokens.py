@@ -0,0 +1,243 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .admission import ServiceOverloaded
+from .authentication import TokenCache
+from .breaker import get_breaker
+from .coalescing import SingleFlight
+from .metrics import auth_deduplicated, auth_duration
+from .proxy import ServiceProxy
+from .upstream import get_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'COALESCE_LOGIN': True,     # Logins idénticos en curso (mismas credenciales) comparten la llamada
+    'REFRESH_CACHE_TTL': 10,    # Segundos que se reutiliza la respuesta de un mismo refresh token; 0 la desactiva
+    'MAX_ENTRIES': 10000,
+    'LOCAL_REFRESH': True,      # Refrescar en el gateway con la clave compartida, sin llamar a usuarios
+    'DENYLIST': True,           # Rechazar refresh tokens ya rotados o revocados
+    'DENYLIST_CACHE': 'denylist',  # Alias de CACHES; debe ser compartida por todos los procesos del gateway
+}
+
+# Ruta en el servicio de usuarios de cada operación
+OPERATIONS = {
+    'login': 'token/',
+    'refresh': 'token/refresh/',
+}
+
+# Solicitudes en curso agrupadas por operación y credencial; nunca se mezclan con los GET del proxy
+token_flight = SingleFlight()
+
+_refresh_cache = None
+_refresh_cache_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GATEWAY_TOKENS', {})}
+
+
+def get_refresh_cache():
+    global _refresh_cache
+    if _refresh_cache is None:
+        with _refresh_cache_lock:
+            if _refresh_cache is None:
+                config = get_config()
+                if not config['REFRESH_CACHE_TTL']:
+                    return None
+                _refresh_cache = TokenCache(ttl=config['REFRESH_CACHE_TTL'], max_entries=config['MAX_ENTRIES'])
+    return _refresh_cache
+
+
+@receiver(setting_changed)
+def _reset_on_config_change(setting, **kwargs):
+    global _refresh_cache
+    if setting == 'GATEWAY_TOKENS':
+        _refresh_cache = None
+
+
+class Denylist:
+    """
+    Identificadores (jti) de refresh tokens que ya no se aceptan. Cada entrada vive en la
+    caché de Django hasta que el token habría caducado de todos modos
+    """
+    prefix = 'gateway:jwt-denylist:'
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def add(self, jti, exp):
+        """
+        Reclama el jti de forma atómica (cache.add): True si aún no estaba. Si dos procesos
+        reciben a la vez el mismo refresh token, solo uno de ellos obtiene True
+        """
+        timeout = max(int(exp - time.time()) + 1, 1)
+        return self.cache.add(self.prefix + jti, True, timeout)
+
+    def __contains__(self, jti):
+        return self.cache.get(self.prefix + jti) is not None
+
+
+def get_denylist():
+    config = get_config()
+    return Denylist(caches[config['DENYLIST_CACHE']]) if config['DENYLIST'] else None
+
+
+def _json(status_code, document):
+    return status_code, json.dumps(document).encode(), 'application/json'
+
+
+def refresh_locally(data):
+    """
+    Refresh sin salir del gateway: verifica firma, tipo y caducidad del refresh token con la
+    clave compartida y firma el nuevo access token. Con ROTATE_REFRESH_TOKENS devuelve también
+    un refresh token nuevo y el anterior pasa a la denylist para que no pueda reutilizarse
+    """
+    try:
+        refresh = RefreshToken(data.get('refresh', ''))
+    except TokenError as e:
+        return _json(status.HTTP_401_UNAUTHORIZED, {"detail": str(e), "code": "token_not_valid"})
+
+    denylist = get_denylist()
+    jti = refresh.get(api_settings.JTI_CLAIM)
+    if denylist is None:
+        revoked = False
+    elif api_settings.ROTATE_REFRESH_TOKENS:
+        # Se reclama antes de emitir el par nuevo: comprobar y añadir por separado dejaría
+        # que dos workers aceptaran el mismo token
+        revoked = not denylist.add(jti, refresh['exp'])
+    else:
+        revoked = jti in denylist
+    if revoked:
+        return _json(status.HTTP_401_UNAUTHORIZED, {"detail": "El token ha sido revocado", "code": "token_not_valid"})
+
+    document = {"access": str(refresh.access_token)}
+    if api_settings.ROTATE_REFRESH_TOKENS:
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+        document["refresh"] = str(refresh)
+    return _json(status.HTTP_200_OK, document)
+
+
+def _flight_key(operation, data):
+    """Clave de agrupación: hash de la credencial, o None si la solicitud no se agrupa"""
+    if not isinstance(data, dict):
+        return None
+    if operation == 'refresh' and isinstance(data.get('refresh'), str):
+        return TokenCache.make_key(data['refresh'])
+    if operation == 'login' and get_config()['COALESCE_LOGIN']:
+        username, password = data.get('username'), data.get('password')
+        if isinstance(username, str) and isinstance(password, str):
+            return TokenCache.make_key(f"{username}\0{password}")
+    return None
+
+
+def _call(client, breaker, operation, data):
+    """Llamada al servicio de usuarios; devuelve (status, cuerpo, content-type)"""
+    start = time.monotonic()
+    try:
+        response = ServiceProxy.send(
+            client, breaker, 'post', OPERATIONS[operation], {},
+            headers={'Content-Type': 'application/json'}, json=data,
+        )
+    except requests.RequestException:
+        auth_duration.observe(time.monotonic() - start, operation=operation, status='error')
+        raise
+    auth_duration.observe(time.monotonic() - start, operation=operation, status=response.status_code)
+    return response.status_code, response.content, response.headers.get('Content-Type', 'application/json')
+
+
+def _call_local(data):
+    start = time.monotonic()
+    result = refresh_locally(data)
+    auth_duration.observe(time.monotonic() - start, operation='refresh_local', status=result[0])
+    return result
+
+
+def _respond(result):
+    status_code, content, content_type = result
+    return HttpResponse(content, status=status_code, content_type=content_type)
+
+
+def forward_token_request(operation, data):
+    """
+    Reenvía un login o un refresh al servicio de usuarios por el cliente compartido (pool,
+    balanceo, circuit breaker y control de admisión) y devuelve su respuesta sin reprocesarla.
+    Con LOCAL_REFRESH los refresh se resuelven en el gateway sin llamar al servicio.
+    Los refresh idénticos en curso se resuelven una sola vez y su respuesta se reutiliza
+    durante REFRESH_CACHE_TTL segundos
+    """
+    key = _flight_key(operation, data)
+    cache = get_refresh_cache() if operation == 'refresh' and key is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            auth_deduplicated.inc(operation=operation, source='cache')
+            return _respond(cached)
+
+    if operation == 'refresh' and get_config()['LOCAL_REFRESH']:
+        if key is None:
+            return _respond(_call_local(data if isinstance(data, dict) else {}))
+        # Agrupar también aquí: con rotación, dos refresh simultáneos del mismo token deben recibir
+        # el mismo par nuevo en lugar de que el segundo encuentre el token ya en la denylist
+        result = token_flight.do((operation, key), lambda: _call_local(data))
+        if cache is not None and result[0] == 200:
+            cache.set(key, result)
+        return _respond(result)
+
+    client = get_client('usuarios')
+    if client is None:
+        return Response({"error": "Servicio 'usuarios' no configurado"}, status=status.HTTP_502_BAD_GATEWAY)
+
+    breaker = get_breaker('usuarios')
+    if breaker is not None and not breaker.allow_request():
+        return Response(
+            {"error": "Servicio de autenticación no disponible temporalmente"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(breaker.retry_after())}
+        )
+
+    try:
+        if key is None:
+            result = _call(client, breaker, operation, data)
+        else:
+            leader = []
+
+            def call():
+                leader.append(True)
+                return _call(client, breaker, operation, data)
+
+            result = token_flight.do((operation, key), call)
+            if not leader:
+                auth_deduplicated.inc(operation=operation, source='coalesced')
+    except ServiceOverloaded as e:
+        return Response(
+            {"error": "Servicio de autenticación saturado, inténtelo de nuevo más tarde"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(e.retry_after)}
+        )
+    except requests.RequestException as e:
+        logger.error("Error al comunicarse con el servicio de autenticación: %s", e)
+        return Response(
+            {"error": f"Error al comunicarse con el servicio de autenticación: {str(e)}"},
+            status=status.HTTP_502_BAD_GATEWAY
+        )
+
+    if cache is not None and result[0] == 200:
+        cache.set(key, result)
+    return _respond(result)
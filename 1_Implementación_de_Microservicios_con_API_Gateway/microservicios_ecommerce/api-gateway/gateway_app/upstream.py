@@ -0,0 +1,304 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http import cookiejar
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .balancer import LoadBalancer
+
+# Valores por defecto para cada entrada de settings.SERVICES
+DEFAULTS = {
+    'POOL_SIZE': 10,        # Conexiones keep-alive que se conservan por backend
+    'POOL_BLOCK': False,    # Si es True, se espera a una conexión libre en vez de abrir otra
+    'KEEP_ALIVE': True,
+    'IDLE_TIMEOUT': 30,     # Segundos que una conexión puede estar ociosa antes de descartarla
+    'TIMEOUT': 10,
+    'BALANCER': 'round_robin',    # round_robin, least_outstanding o ewma
+    'HEALTH_CHECK_PATH': '',      # Relativo a la URL de cada backend
+    'HEALTH_CHECK_INTERVAL': 5,   # Segundos entre comprobaciones (0 las desactiva)
+    'HEALTH_CHECK_TIMEOUT': 2,
+    'HEALTHY_THRESHOLD': 1,       # Comprobaciones correctas para volver a la rotación
+    'UNHEALTHY_THRESHOLD': 2,     # Comprobaciones fallidas para salir de la rotación
+}
+
+
+def get_service_config(service):
+    """
+    Devuelve la configuración normalizada de un servicio.
+    Cada entrada de settings.SERVICES puede ser una URL o un diccionario con 'URL'
+    o con 'URLS' (varias instancias del servicio). 'URL' siempre es la primera instancia.
+    """
+    entry = settings.SERVICES.get(service.upper())
+    if entry is None:
+        return None
+    if isinstance(entry, str):
+        entry = {'URL': entry}
+    config = {**DEFAULTS, **entry}
+    config['URLS'] = list(config.get('URLS') or [config['URL']])
+    config['URL'] = config['URLS'][0]
+    return config
+
+
+class PoolStats:
+    """Contadores del pool de conexiones de un servicio"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, reused, waited):
+        with self._lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def record_eviction(self):
+        with self._lock:
+            self.evictions += 1
+
+    def snapshot(self):
+        with self._lock:
+            checkouts = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'wait_total_ms': round(self.wait_total * 1000, 3),
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'wait_avg_ms': round(self.wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+            }
+
+
+_tracking = threading.local()
+
+
+class ConnectionHandle:
+    """
+    Conexión que está usando una llamada en curso, para poder cortarla desde otro hilo
+    (p. ej. cuando el segundo intento de una llamada duplicada ya ha respondido)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.conn = None
+        self.aborted = False
+
+    def attach(self, conn):
+        with self._lock:
+            self.conn = conn
+            conn.gateway_handle = self
+            if self.aborted:
+                self._shutdown(conn)
+
+    def detach(self, conn):
+        """La conexión vuelve al pool: desde aquí puede usarla otra llamada y ya no se corta"""
+        with self._lock:
+            if self.conn is conn:
+                self.conn = None
+
+    def abort(self):
+        # Con el lock: la conexión no puede volver al pool a mitad del corte
+        with self._lock:
+            self.aborted = True
+            if self.conn is not None:
+                self._shutdown(self.conn)
+
+    @staticmethod
+    def _shutdown(conn):
+        # La lectura bloqueada en el otro hilo termina con un error de conexión
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+@contextmanager
+def track_connection(handle):
+    """Las conexiones que saque del pool este hilo dentro del bloque quedan asociadas a handle"""
+    _tracking.handle = handle
+    try:
+        yield handle
+    finally:
+        _tracking.handle = None
+
+
+class InstrumentedPoolMixin:
+    """Cuenta reutilizaciones de conexiones y descarta las que llevan demasiado tiempo ociosas"""
+    stats = None
+    idle_timeout = None
+
+    def _get_conn(self, timeout=None):
+        start = time.monotonic()
+        conn = super()._get_conn(timeout)
+        waited = time.monotonic() - start
+
+        reused = conn.sock is not None
+        if reused and self.idle_timeout is not None:
+            last_used = getattr(conn, 'gateway_last_used', None)
+            if last_used is not None and time.monotonic() - last_used > self.idle_timeout:
+                # El servidor probablemente ya cerró la conexión: mejor abrir una nueva
+                conn.close()
+                reused = False
+                if self.stats is not None:
+                    self.stats.record_eviction()
+
+        if self.stats is not None:
+            self.stats.record_checkout(reused, waited)
+        handle = getattr(_tracking, 'handle', None)
+        if handle is not None:
+            handle.attach(conn)
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.gateway_last_used = time.monotonic()
+            handle = getattr(conn, 'gateway_handle', None)
+            if handle is not None:
+                conn.gateway_handle = None
+                handle.detach(conn)
+        super()._put_conn(conn)
+
+
+class InstrumentedHTTPConnectionPool(InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class InstrumentedHTTPSConnectionPool(InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class InstrumentedPoolManager(PoolManager):
+    def __init__(self, *args, stats=None, idle_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.idle_timeout = idle_timeout
+        self.pool_classes_by_scheme = {
+            'http': InstrumentedHTTPConnectionPool,
+            'https': InstrumentedHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.stats = self.stats
+        pool.idle_timeout = self.idle_timeout
+        return pool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, stats, idle_timeout=None, **kwargs):
+        # init_poolmanager se invoca desde HTTPAdapter.__init__
+        self.stats = stats
+        self.idle_timeout = idle_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = InstrumentedPoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            stats=self.stats,
+            idle_timeout=self.idle_timeout,
+            **pool_kwargs,
+        )
+
+
+class UpstreamClient:
+    """Cliente HTTP con conexiones persistentes hacia un servicio"""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.stats = PoolStats()
+
+        self.session = requests.Session()
+        # La sesión es compartida entre usuarios: nunca guardar cookies de los servicios
+        self.session.cookies.set_policy(cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        if not config['KEEP_ALIVE']:
+            self.session.headers['Connection'] = 'close'
+
+        adapter = PooledAdapter(
+            self.stats,
+            idle_timeout=config['IDLE_TIMEOUT'],
+            pool_maxsize=config['POOL_SIZE'],
+            pool_block=config['POOL_BLOCK'],
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.balancer = LoadBalancer(name, config)
+
+    @staticmethod
+    def build_url(backend, path):
+        # Si service_url termina con / y path está vacío, no agregamos otra /
+        if not path and not backend.url.endswith('/'):
+            return f"{backend.url}/"
+        return f"{backend.url}{path}"
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.config['TIMEOUT'])
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        self.balancer.close()
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service):
+    """Devuelve (creándolo si hace falta) el cliente compartido de un servicio"""
+    name = service.upper()
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                config = get_service_config(name)
+                if config is None:
+                    return None
+                client = _clients[name] = UpstreamClient(name, config)
+    return client
+
+
+def reset_clients():
+    """Cierra todos los clientes (útil en tests o tras cambiar settings.SERVICES)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def pool_stats():
+    return {name: client.stats.snapshot() for name, client in list(_clients.items())}
+
+
+def balancer_stats():
+    return {name: client.balancer.snapshot() for name, client in list(_clients.items())}
+
+
+@receiver(setting_changed)
+def _reset_on_services_change(setting, **kwargs):
+    if setting == 'SERVICES':
+        reset_clients()
@@ -1,12 +1,43 @@
-import requests
-from rest_framework import status
+import hmac
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import BasePermission, IsAuthenticated, AllowAny
+from rest_framework.settings import api_settings
+from .admission import admission_stats
+from .aggregation import order_summary
+from .async_proxy import AsyncServiceProxy
+from .authentication import get_token_cache
+from .batch import dispatch, parse_batch
+from .breaker import breaker_states
+from .cache import get_response_cache
+from .coalescing import async_singleflight, singleflight
+from .hedging import hedging_stats
+from .metrics import render_metrics
 from .proxy import ServiceProxy
+from .retry import retry_stats
+from .routing import get_routing_table
+from .tokens import forward_token_request, get_refresh_cache, token_flight
+from .upstream import balancer_stats, pool_stats
 from django.conf import settings
 
+API_ROOT = {
+    "usuarios_endpoint": "/api/usuarios/",
+    "productos_endpoint": "/api/productos/",
+    "ordenes_endpoint": "/api/ordenes/",
+    "resumen_orden_endpoint": "/api/resumen/ordenes/<id>/",
+    "batch_endpoint": "/api/batch/",
+    "token_endpoint": "/api/token/",
+    "token_refresh_endpoint": "/api/token/refresh/"
+}
+
+
 # Create your views here.
 class LoginView(APIView):
     permission_classes = []
@@ -16,25 +47,7 @@ class LoginView(APIView):
         Reenvía la solicitud de autenticación al servicio de usuarios
         y devuelve el token JWT generado
         """
-        login_url = f"{settings.SERVICES['USUARIOS']}token/"
-        print(f"URL de autenticación: {login_url}")
-
-        try:
-            response = requests.post(
-                login_url,
-                json=request.data,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            return Response(
-                data=response.json() if response.content else None,
-                status=response.status_code
-            )
-        except requests.RequestException as e:
-            return Response(
-                {"error": f"Error al comunicarse con el servicio de autenticación: {str(e)}"},
-                status=status.HTTP_502_BAD_GATEWAY
-            )
+        return forward_token_request('login', request.data)
 
 
 class RefreshTokenView(APIView):
@@ -44,24 +57,122 @@ class RefreshTokenView(APIView):
         """
         Reenvía la solicitud de refresh token al servicio de usuarios
         """
-        refresh_url = f"{settings.SERVICES['USUARIOS']}token/refresh/"
-
-        try:
-            response = requests.post(
-                refresh_url,
-                json=request.data,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            return Response(
-                data=response.json() if response.content else None,
-                status=response.status_code
-            )
-        except requests.RequestException as e:
-            return Response(
-                {"error": f"Error al comunicarse con el servicio de autenticación: {str(e)}"},
-                status=status.HTTP_502_BAD_GATEWAY
-            )
+        return forward_token_request('refresh', request.data)
+
+
+class InternalRoute(BasePermission):
+    message = "Esta ruta solo está disponible entre servicios"
+
+    def has_permission(self, request, view):
+        return False
+
+
+class IsGatewayOperator(BasePermission):
+    """
+    Estado interno del gateway: usuarios staff, o quien envíe la cabecera X-Gateway-Token
+    con el valor de GATEWAY_OPERATOR_TOKEN (p. ej. el scraper de Prometheus)
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if user and user.is_authenticated and user.is_staff:
+            return True
+        expected = getattr(settings, 'GATEWAY_OPERATOR_TOKEN', None)
+        if not expected:
+            return False
+        return hmac.compare_digest(request.headers.get('X-Gateway-Token', '').encode(), expected.encode())
+
+
+def get_proxy_permissions(service, method, path='', route=None):
+    # API root
+    if not service:
+        return [AllowAny()]
+
+    # La política sale de la tabla de rutas (GATEWAY_ROUTES); por defecto se requiere autenticación
+    if route is None:
+        route = get_routing_table().match(service, path, method)
+    if route is not None and route.public:
+        return [AllowAny()]
+    if route is not None and route.internal:
+        return [InternalRoute()]
+    return [IsAuthenticated()]
+
+
+class GatewayStatsView(APIView):
+    permission_classes = [IsGatewayOperator]
+
+    def get(self, request):
+        """
+        Estado interno del gateway: pools de conexiones, backends de cada servicio, cachés,
+        solicitudes agrupadas, estado de los circuit breakers, llamadas duplicadas, reintentos
+        límites de concurrencia y logins/refresh agrupados
+        """
+        cache = get_response_cache()
+        token_cache = get_token_cache()
+        refresh_cache = get_refresh_cache()
+        return Response({
+            "pools": pool_stats(),
+            "backends": balancer_stats(),
+            "cache": cache.snapshot() if cache is not None else None,
+            "coalescing": singleflight.snapshot(),
+            "coalescing_async": async_singleflight.snapshot(),
+            "breakers": breaker_states(),
+            "hedging": hedging_stats(),
+            "retries": retry_stats(),
+            "admission": admission_stats(),
+            "auth_cache": token_cache.snapshot() if token_cache is not None else None,
+            "tokens": {
+                "coalescing": token_flight.snapshot(),
+                "refresh_cache": refresh_cache.snapshot() if refresh_cache is not None else None,
+            },
+        })
+
+
+class OrderSummaryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, orden_id):
+        """
+        Devuelve en un solo documento la orden, los productos de sus detalles y el usuario,
+        consultando los servicios en paralelo
+        """
+        document, status_code = order_summary(orden_id, request.META.get('HTTP_AUTHORIZATION'))
+        return Response(document, status=status_code)
+
+
+class BatchView(APIView):
+    # Los permisos se comprueban por subsolicitud, igual que en ProxyView
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        """
+        Recibe una lista de subsolicitudes (method, service, path, body), las reenvía en paralelo
+        a los servicios y devuelve sus resultados en el mismo orden
+        """
+        entries, error = parse_batch(request.data)
+        if error is not None:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        def check_permissions(service, method, path):
+            for permission in get_proxy_permissions(service, method, path):
+                if not permission.has_permission(request, self):
+                    if request.user and request.user.is_authenticated:
+                        denied = exceptions.PermissionDenied()
+                    else:
+                        denied = exceptions.NotAuthenticated()
+                    return {"status": denied.status_code, "body": {"detail": denied.detail}}
+            return None
+
+        return Response({"results": dispatch(request, entries, check_permissions)})
+
+
+class MetricsView(APIView):
+    permission_classes = [IsGatewayOperator]
+
+    def get(self, request):
+        """Histogramas de latencia y solicitudes en curso en formato de texto de Prometheus"""
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 class ProxyView(APIView):
     def initialize_request(self, request, *args, **kwargs):
@@ -70,37 +181,22 @@ class ProxyView(APIView):
         self.path = kwargs.get('path', '')
         if self.path is None:
             self.path = ''
+        self.route = get_routing_table().match(self.service, self.path, request.method) if self.service else None
         return super().initialize_request(request, *args, **kwargs)
 
     def get_permissions(self):
-        # API root
-        if not self.service:
-            return [AllowAny()]
-
-        # Registro de usuarios - permitir POST sin autenticación
-        if self.service == 'usuarios' and self.request.method == 'POST':
-            return [AllowAny()]
-        # Ver productos sin autenticación
-        elif self.service == 'productos' and self.request.method == 'GET':
-            return [AllowAny()]
-        # Otros endpoints requieren autenticación
-        return [IsAuthenticated()]
+        return get_proxy_permissions(self.service, self.request.method, self.path, self.route)
 
     def handle_request(self, request, *args, **kwargs):
         # Respuesta base para API root sin servicio
         if not self.service:
-            return Response({
-                "usuarios_endpoint": "/api/usuarios/",
-                "productos_endpoint": "/api/productos/",
-                "ordenes_endpoint": "/api/ordenes/",
-                "token_endpoint": "/api/token/",
-                "token_refresh_endpoint": "/api/token/refresh/"
-            })
+            return Response(API_ROOT)
 
         return ServiceProxy.forward_request(
             self.service,
             self.path,
-            request
+            request,
+            route=self.route
         )
 
     def get(self, request, *args, **kwargs):
@@ -116,4 +212,41 @@ class ProxyView(APIView):
         return self.handle_request(request, *args, **kwargs)
 
     def patch(self, request, *args, **kwargs):
-        return self.handle_request(request, *args, **kwargs)
\ No newline at end of file
+        return self.handle_request(request, *args, **kwargs)
+
+
+def _authenticate(request):
+    """Aplica las clases de autenticación de DRF sobre una solicitud de Django"""
+    for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authenticator().authenticate(request)
+        if result is not None:
+            return result
+    return None
+
+
+@csrf_exempt
+async def async_proxy_view(request, service='', path=''):
+    """
+    Versión ASGI de ProxyView: el reenvío no bloquea un hilo por solicitud, con la misma
+    caché, agrupación de GET y llamadas duplicadas. Lo que no se cachea ni se comparte se
+    transmite al cliente por bloques
+    """
+    path = path or ''
+    if not service:
+        return JsonResponse(API_ROOT)
+
+    try:
+        result = await sync_to_async(_authenticate)(request)
+    except exceptions.APIException as e:
+        return JsonResponse({"detail": e.detail}, status=e.status_code)
+
+    # Nunca dejar que request.user se resuelva contra la sesión dentro del event loop
+    request.user, request.auth = result if result is not None else (AnonymousUser(), None)
+
+    route = get_routing_table().match(service, path, request.method)
+    for permission in get_proxy_permissions(service, request.method, path, route):
+        if not permission.has_permission(request, None):
+            error = exceptions.NotAuthenticated() if result is None else exceptions.PermissionDenied()
+            return JsonResponse({"detail": error.detail}, status=error.status_code)
+
+    return await AsyncServiceProxy.forward_request(service, path, request, route)
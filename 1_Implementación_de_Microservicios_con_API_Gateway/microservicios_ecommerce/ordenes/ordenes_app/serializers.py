@@ -1,10 +1,9 @@
-from rest_framework import serializers
-from .models import Orden, DetalleOrden
-import requests
+from decimal import Decimal
 
+from django.db import transaction
 from rest_framework import serializers
+
 from .models import Orden, DetalleOrden
-import requests
 from .services import UsuariosService, ProductosService
 
 
@@ -46,22 +45,33 @@ class OrdenSerializer(serializers.ModelSerializer):
         if usuario_id and not UsuariosService.verify_user_exists(usuario_id, token):
             raise serializers.ValidationError({"usuario_id": "El usuario no existe"})
 
-        # Verificar stock de productos
+        # Verificar existencia y stock de productos: cada producto distinto se consulta una sola vez
+        # y en paralelo, y la cantidad pedida se suma entre las líneas que lo repiten
         detalles_datos = data.get('detalles_datos', [])
+        cantidades = {}
         for detalle in detalles_datos:
             producto_id = detalle.get('producto_id')
-            cantidad = detalle.get('cantidad', 0)
-
-            if not ProductosService.verify_product_exists(producto_id, token):
+            cantidades[producto_id] = cantidades.get(producto_id, 0) + detalle.get('cantidad', 0)
+
+        productos = ProductosService.get_products(cantidades, token)
+        if productos is None:
+            raise serializers.ValidationError(
+                {"detalles_datos": "No se pudieron consultar los productos de la orden"}
+            )
+        for producto_id, cantidad in cantidades.items():
+            producto_data = productos[producto_id]
+            if producto_data is None:
                 raise serializers.ValidationError(
                     {"detalles_datos": f"El producto con ID {producto_id} no existe"}
                 )
 
-            if not ProductosService.verify_product_stock(producto_id, cantidad, token):
+            if producto_data.get('stock', 0) < cantidad:
                 raise serializers.ValidationError(
                     {"detalles_datos": f"Stock insuficiente para el producto con ID {producto_id}"}
                 )
 
+        # create() reutiliza los productos ya obtenidos en lugar de volver a pedirlos
+        self._productos = productos
         return data
 
     def create(self, validated_data):
@@ -69,37 +79,70 @@ class OrdenSerializer(serializers.ModelSerializer):
         token = request.META.get('HTTP_AUTHORIZATION', '').split(' ')[1]
 
         detalles_datos = validated_data.pop('detalles_datos', [])
-        orden = Orden.objects.create(**validated_data)
-
-        total = 0
-        for detalle_dato in detalles_datos:
-            producto_id = detalle_dato['producto_id']
-            cantidad = detalle_dato['cantidad']
-
-            # Obtener datos actualizados del producto
-            producto_data = ProductosService.get_product(producto_id, token)
-
-            if producto_data:
-                # Usar el precio actual del producto
-                precio_actual = producto_data.get('precio', detalle_dato['precio_unitario'])
-                nombre_producto = producto_data.get('nombre', detalle_dato['producto_nombre'])
-
-                subtotal = cantidad * precio_actual
-
-                DetalleOrden.objects.create(
-                    orden=orden,
-                    producto_id=producto_id,
-                    producto_nombre=nombre_producto,
-                    cantidad=cantidad,
-                    precio_unitario=precio_actual,
-                    subtotal=subtotal
-                )
-
-                # Actualizar el stock del producto
-                ProductosService.update_product_stock(producto_id, cantidad, token)
 
-                total += subtotal
+        productos = getattr(self, '_productos', None)
+        if productos is None:
+            productos = ProductosService.get_products(
+                [detalle_dato['producto_id'] for detalle_dato in detalles_datos], token
+            )
+            if productos is None:
+                raise serializers.ValidationError(
+                    {"detalles_datos": "No se pudieron consultar los productos de la orden"}
+                )
 
-        orden.total = total
-        orden.save()
-        return orden
\ No newline at end of file
+        # Descontar el stock de toda la orden de una vez; si alguna línea no se puede cumplir
+        # (p. ej. otra orden se llevó el stock tras la validación) no se descuenta nada
+        reservado, resultado = ProductosService.reserve_stock(detalles_datos, token)
+        if not reservado:
+            raise serializers.ValidationError({"detalles_datos": self.reservation_error(resultado)})
+
+        try:
+            with transaction.atomic():
+                orden = Orden.objects.create(**validated_data)
+
+                total = 0
+                for detalle_dato in detalles_datos:
+                    producto_id = detalle_dato['producto_id']
+                    cantidad = detalle_dato['cantidad']
+
+                    # Datos del producto obtenidos durante la validación
+                    producto_data = productos.get(producto_id)
+
+                    if producto_data:
+                        # Usar el precio actual del producto
+                        precio_actual = Decimal(str(producto_data.get('precio', detalle_dato.get('precio_unitario'))))
+                        nombre_producto = producto_data.get('nombre', detalle_dato.get('producto_nombre'))
+
+                        subtotal = cantidad * precio_actual
+
+                        DetalleOrden.objects.create(
+                            orden=orden,
+                            producto_id=producto_id,
+                            producto_nombre=nombre_producto,
+                            cantidad=cantidad,
+                            precio_unitario=precio_actual,
+                            subtotal=subtotal
+                        )
+
+                        total += subtotal
+
+                orden.total = total
+                orden.save()
+        except Exception:
+            # La orden no se guardó: el stock reservado vuelve a productos
+            ProductosService.release_stock(detalles_datos, token)
+            raise
+        return orden
+
+    @staticmethod
+    def reservation_error(resultado):
+        if resultado is None:
+            return "No se pudo reservar el stock: el servicio de productos no está disponible"
+        if 'no_encontrados' not in resultado and 'sin_stock' not in resultado:
+            # Errores de validación de las líneas: se devuelven tal cual los dio productos
+            return resultado.get('items', resultado)
+        if resultado.get('no_encontrados'):
+            ids = ', '.join(map(str, resultado['no_encontrados']))
+            return f"Los productos con ID {ids} no existen"
+        ids = ', '.join(map(str, resultado.get('sin_stock', [])))
+        return f"Stock insuficiente para los productos con ID {ids}"
@@ -1,4 +1,5 @@
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 import logging
 
@@ -42,6 +43,65 @@ class ProductosService:
             logger.error(f"Error al comunicarse con el servicio de productos: {str(e)}")
             return None
 
+    @staticmethod
+    def get_products(product_ids, token):
+        """
+        Obtiene varios productos en una sola solicitud al endpoint productos/bulk/.
+        Devuelve {id: datos}, con None para los que no existen, o None si productos rechazó
+        la consulta o falló. Si el endpoint no existe (404/405) o el servicio no responde,
+        recurre a pedirlos uno a uno en paralelo
+        """
+        product_ids = list(dict.fromkeys(product_ids))
+        if not product_ids:
+            return {}
+
+        valid_ids = {}
+        for product_id in product_ids:
+            try:
+                valid_ids[product_id] = int(product_id)
+            except (TypeError, ValueError):
+                pass  # Un ID que no es entero no puede existir
+
+        url = f"{settings.PRODUCTOS_SERVICE_URL}productos/bulk/"
+        headers = {'Authorization': f'Bearer {token}'}
+
+        try:
+            response = requests.post(url, json={'ids': list(set(valid_ids.values()))}, headers=headers)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.warning(f"Consulta en bloque de productos no disponible, se piden uno a uno: {str(e)}")
+            return ProductosService.get_products_concurrently(product_ids, token)
+
+        if response.status_code in (404, 405):
+            # Servicio de productos sin productos/bulk/
+            logger.warning(f"Consulta en bloque de productos no disponible ({response.status_code}), se piden uno a uno")
+            return ProductosService.get_products_concurrently(product_ids, token)
+
+        try:
+            response.raise_for_status()
+            found = {product['id']: product for product in response.json()}
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Error al consultar productos en bloque: {str(e)}")
+            return None
+
+        return {
+            product_id: found.get(valid_ids[product_id]) if product_id in valid_ids else None
+            for product_id in product_ids
+        }
+
+    @staticmethod
+    def get_products_concurrently(product_ids, token):
+        """
+        Obtiene varios productos pidiendo cada ID distinto una sola vez, en paralelo.
+        Devuelve {id: datos}, con None para los que fallaron
+        """
+        product_ids = list(dict.fromkeys(product_ids))
+        if not product_ids:
+            return {}
+        workers = min(len(product_ids), getattr(settings, 'PRODUCTOS_SERVICE_MAX_WORKERS', 8))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda product_id: ProductosService.get_product(product_id, token), product_ids)
+            return dict(zip(product_ids, results))
+
     @staticmethod
     def verify_product_exists(product_id, token):
         """Verifica si un producto existe en el servicio de productos"""
@@ -59,30 +119,44 @@ class ProductosService:
         return product_data.get('stock', 0) >= quantity
 
     @staticmethod
-    def update_product_stock(product_id, quantity, token):
-        """Actualiza el stock de un producto después de una compra"""
-        product_data = ProductosService.get_product(product_id, token)
-
-        if not product_data:
-            return False
+    def stock_headers(token):
+        """Reservar y liberar stock son operaciones internas de productos: llevan también el token entre servicios"""
+        headers = {'Authorization': f'Bearer {token}'}
+        if settings.INTERNAL_SERVICE_TOKEN:
+            headers['X-Internal-Token'] = settings.INTERNAL_SERVICE_TOKEN
+        return headers
 
-        current_stock = product_data.get('stock', 0)
-        new_stock = current_stock - quantity
+    @staticmethod
+    def reserve_stock(items, token):
+        """
+        Descuenta en productos el stock de todas las líneas de una orden con una sola solicitud.
+        Devuelve (True, stock resultante) o (False, detalle del rechazo): los errores de validación
+        (400) o de stock (409) que devolvió productos, o None si el servicio no respondió o falló.
+        Si alguna línea no se puede cumplir no se descuenta nada
+        """
+        url = f"{settings.PRODUCTOS_SERVICE_URL}productos/reservar/"
+        data = {'items': [{'producto_id': item.get('producto_id'), 'cantidad': item.get('cantidad')} for item in items]}
 
-        if new_stock < 0:
-            return False
+        try:
+            response = requests.post(url, json=data, headers=ProductosService.stock_headers(token))
+            if response.status_code in (400, 409):
+                return False, response.json()
+            response.raise_for_status()
+            return True, response.json()
+        except requests.RequestException as e:
+            logger.error(f"Error al reservar stock: {str(e)}")
+            return False, None
 
-        url = f"{settings.PRODUCTOS_SERVICE_URL}productos/{product_id}/"
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        data = {'stock': new_stock}
+    @staticmethod
+    def release_stock(items, token):
+        """Devuelve al stock una reserva hecha con reserve_stock"""
+        url = f"{settings.PRODUCTOS_SERVICE_URL}productos/liberar/"
+        data = {'items': [{'producto_id': item.get('producto_id'), 'cantidad': item.get('cantidad')} for item in items]}
 
         try:
-            response = requests.patch(url, json=data, headers=headers)
+            response = requests.post(url, json=data, headers=ProductosService.stock_headers(token))
             response.raise_for_status()
             return True
         except requests.RequestException as e:
-            logger.error(f"Error al actualizar stock del producto {product_id}: {str(e)}")
-            return False
\ No newline at end of file
+            logger.error(f"Error al liberar stock: {str(e)}")
+            return False
@@ -1,3 +1,96 @@
-from django.test import TestCase
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from .serializers import OrdenSerializer
+from .services import ProductosService
+
+
+def fake_response(status_code, body):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode()
+    return response
+
+
+@override_settings(PRODUCTOS_SERVICE_URL='http://productos/api/', INTERNAL_SERVICE_TOKEN='token-interno')
+class ReservaStockTestCase(SimpleTestCase):
+    items = [{'producto_id': 1, 'cantidad': 2}]
+
+    @mock.patch('ordenes_app.services.requests.post')
+    def test_reserva_con_token_entre_servicios(self, post):
+        post.return_value = fake_response(200, [{'id': 1, 'stock': 3}])
+        self.assertEqual(ProductosService.reserve_stock(self.items, 'jwt'), (True, [{'id': 1, 'stock': 3}]))
+        headers = post.call_args.kwargs['headers']
+        self.assertEqual(headers['X-Internal-Token'], 'token-interno')
+        self.assertEqual(headers['Authorization'], 'Bearer jwt')
+
+    @mock.patch('ordenes_app.services.requests.post')
+    def test_sin_stock(self, post):
+        post.return_value = fake_response(409, {'detail': '...', 'no_encontrados': [], 'sin_stock': [1]})
+        reservado, resultado = ProductosService.reserve_stock(self.items, 'jwt')
+        self.assertFalse(reservado)
+        self.assertEqual(OrdenSerializer.reservation_error(resultado), "Stock insuficiente para los productos con ID 1")
+
+    @mock.patch('ordenes_app.services.requests.post')
+    def test_error_de_validacion_no_es_servicio_caido(self, post):
+        errores = {'items': [{'cantidad': ['Asegúrese de que este valor es mayor o igual a 1.']}]}
+        post.return_value = fake_response(400, errores)
+        reservado, resultado = ProductosService.reserve_stock(self.items, 'jwt')
+        self.assertFalse(reservado)
+        self.assertEqual(OrdenSerializer.reservation_error(resultado), errores['items'])
+
+    @mock.patch('ordenes_app.services.requests.post', side_effect=requests.ConnectionError)
+    def test_servicio_no_disponible(self, post):
+        with self.assertLogs('ordenes_app.services', 'ERROR'):
+            self.assertEqual(ProductosService.reserve_stock(self.items, 'jwt'), (False, None))
+        self.assertIn("no está disponible", OrdenSerializer.reservation_error(None))
+
+
+@override_settings(PRODUCTOS_SERVICE_URL='http://productos/api/', PRODUCTOS_SERVICE_MAX_WORKERS=8)
+class GetProductsTestCase(SimpleTestCase):
+    @mock.patch('ordenes_app.services.requests.post')
+    def test_una_sola_solicitud_en_bloque(self, post):
+        post.return_value = fake_response(200, [{'id': 1, 'stock': 3}, {'id': 2, 'stock': 0}])
+        productos = ProductosService.get_products([2, 1, 2, '1', 5, 'x'], 'jwt')
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(sorted(post.call_args.kwargs['json']['ids']), [1, 2, 5])
+        self.assertEqual(productos, {
+            2: {'id': 2, 'stock': 0}, 1: {'id': 1, 'stock': 3}, '1': {'id': 1, 'stock': 3}, 5: None, 'x': None,
+        })
+
+    @mock.patch('ordenes_app.services.ProductosService.get_products_concurrently', return_value={1: None})
+    @mock.patch('ordenes_app.services.requests.post')
+    def test_sin_endpoint_en_bloque_se_piden_uno_a_uno(self, post, concurrently):
+        for respuesta in (fake_response(404, {}), fake_response(405, {}), requests.ConnectionError()):
+            post.side_effect = [respuesta]
+            concurrently.reset_mock()
+            with self.assertLogs('ordenes_app.services', 'WARNING'):
+                self.assertEqual(ProductosService.get_products([1], 'jwt'), {1: None})
+            concurrently.assert_called_once_with([1], 'jwt')
+
+    @mock.patch('ordenes_app.services.ProductosService.get_products_concurrently')
+    @mock.patch('ordenes_app.services.requests.post')
+    def test_otros_errores_no_se_reintentan_uno_a_uno(self, post, concurrently):
+        for status_code in (400, 401, 403, 500):
+            post.return_value = fake_response(status_code, {'detail': 'error'})
+            with self.assertLogs('ordenes_app.services', 'ERROR'):
+                self.assertIsNone(ProductosService.get_products([1], 'jwt'))
+        concurrently.assert_not_called()
+
+    @mock.patch('ordenes_app.services.ProductosService.get_product')
+    def test_consulta_concurrente(self, get_product):
+        """Cada ID distinto se pide una sola vez, y todas las consultas están en curso a la vez"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def get(product_id, token):
+            barrier.wait()
+            return None if product_id == 3 else {'id': product_id}
+
+        get_product.side_effect = get
+        productos = ProductosService.get_products_concurrently([1, 2, 1, 3, 2], 'jwt')
+        self.assertEqual(productos, {1: {'id': 1}, 2: {'id': 2}, 3: None})
+        self.assertEqual(sorted(call.args[0] for call in get_product.call_args_list), [1, 2, 3])
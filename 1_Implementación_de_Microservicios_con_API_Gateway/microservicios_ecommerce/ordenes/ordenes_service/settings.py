@@ -13,6 +13,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',  # El gateway reenvía el cuerpo comprimido sin recomprimir
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -140,6 +143,26 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Misma clave JWT que el gateway (ver api-gateway/api_gateway/settings.py)
+JWT_SIGNING_KEY = os.environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured('La variable de entorno JWT_SIGNING_KEY es obligatoria con DEBUG desactivado')
+    JWT_SIGNING_KEY = 'django-insecure-jwt-desarrollo-compartida-0b7f3c9e1d54a2f86c3e9b17d04a5f2e'
+
+# Este servicio solo verifica tokens; los emite el servicio de usuarios
+SIMPLE_JWT = {
+    'SIGNING_KEY': JWT_SIGNING_KEY,
+}
+
 # URLs de servicios para comunicación entre microservicios
 USUARIOS_SERVICE_URL = 'http://localhost:8001/api/'
-PRODUCTOS_SERVICE_URL = 'http://localhost:8002/api/'
\ No newline at end of file
+PRODUCTOS_SERVICE_URL = 'http://localhost:8002/api/'
+
+# Consultas simultáneas al servicio de productos cuando productos/bulk/ no está disponible
+PRODUCTOS_SERVICE_MAX_WORKERS = 8
+
+# Token compartido entre servicios para las operaciones internas de stock (cabecera X-Internal-Token)
+INTERNAL_SERVICE_TOKEN = os.environ.get('INTERNAL_SERVICE_TOKEN')
+if not INTERNAL_SERVICE_TOKEN and not DEBUG:
+    raise ImproperlyConfigured('La variable de entorno INTERNAL_SERVICE_TOKEN es obligatoria con DEBUG desactivado')
@@ -0,0 +1,19 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IsInternalService(BasePermission):
+    """
+    Solo llamadas de otros servicios: la solicitud debe traer la cabecera X-Internal-Token con
+    el valor de INTERNAL_SERVICE_TOKEN. El gateway no reenvía esa cabecera
+    """
+    message = "Esta operación solo está disponible entre servicios"
+
+    def has_permission(self, request, view):
+        expected = getattr(settings, 'INTERNAL_SERVICE_TOKEN', None)
+        if not expected:
+            return False
+        received = request.headers.get('X-Internal-Token', '')
+        return hmac.compare_digest(received.encode(), expected.encode())
@@ -18,4 +18,23 @@ class ProductoSerializer(serializers.ModelSerializer):
             'precio', 'stock','categoria',
             'categoria_nombre', 'fecha_creacion',
             'fecha_actualizacion'
-        ]
\ No newline at end of file
+        ]
+
+class ProductoIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), max_length=1000)
+
+
+class LineaStockSerializer(serializers.Serializer):
+    producto_id = serializers.IntegerField()
+    cantidad = serializers.IntegerField(min_value=1)
+
+
+class ReservaStockSerializer(serializers.Serializer):
+    items = LineaStockSerializer(many=True, allow_empty=False, max_length=1000)
+
+    def validate_items(self, items):
+        """Suma las cantidades de las líneas que repiten producto: {producto_id: cantidad}"""
+        cantidades = {}
+        for item in items:
+            cantidades[item['producto_id']] = cantidades.get(item['producto_id'], 0) + item['cantidad']
+        return cantidades
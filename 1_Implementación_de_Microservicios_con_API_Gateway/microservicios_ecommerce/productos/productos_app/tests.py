@@ -1,3 +1,122 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .models import Categoria, Producto
+
+
+class ConsultaPorIdsTestCase(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre='Libros')
+        self.productos = [
+            Producto.objects.create(nombre=f'Libro {n}', descripcion='', precio=Decimal('10.00'), stock=n, categoria=categoria)
+            for n in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=User(id=1, username='ordenes'))
+
+    def ids(self, response):
+        return sorted(producto['id'] for producto in response.json())
+
+    def test_filtro_ids(self):
+        primero, _, tercero = self.productos
+        response = self.client.get(f'/api/productos/?ids={primero.id},{tercero.id},999999')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids(response), [primero.id, tercero.id])
+        self.assertEqual(response.json()[0]['categoria_nombre'], 'Libros')
+
+    def test_filtro_ids_no_valido(self):
+        response = self.client.get('/api/productos/?ids=1,dos')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', response.json())
+
+    def test_bulk(self):
+        ids = [producto.id for producto in self.productos]
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/productos/bulk/', {'ids': ids + [999999]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids(response), ids)
+
+    def test_bulk_no_valido(self):
+        self.assertEqual(self.client.post('/api/productos/bulk/', {'ids': ['x']}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/productos/bulk/', {}, format='json').status_code, 400)
+
+
+@override_settings(INTERNAL_SERVICE_TOKEN='token-interno')
+class ReservaStockTestCase(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre='Libros')
+        self.libro = Producto.objects.create(
+            nombre='Libro', descripcion='', precio=Decimal('10.00'), stock=5, categoria=categoria
+        )
+        self.lapiz = Producto.objects.create(
+            nombre='Lápiz', descripcion='', precio=Decimal('1.00'), stock=1, categoria=categoria
+        )
+        self.client = APIClient(headers={'X-Internal-Token': 'token-interno'})
+
+    def reservar(self, *items, accion='reservar'):
+        data = {'items': [{'producto_id': producto_id, 'cantidad': cantidad} for producto_id, cantidad in items]}
+        return self.client.post(f'/api/productos/{accion}/', data, format='json')
+
+    def stock(self, producto):
+        producto.refresh_from_db()
+        return producto.stock
+
+    def test_reserva_descuenta_el_stock(self):
+        response = self.reservar((self.libro.id, 2), (self.lapiz.id, 1), (self.libro.id, 1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'id': self.libro.id, 'stock': 2},
+            {'id': self.lapiz.id, 'stock': 0},
+        ])
+        self.assertEqual(self.stock(self.libro), 2)
+        self.assertEqual(self.stock(self.lapiz), 0)
+
+    def test_el_stock_nunca_queda_en_negativo(self):
+        """El UPDATE solo se aplica si en ese momento stock >= cantidad, aunque la orden se validara antes"""
+        self.assertEqual(self.reservar((self.libro.id, 3)).status_code, 200)
+        response = self.reservar((self.libro.id, 3))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['sin_stock'], [self.libro.id])
+        self.assertEqual(self.stock(self.libro), 2)
+
+    def test_rechazo_no_descuenta_ninguna_linea(self):
+        response = self.reservar((self.libro.id, 2), (self.lapiz.id, 5), (999999, 1))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {
+            'detail': 'No se pudo reservar el stock de la orden',
+            'no_encontrados': [999999],
+            'sin_stock': [self.lapiz.id],
+        })
+        # La línea del libro sí cabía, pero la transacción se revierte entera
+        self.assertEqual(self.stock(self.libro), 5)
+        self.assertEqual(self.stock(self.lapiz), 1)
+
+    def test_lineas_no_validas(self):
+        response = self.reservar((self.libro.id, 0))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('items', response.json())
+        self.assertEqual(self.stock(self.libro), 5)
+
+    def test_liberar_devuelve_el_stock(self):
+        self.reservar((self.libro.id, 4))
+        response = self.reservar((self.libro.id, 4), accion='liberar')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(self.libro), 5)
+
+    def test_solo_entre_servicios(self):
+        """Un cliente autenticado no puede mover stock: hace falta el token entre servicios"""
+        cliente = User.objects.create_user(username='cliente', password='clave-cliente')
+        for headers in ({}, {'X-Internal-Token': 'otro'}):
+            client = APIClient(headers=headers)
+            client.force_authenticate(user=cliente)
+            for accion in ('reservar', 'liberar'):
+                response = client.post(
+                    f'/api/productos/{accion}/',
+                    {'items': [{'producto_id': self.libro.id, 'cantidad': 1}]},
+                    format='json',
+                )
+                self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.stock(self.libro), 5)
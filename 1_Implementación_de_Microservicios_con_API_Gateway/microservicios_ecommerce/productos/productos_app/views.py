@@ -1,8 +1,14 @@
-from rest_framework import viewsets
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
 from .models import Producto, Categoria
-from .serializers import ProductoSerializer, CategoriaSerializer
+from .permissions import IsInternalService
+from .serializers import ProductoSerializer, CategoriaSerializer, ProductoIdsSerializer, ReservaStockSerializer
 
 # Create your views here.
 class CategoriaViewSet(viewsets.ModelViewSet):
@@ -17,8 +23,80 @@ class ProductoViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        queryset = Producto.objects.all()
+        # categoria_nombre se lee de la categoría: se trae en la misma consulta
+        queryset = Producto.objects.select_related('categoria')
         categoria = self.request.query_params.get('categoria')
         if categoria:
             queryset = queryset.filter(categoria__id=categoria)
-        return queryset
\ No newline at end of file
+        ids = self.request.query_params.get('ids')
+        if ids is not None:
+            queryset = queryset.filter(id__in=self.parse_ids(ids))
+        return queryset
+
+    @staticmethod
+    def parse_ids(ids):
+        """'1,2,3' -> [1, 2, 3]"""
+        try:
+            return [int(producto_id) for producto_id in ids.split(',') if producto_id.strip()]
+        except ValueError:
+            raise serializers.ValidationError({"ids": "Debe ser una lista de IDs separados por comas"})
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Varios productos en una sola consulta, para listas de IDs demasiado largas para ?ids="""
+        serializer = ProductoIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.get_queryset().filter(id__in=serializer.validated_data['ids'])
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsInternalService])
+    def reservar(self, request):
+        """
+        Descuenta el stock de varios productos en una sola transacción. Cada línea es un UPDATE
+        condicional (stock >= cantidad), así que dos órdenes simultáneas nunca dejan el stock en
+        negativo ni se pisan. Si alguna línea no se puede cumplir no se descuenta nada
+        """
+        serializer = ReservaStockSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cantidades = serializer.validated_data['items']
+
+        with transaction.atomic():
+            # Siempre en el mismo orden para que dos reservas que se cruzan no se bloqueen mutuamente
+            fallidos = [
+                producto_id for producto_id in sorted(cantidades)
+                if not Producto.objects.filter(id=producto_id, stock__gte=cantidades[producto_id]).update(
+                    stock=F('stock') - cantidades[producto_id], fecha_actualizacion=timezone.now()
+                )
+            ]
+            if fallidos:
+                transaction.set_rollback(True)
+
+        if fallidos:
+            existentes = set(Producto.objects.filter(id__in=fallidos).values_list('id', flat=True))
+            return Response({
+                "detail": "No se pudo reservar el stock de la orden",
+                "no_encontrados": [producto_id for producto_id in fallidos if producto_id not in existentes],
+                "sin_stock": [producto_id for producto_id in fallidos if producto_id in existentes],
+            }, status=status.HTTP_409_CONFLICT)
+        return Response(self.stock_actual(cantidades))
+
+    @action(detail=False, methods=['post'], permission_classes=[IsInternalService])
+    def liberar(self, request):
+        """Devuelve al stock una reserva anterior (p. ej. si la orden no llegó a guardarse)"""
+        serializer = ReservaStockSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cantidades = serializer.validated_data['items']
+
+        with transaction.atomic():
+            for producto_id in sorted(cantidades):
+                Producto.objects.filter(id=producto_id).update(
+                    stock=F('stock') + cantidades[producto_id], fecha_actualizacion=timezone.now()
+                )
+        return Response(self.stock_actual(cantidades))
+
+    @staticmethod
+    def stock_actual(cantidades):
+        return [
+            {"id": producto_id, "stock": stock}
+            for producto_id, stock in Producto.objects.filter(id__in=cantidades).order_by('id').values_list('id', 'stock')
+        ]
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,7 +47,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',  # El gateway reenvía el cuerpo comprimido sin recomprimir
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',  # ETag / If-None-Match para la caché del gateway
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -140,6 +145,23 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Misma clave JWT que el gateway (ver api-gateway/api_gateway/settings.py)
+JWT_SIGNING_KEY = os.environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured('La variable de entorno JWT_SIGNING_KEY es obligatoria con DEBUG desactivado')
+    JWT_SIGNING_KEY = 'django-insecure-jwt-desarrollo-compartida-0b7f3c9e1d54a2f86c3e9b17d04a5f2e'
+
+# Este servicio solo verifica tokens; los emite el servicio de usuarios
+SIMPLE_JWT = {
+    'SIGNING_KEY': JWT_SIGNING_KEY,
+}
+
 # URLs de servicios para comunicación entre microservicios
 USUARIOS_SERVICE_URL = 'http://localhost:8001/api/'
-ORDENES_SERVICE_URL = 'http://localhost:8003/api/'
\ No newline at end of file
+ORDENES_SERVICE_URL = 'http://localhost:8003/api/'
+
+# Token compartido entre servicios para las operaciones internas de stock (cabecera X-Internal-Token)
+INTERNAL_SERVICE_TOKEN = os.environ.get('INTERNAL_SERVICE_TOKEN')
+if not INTERNAL_SERVICE_TOKEN and not DEBUG:
+    raise ImproperlyConfigured('La variable de entorno INTERNAL_SERVICE_TOKEN es obligatoria con DEBUG desactivado')
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -142,6 +146,20 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Misma clave JWT que el gateway (ver api-gateway/api_gateway/settings.py)
+JWT_SIGNING_KEY = os.environ.get('JWT_SIGNING_KEY')
+if not JWT_SIGNING_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured('La variable de entorno JWT_SIGNING_KEY es obligatoria con DEBUG desactivado')
+    JWT_SIGNING_KEY = 'django-insecure-jwt-desarrollo-compartida-0b7f3c9e1d54a2f86c3e9b17d04a5f2e'
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'ROTATE_REFRESH_TOKENS': True,
+    'SIGNING_KEY': JWT_SIGNING_KEY,
+}
+
 # URLs de servicios para comunicación entre microservicios
 PRODUCTOS_SERVICE_URL = 'http://localhost:8002/api/'
 ORDENES_SERVICE_URL = 'http://localhost:8003/api/'
\ No newline at end of file